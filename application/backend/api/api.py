@@ -1,10 +1,17 @@
+import asyncio
+import json
 import logging
 import os
+import time
+from contextlib import asynccontextmanager
 from operator import itemgetter
-from application.backend.chatbot.chatbot import Chatbot, Message, Conversation
-from application.backend.chatbot.history import PostgresChatMessageHistory
+from typing import Optional
+from application.backend.chatbot.admission import AdmissionRejected
+from application.backend.chatbot.chatbot import Chatbot, Message, Conversation, BatchRequest, HistoryPage
+from application.backend.metrics import render_metrics
 from dotenv import find_dotenv, load_dotenv
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from sse_starlette.sse import EventSourceResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
@@ -12,15 +19,62 @@ from pydantic import BaseModel, Field
 
 load_dotenv(find_dotenv())
 
-bot = Chatbot()
-
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
 origins = ["http://localhost:3000"]
 
-app = FastAPI()
+RETRY_AFTER_SECONDS = 5
+STARTUP_RETRY_MAX_SECONDS = 60
+
+
+async def start_chatbot(app: FastAPI):
+    """
+    Connect to the databases in the background, retrying until it succeeds.
+    The API serves /test and /ready in the meantime, so the container is up before its dependencies are.
+    """
+    started_at = time.perf_counter()
+    delay = 1
+    while True:
+        try:
+            app.state.bot = await Chatbot.create()
+            logger.info(f"Chatbot ready after {time.perf_counter() - started_at:.2f}s")
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:
+            # Chatbot.create closed the connections and threads it had started, so attempts do not pile them up
+            app.state.startup_error = f"{type(error).__name__}: {error}"
+            logger.exception(f"Could not start the chatbot, retrying in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, STARTUP_RETRY_MAX_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.bot = None
+    app.state.startup_error = None
+    startup = asyncio.create_task(start_chatbot(app))
+    yield
+    startup.cancel()
+    if app.state.bot is not None:
+        # Turns are written to the history in the background, write the queued ones before the process exits
+        await asyncio.to_thread(app.state.bot.close)
+
+
+def get_bot(request: Request) -> Chatbot:
+    bot = getattr(request.app.state, "bot", None)
+    if bot is None:
+        raise HTTPException(
+            status_code=503,
+            detail="The chatbot is starting, please try again in a moment.",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
+    return bot
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -39,6 +93,20 @@ class Feedback(BaseModel):
         ..., description="The classification of the feedback"
     )
     feedback_text: str = Field(..., description="The detailed feedback text")
+    message_id: Optional[str] = Field(
+        default=None, description="The message id of the rated answer, omitted for feedback on the whole session"
+    )
+
+
+@app.exception_handler(AdmissionRejected)
+async def overloaded(request: Request, error: AdmissionRejected):
+    # The LLM deployment is saturated, tell the client to come back instead of letting it wait
+    logger.warning(f"Rejected {request.url.path}: {error}")
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The chatbot is busy right now, please try again in a moment."},
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+    )
 
 
 @app.get("/test")
@@ -46,10 +114,24 @@ async def test():
     return {"test": "works"}
 
 
+@app.get("/ready")
+async def ready(request: Request):
+    if getattr(request.app.state, "bot", None) is None:
+        return JSONResponse(
+            status_code=503,
+            content={"ready": False, "error": getattr(request.app.state, "startup_error", None)},
+        )
+    return {"ready": True}
+
+
+@app.get("/metrics")
+async def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
 @app.post("/conversation")
-async def ask_question(question: str, conversation: Conversation) -> dict:
-    print(question)
-    print(conversation)
+def ask_question(question: str, conversation: Conversation, bot: Chatbot = Depends(get_bot)) -> dict:
     answer = bot.chat(
         question=question,
         conversation=conversation,
@@ -59,29 +141,60 @@ async def ask_question(question: str, conversation: Conversation) -> dict:
     return {"answer": answer}
 
 
+@app.post("/conversation/batch")
+async def ask_questions(batch: BatchRequest, bot: Chatbot = Depends(get_bot)):
+    async def results():
+        async for result in bot.chat_batch(batch.items, concurrency=batch.concurrency):
+            yield f"{json.dumps(result)}\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
 @app.post("/chat_stream/")
-async def chat_stream_endpoint(question: str, conversation: Conversation):
-    return EventSourceResponse(
-        bot.chat_stream(
-            question=question,
-            conversation=conversation,
-            study_program=conversation.study_program,
-        ),
-        media_type="text/event-stream",
+async def chat_stream_endpoint(question: str, conversation: Conversation, bot: Chatbot = Depends(get_bot)):
+    stream = bot.chat_stream(
+        question=question,
+        conversation=conversation,
+        study_program=conversation.study_program,
     )
+    # Wait for the first event before responding, so a rejected question still gets a 503 instead of an empty stream
+    first_event = await anext(stream)
+
+    async def events():
+        yield first_event
+        async for event in stream:
+            yield event
+
+    return EventSourceResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/history/{session_id}")
+def read_history(
+    session_id: str,
+    before: Optional[int] = None,
+    limit: int = Query(default=50, ge=1, le=200),
+    bot: Chatbot = Depends(get_bot),
+) -> HistoryPage:
+    return bot.history_page(session_id, before=before, limit=limit)
 
 
 @app.post("/feedback")
-async def send_feedback(feedback: Feedback):
+def send_feedback(feedback: Feedback, bot: Chatbot = Depends(get_bot)):
     logger.info(f"Feedback received: {feedback}")
-    history = PostgresChatMessageHistory(feedback.uuid)
-    history.add_feedback_to_message(
+    accepted = bot.record_feedback(
+        session_id=feedback.uuid,
+        message_id=feedback.message_id,
+        classification=feedback.feedback_classification,
         feedback=feedback.feedback_text,
-        feedback_classification=feedback.feedback_classification,
     )
+    if not accepted:
+        return JSONResponse(
+            status_code=503,
+            content={"detail": "Feedback cannot be stored right now, please try again in a moment."},
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
     return {"message": "Feedback received successfully"}
 
-
 if __name__ == "__main__":
     os.environ["APP_PATH"] = "../.."
     uvicorn.run(app, host="0.0.0.0", port=8000)
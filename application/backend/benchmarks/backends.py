@@ -0,0 +1,96 @@
+"""
+Run the same import and search workload against each vector store backend and report throughput and latency.
+The curated QA answers are imported as chunks into a temporary collection, the questions are used as queries.
+
+Usage: python -m application.backend.benchmarks.backends [--backends local weaviate] [--copies 20]
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+
+from application.backend.benchmarks.local_search import load_queries, report
+from application.backend.datastore.backends import LocalBackend, VectorStoreBackend, WeaviateBackend
+from application.backend.datastore.collections.main.local_index import azure_embeddings
+from application.backend.datastore.collections.main.main_data import MainDataCollection
+from application.backend.datastore.collections.main.schema import Chunk
+
+
+def make_chunks(copies: int) -> list[Chunk]:
+    """
+    Build a synthetic corpus from the curated answers, repeated to reach a realistic size.
+    """
+    chunks = []
+    for copy in range(copies):
+        for question, program, language in load_queries():
+            chunks.append(Chunk(
+                text=f"{question} ({copy})",
+                faculty=None,
+                target_groups=[],
+                topic=None,
+                subtopic=None,
+                title=question[:50],
+                degree_programs=[program] if copy % 2 else [],
+                languages=[language],
+                hash=f"benchmark-{copy}",
+                url="https://example.com",
+            ))
+    return chunks
+
+
+def create_backend(name: str) -> tuple[VectorStoreBackend, callable]:
+    """
+    Create an empty backend of the given type and a function that removes it again.
+    """
+    collection_name = f"Benchmark{uuid.uuid4().hex}"
+    if name == "local":
+        directory = tempfile.TemporaryDirectory()
+        backend = LocalBackend(collection_name, Chunk.TEXT, azure_embeddings(), os.path.join(directory.name, "db"))
+        return backend, lambda: (backend.close(), directory.cleanup())
+
+    import weaviate
+    import application.backend.datastore.collections.main.schema as main_schema
+
+    client = weaviate.connect_to_wcs(
+        cluster_url=os.getenv("WCS_URL"),
+        auth_credentials=weaviate.auth.AuthApiKey(os.getenv("WEAVIATE_API_KEY")),
+        headers={"X-Azure-Api-Key": os.getenv("AZURE_OPENAI_API_KEY")},
+    )
+    backend = WeaviateBackend(main_schema.create_collection_if_not_exists(client, collection_name))
+    return backend, lambda: (client.collections.delete(collection_name), client.close())
+
+
+def benchmark(name: str, chunks: list[Chunk], queries: list[tuple[str, str, str]]):
+    backend, cleanup = create_backend(name)
+    try:
+        main = MainDataCollection(backend, local_search=False)
+        start = time.perf_counter()
+        main.import_chunks(chunks)
+        duration = time.perf_counter() - start
+        print(f"{name:>10}: imported {len(chunks)} chunks at {len(chunks) / duration:.1f} chunks/s")
+
+        latencies = []
+        for question, program, language in queries:
+            start = time.perf_counter()
+            main.search(question, k=3, degree_programs={program}, language=language)
+            latencies.append(time.perf_counter() - start)
+        report(name, latencies)
+    finally:
+        cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--backends", nargs="+", default=["local", "weaviate"], choices=["local", "weaviate"])
+    parser.add_argument("--copies", type=int, default=20, help="How often the curated corpus is repeated")
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.copies)
+    queries = load_queries()
+    for name in args.backends:
+        benchmark(name, chunks, queries)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Compare session lookups on the unpartitioned, unindexed history table with the partitioned and indexed schema.
+
+Both tables are filled with the same synthetic turns spread over the last months, then the messages of random
+sessions are read and rated the way the chatbot and the feedback endpoint do it.
+The tables are created under temporary names and dropped afterwards.
+
+Usage: python -m application.backend.benchmarks.history [--rows 2000000] [--sessions 200000] [--months 12]
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import psycopg
+from psycopg import sql
+
+from application.backend.benchmarks.local_search import report
+from application.backend.chatbot.history_schema import create_schema, ensure_partitions
+
+LEGACY_TABLE = "benchmark_history_legacy"
+PARTITIONED_TABLE = "benchmark_history_partitioned"
+
+
+def create_legacy(connection: psycopg.Connection):
+    connection.execute(sql.SQL("""CREATE TABLE {} (
+        id SERIAL PRIMARY KEY,
+        session_id TEXT NOT NULL,
+        message JSONB NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        feedback_classification TEXT DEFAULT NULL,
+        feedback TEXT DEFAULT NULL
+    );""").format(sql.Identifier(LEGACY_TABLE)))
+
+
+def fill(connection: psycopg.Connection, table_name: str, rows: int, sessions: int, months: int):
+    """
+    Insert `rows` messages of `sessions` sessions, ordered by time like the chatbot writes them.
+    """
+    seconds = months * 30 * 24 * 3600
+    start = time.perf_counter()
+    connection.execute(sql.SQL("""
+        INSERT INTO {} (session_id, message, created_at)
+        SELECT 'session-' || (i % %(sessions)s),
+               jsonb_build_object('type', 'human', 'data', jsonb_build_object('content', 'Question ' || i)),
+               NOW() - make_interval(secs => %(seconds)s * (1 - i::float / %(rows)s))
+        FROM generate_series(1, %(rows)s) AS i;
+    """).format(sql.Identifier(table_name)), {"rows": rows, "sessions": sessions, "seconds": seconds})
+    connection.execute(sql.SQL("ANALYZE {};").format(sql.Identifier(table_name)))
+    print(f"Filled {table_name} with {rows} rows in {time.perf_counter() - start:.1f}s")
+
+
+def run_lookups(connection: psycopg.Connection, table_name: str, session_ids: list[str]) -> dict[str, list[float]]:
+    table = sql.Identifier(table_name)
+    read = sql.SQL("SELECT message FROM {} WHERE session_id = %s ORDER BY id;").format(table)
+    feedback = sql.SQL("UPDATE {} SET feedback = %s, feedback_classification = %s WHERE session_id = %s;").format(table)
+    latencies = {"read": [], "feedback": []}
+    for session_id in session_ids:
+        start = time.perf_counter()
+        connection.execute(read, (session_id,)).fetchall()
+        latencies["read"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        connection.execute(feedback, ("benchmark", "positive", session_id))
+        latencies["feedback"].append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    from application.backend.chatbot.history import conn_string
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--dsn", default=conn_string, help="Connection string of the database to benchmark")
+    parser.add_argument("--rows", type=int, default=2_000_000, help="Number of messages in the history")
+    parser.add_argument("--sessions", type=int, default=200_000, help="Number of sessions the messages belong to")
+    parser.add_argument("--months", type=int, default=12, help="Number of months the messages are spread over")
+    parser.add_argument("--lookups", type=int, default=200, help="Number of sessions to look up")
+    args = parser.parse_args()
+
+    session_ids = [f"session-{random.randrange(args.sessions)}" for _ in range(args.lookups)]
+    with psycopg.connect(args.dsn, autocommit=True) as connection:
+        try:
+            create_legacy(connection)
+            create_schema(connection, PARTITIONED_TABLE, legacy_table=None)
+            first_month = (datetime.now(timezone.utc) - timedelta(days=args.months * 30 + 31)).date()
+            ensure_partitions(connection, PARTITIONED_TABLE, start=first_month)
+            for table_name in (LEGACY_TABLE, PARTITIONED_TABLE):
+                fill(connection, table_name, args.rows, args.sessions, args.months)
+            for table_name in (LEGACY_TABLE, PARTITIONED_TABLE):
+                print(f"{table_name}:")
+                for name, latencies in run_lookups(connection, table_name, session_ids).items():
+                    report(name, latencies)
+        finally:
+            for table_name in (LEGACY_TABLE, PARTITIONED_TABLE):
+                connection.execute(sql.SQL("DROP TABLE IF EXISTS {} CASCADE;").format(sql.Identifier(table_name)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Compare the recall and latency of the in-process hybrid search replica against the hybrid search in Weaviate.
+Weaviate's results are used as the reference for recall.
+
+Usage: python -m application.backend.benchmarks.local_search [--k 3] [--rounds 3]
+"""
+import argparse
+import csv
+import os
+import statistics
+import time
+
+from application.backend.datastore.db import ChatbotVectorDatabase
+
+QA_PAIRS_CSV = os.path.join(os.path.dirname(__file__), "..", "datastore", "qa_pairs", "cleaned_questions_answers.csv")
+
+
+def load_queries() -> list[tuple[str, str, str]]:
+    """
+    Use the curated questions as benchmark queries.
+    :return: A list of (question, program, language) tuples
+    """
+    with open(QA_PAIRS_CSV, mode="r", encoding="utf-8") as file:
+        return [(row["question"], row["program"], row["language"]) for row in csv.DictReader(file)]
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def report(name: str, latencies: list[float]):
+    print(f"{name:>10}: p50 {percentile(latencies, 0.5) * 1000:8.2f}ms  "
+          f"p95 {percentile(latencies, 0.95) * 1000:8.2f}ms  "
+          f"mean {statistics.mean(latencies) * 1000:8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--k", type=int, default=3, help="Number of chunks to retrieve per query")
+    parser.add_argument("--rounds", type=int, default=3, help="Number of times each query is repeated")
+    args = parser.parse_args()
+
+    db = ChatbotVectorDatabase()
+    main_data = db.main
+    if main_data.local_index is None:
+        main_data.refresh_local_index()
+    queries = load_queries()
+    print(f"Benchmarking {len(queries)} queries x {args.rounds} rounds against {len(main_data.local_index)} chunks")
+
+    weaviate_latencies, local_latencies, recalls = [], [], []
+    for _ in range(args.rounds):
+        for question, program, language in queries:
+            start = time.perf_counter()
+            expected = main_data.search_backend(question, k=args.k, degree_programs={program}, language=language)
+            weaviate_latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            actual = main_data.local_index.search(question, k=args.k, degree_programs={program}, language=language)
+            local_latencies.append(time.perf_counter() - start)
+
+            expected_ids = {chunk.uuid for chunk in expected}
+            if expected_ids:
+                recalls.append(len(expected_ids & {chunk.uuid for chunk in actual}) / len(expected_ids))
+
+    report("weaviate", weaviate_latencies)
+    report("local", local_latencies)
+    print(f"recall@{args.k} of local against weaviate: {statistics.mean(recalls):.3f}")
+
+
+if __name__ == "__main__":
+    main()
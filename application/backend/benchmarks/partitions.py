@@ -0,0 +1,107 @@
+"""
+Compare the latency and recall of searches in one filtered collection against the collection partitioned per
+degree program and language. The filtered collection's results are the reference for recall.
+
+- local (default): both layouts on the embedded backend with a synthetic corpus, no services needed
+- weaviate: the chunks of the main collection are copied into temporary partitions in the cluster,
+  which vectorizes them again, and the curated questions are used as queries. The partitions are deleted afterwards
+
+Usage: python -m application.backend.benchmarks.partitions [--backend local] [--chunks 20000] [--k 8]
+"""
+import argparse
+import random
+import statistics
+import time
+from typing import Callable
+
+from application.backend.benchmarks.local_search import load_queries, report
+from application.backend.benchmarks.workers import LANGUAGES, PROGRAMS, WORDS, snapshot
+from application.backend.datastore.backends import LocalBackend, PartitionedBackend, WeaviateBackend
+from application.backend.datastore.collections.main.local_index import HashEmbeddings
+from application.backend.datastore.collections.main.main_data import MainDataCollection
+from application.backend.datastore.collections.main.schema import Chunk
+
+BENCHMARK_COLLECTION_NAME = "BenchmarkChatbotData"
+
+
+def local_layouts(chunks: int) -> tuple[MainDataCollection, MainDataCollection, list[tuple[str, str, str]]]:
+    embeddings = HashEmbeddings()
+    filtered = MainDataCollection(LocalBackend("Filtered", Chunk.TEXT, embeddings))
+    partitioned = MainDataCollection(PartitionedBackend(
+        "Partitioned", lambda name: LocalBackend(name, Chunk.TEXT, embeddings), lambda: [],
+        Chunk.DEGREE_PROGRAMS, Chunk.LANGUAGES,
+    ))
+    corpus = [chunk for chunk, _ in snapshot(chunks)]
+    for main in (filtered, partitioned):
+        main.import_chunks(corpus)
+    rng = random.Random(1)
+    queries = [(" ".join(rng.choices(WORDS, k=6)), rng.choice(PROGRAMS), rng.choice(LANGUAGES)) for _ in range(200)]
+    return filtered, partitioned, queries
+
+
+def weaviate_layouts() -> tuple[MainDataCollection, MainDataCollection, list[tuple[str, str, str]], Callable]:
+    import application.backend.datastore.collections.main.schema as main_schema
+    from application.backend.datastore.db import ChatbotVectorDatabase
+
+    db = ChatbotVectorDatabase(backend="weaviate", partitioned=False)
+    client = db.client
+    backend = PartitionedBackend(
+        BENCHMARK_COLLECTION_NAME,
+        lambda name: WeaviateBackend(main_schema.create_collection_if_not_exists(client, name)),
+        lambda: client.collections.list_all(simple=True).keys(),
+        Chunk.DEGREE_PROGRAMS, Chunk.LANGUAGES,
+    )
+    partitioned = MainDataCollection(backend)
+    partitioned.import_chunks([chunk for chunk, _ in db.main.snapshot()])
+
+    def cleanup():
+        for name in backend.list_partitions():
+            if name.startswith(f"{BENCHMARK_COLLECTION_NAME}_"):
+                client.collections.delete(name)
+
+    return db.main, partitioned, load_queries(), cleanup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["local", "weaviate"], default="local", help="The vector store to use")
+    parser.add_argument("--chunks", type=int, default=20_000, help="Number of synthetic chunks of the local corpus")
+    parser.add_argument("--k", type=int, default=8, help="Number of chunks to retrieve per query")
+    parser.add_argument("--rounds", type=int, default=3, help="Number of times each query is repeated")
+    args = parser.parse_args()
+
+    cleanup = None
+    if args.backend == "local":
+        filtered, partitioned, queries = local_layouts(args.chunks)
+    else:
+        filtered, partitioned, queries, cleanup = weaviate_layouts()
+    try:
+        print(f"Benchmarking {len(queries)} queries x {args.rounds} rounds against {filtered.count_chunks()} chunks "
+              f"in {len(partitioned.backend.names())} partitions")
+        for main_data in (filtered, partitioned):  # Build lazily created indexes before measuring
+            main_data.search_backend(queries[0][0], k=args.k, degree_programs=set(PROGRAMS), language=None)
+        latencies = {"filtered": [], "partitioned": []}
+        recalls = []
+        for _ in range(args.rounds):
+            for question, program, language in queries:
+                results = {}
+                for name, main_data in (("filtered", filtered), ("partitioned", partitioned)):
+                    start = time.perf_counter()
+                    results[name] = main_data.search_backend(
+                        question, k=args.k, degree_programs={program}, language=language
+                    )
+                    latencies[name].append(time.perf_counter() - start)
+                expected = {(chunk.hash, chunk.text) for chunk in results["filtered"]}
+                if expected:
+                    actual = {(chunk.hash, chunk.text) for chunk in results["partitioned"]}
+                    recalls.append(len(expected & actual) / len(expected))
+        for name, values in latencies.items():
+            report(name, values)
+        print(f"recall@{args.k} of partitioned against filtered: {statistics.mean(recalls):.3f}")
+    finally:
+        if cleanup is not None:
+            cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,525 @@
+"""
+Replay recorded chat traffic from the message history table against the chat pipeline.
+
+Every user message in the history becomes one replayed question, sent with the messages that preceded it in its
+session. The questions are replayed at a fixed rate or with their recorded timing, either against the live LLM and
+vector database or against stubs, so runs can be compared between builds without network access.
+
+Usage:
+    python -m application.backend.benchmarks.replay export --output traffic.jsonl [--since 2024-04-01] [--sessions 500]
+    python -m application.backend.benchmarks.replay run --source traffic.jsonl --output build_a.jsonl \\
+        [--rate 2 | --speedup 10] [--concurrency 8] [--stub-llm] [--stub-data]
+    python -m application.backend.benchmarks.replay diff build_a.jsonl [build_b.jsonl]
+
+`--source postgres` reads the history table directly instead of an exported dump.
+`diff` with a single file compares the replayed answers to the recorded ones.
+"""
+import argparse
+import asyncio
+import csv
+import difflib
+import json
+import os
+import re
+import statistics
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Iterable, Iterator, List, Optional
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from application.backend.benchmarks.local_search import QA_PAIRS_CSV, percentile
+from application.backend.chatbot.history_schema import HISTORY_TABLE
+
+_ROLES = {"human": "user", "ai": "assistant"}
+_QUESTION_PATTERN = re.compile(r"<question>\s*(.*?)\s*</question>", re.DOTALL)
+_DOCUMENT_PATTERN = re.compile(r"Document Index: (\d+),")
+
+
+class ReplayItem:
+    """
+    A recorded user question together with the conversation that preceded it.
+    """
+
+    item_id: str
+    session_id: str
+    question: str
+    history: list[dict]  # The previous messages of the session as {"role": ..., "content": ...}
+    recorded_answer: str | None
+    created_at: datetime | None
+
+    def __init__(self, item_id: str, session_id: str, question: str, history: list[dict],
+                 recorded_answer: str | None = None, created_at: datetime | None = None):
+        self.item_id = item_id
+        self.session_id = session_id
+        self.question = question
+        self.history = history
+        self.recorded_answer = recorded_answer
+        self.created_at = created_at
+
+
+def _parse_timestamp(value) -> datetime | None:
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def load_rows_from_postgres(since: datetime = None, sessions: int = None) -> Iterator[dict]:
+    """
+    Read the recorded messages from the history table, grouped by session and in the order they were written.
+    :param since: Only include sessions that started after this time
+    :param sessions: The maximum number of sessions, the most recent ones are used
+    """
+    import psycopg
+    from psycopg.rows import dict_row
+
+    from application.backend.chatbot.history import conn_string
+
+    query = f"""
+        WITH replayed AS (
+            SELECT session_id, MIN(created_at) AS started_at FROM {HISTORY_TABLE}
+            GROUP BY session_id
+            HAVING MIN(created_at) >= %s
+            ORDER BY started_at DESC
+            LIMIT %s
+        )
+        SELECT m.session_id, m.message, m.created_at FROM {HISTORY_TABLE} m
+        JOIN replayed USING (session_id)
+        ORDER BY replayed.started_at, m.session_id, m.id;
+    """
+    with psycopg.connect(conn_string) as connection:
+        with connection.cursor(row_factory=dict_row) as cursor:
+            cursor.execute(query, (since or datetime.min, sessions))
+            yield from cursor
+
+
+def load_rows_from_dump(path: str) -> Iterator[dict]:
+    """
+    Read the recorded messages from a dump written by the export command.
+    """
+    with open(path, mode="r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def export_rows(rows: Iterable[dict], path: str) -> int:
+    """
+    Write recorded messages to a JSON lines dump, one message per line.
+    :return: The number of exported messages
+    """
+    count = 0
+    with open(path, mode="w", encoding="utf-8") as file:
+        for row in rows:
+            created_at = row.get("created_at")
+            file.write(json.dumps({
+                "session_id": row["session_id"],
+                "message": row["message"],
+                "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+            }) + "\n")
+            count += 1
+    return count
+
+
+def extract_items(rows: Iterable[dict]) -> list[ReplayItem]:
+    """
+    Turn the recorded messages into replay items, one per user message.
+    :param rows: Messages with the keys session_id, message and created_at, in the order they were written.
+    The message is stored in the format of langchain's `message_to_dict`.
+    :return: The replay items, in the order their sessions appear in the rows
+    """
+    sessions: dict[str, list[dict]] = {}
+    for row in rows:
+        sessions.setdefault(row["session_id"], []).append(row)
+
+    items = []
+    for session_id, session_rows in sessions.items():
+        history = []
+        for position, row in enumerate(session_rows):
+            message = row["message"]
+            if isinstance(message, str):
+                message = json.loads(message)
+            role = _ROLES.get(message.get("type"), message.get("type"))
+            content = message.get("data", {}).get("content", "")
+
+            if role == "user":
+                next_message = session_rows[position + 1]["message"] if position + 1 < len(session_rows) else None
+                if isinstance(next_message, str):
+                    next_message = json.loads(next_message)
+                recorded_answer = None
+                if next_message and next_message.get("type") == "ai":
+                    recorded_answer = next_message.get("data", {}).get("content")
+                items.append(ReplayItem(
+                    item_id=f"{session_id}:{position}",
+                    session_id=session_id,
+                    question=content,
+                    history=list(history),
+                    recorded_answer=recorded_answer,
+                    created_at=_parse_timestamp(row.get("created_at")),
+                ))
+            history.append({"role": role, "content": content})
+    return items
+
+
+class ReplayHistory(BaseChatMessageHistory):
+    """
+    An in-memory stand-in for PostgresChatMessageHistory, so replayed turns never reach the production history.
+    """
+
+    def __init__(self, session_id: str = "replay", store: dict[str, list[BaseMessage]] = None):
+        self.session_id = session_id
+        self._store = store if store is not None else {}
+
+    def for_session(self, session_id: str) -> "ReplayHistory":
+        return ReplayHistory(session_id, self._store)
+
+    @property
+    def messages(self) -> List[BaseMessage]:  # type: ignore
+        return list(self._store.get(self.session_id, []))
+
+    def add_message(self, message: BaseMessage) -> None:
+        self._store.setdefault(self.session_id, []).append(message)
+
+    def clear(self) -> None:
+        self._store.pop(self.session_id, None)
+
+
+class StubChatModel(BaseChatModel):
+    """
+    A deterministic stand-in for the Azure OpenAI deployment.
+    It recognizes the prompts of the chat pipeline and answers them in the expected format with a simulated latency.
+    The stubbed answer cites every document in its context, so changes in retrieval show up in answer diffs.
+    """
+
+    first_token_latency: float = 0.3
+    token_latency: float = 0.02
+    answer_words: int = 0  # Pads answers to this many words, to simulate long answers
+
+    @property
+    def _llm_type(self) -> str:
+        return "replay-stub"
+
+    def _respond(self, prompt: str) -> str:
+        if "JSON Output:" in prompt:
+            question = _QUESTION_PATTERN.search(prompt)
+            return json.dumps({
+                "is_tum": True,
+                "is_sensitive": False,
+                "language": "English",
+                "keywords": question.group(1) if question else "",
+            })
+        if "trigger_feedback" in prompt:
+            return json.dumps({"trigger_feedback": True})
+        if "Progressively summarize" in prompt:
+            return "The student asked about their studies at the TUM School of Management."
+        documents = sorted(set(_DOCUMENT_PATTERN.findall(prompt)), key=int)
+        citations = " ".join(f"[{document}]" for document in documents)
+        answer = f"This is a stubbed answer based on {len(documents)} documents."
+        padding = self.answer_words - len(answer.split(" ")) - len(documents)
+        if padding > 0:
+            answer += " " + " ".join(["lorem"] * padding)
+        return f"{answer} {citations}".strip()
+
+    def _tokens(self, messages: List[BaseMessage]) -> list[str]:
+        words = self._respond(messages[-1].content).split(" ")
+        return [word if i == 0 else f" {word}" for i, word in enumerate(words)]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        tokens = self._tokens(messages)
+        time.sleep(self.first_token_latency + self.token_latency * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_latency)
+        for token in self._tokens(messages):
+            time.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.first_token_latency)
+        for token in self._tokens(messages):
+            await asyncio.sleep(self.token_latency)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+def load_stub_qa_pairs(degree_program: str, language: str) -> list:
+    """
+    Serve the curated QA pairs from the CSV file in the same row format as the QA pairs table.
+    """
+    with open(QA_PAIRS_CSV, mode="r", encoding="utf-8") as file:
+        return [
+            (i, row["program"], row["language"], row["question"], row["answer"])
+            for i, row in enumerate(csv.DictReader(file))
+            if row["program"] == degree_program and row["language"] == language
+        ]
+
+
+def create_stub_database():
+    """
+    Create an in-memory vector database with the curated answers as chunks and deterministic embeddings.
+    """
+    from application.backend.datastore.collections.main.local_index import HashEmbeddings
+    from application.backend.datastore.collections.main.schema import Chunk
+    from application.backend.datastore.db import ChatbotVectorDatabase
+
+    database = ChatbotVectorDatabase(backend="local", embeddings=HashEmbeddings(), local_path=":memory:")
+    with open(QA_PAIRS_CSV, mode="r", encoding="utf-8") as file:
+        database.main.import_chunks([
+            Chunk(
+                text=row["answer"],
+                faculty=None,
+                target_groups=[],
+                topic=None,
+                subtopic=None,
+                title=row["question"][:50],
+                degree_programs=[],  # The study program is not recorded, so every chunk is general
+                languages=[row["language"]],
+                hash=f"replay-{i}",
+                url=f"https://example.com/qa/{i}",
+            )
+            for i, row in enumerate(csv.DictReader(file))
+        ])
+    return database
+
+
+def create_chatbot(stub_llm: bool, stub_data: bool, first_token_latency: float, token_latency: float,
+                   answer_words: int = 0):
+    """
+    Create a chatbot that stores its turns in memory, with the selected backends replaced by stubs.
+    """
+    from application.backend.chatbot import utils
+    from application.backend.chatbot.chatbot import Chatbot
+
+    # Replayed traffic must not end up next to the production traces
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+
+    llm_factory = None
+    if stub_llm:
+        llm_factory = lambda: StubChatModel(
+            first_token_latency=first_token_latency, token_latency=token_latency, answer_words=answer_words
+        )
+    vector_database = None
+    if stub_data:
+        utils.set_qa_pairs_source(load_stub_qa_pairs)
+        vector_database = create_stub_database()
+    return Chatbot(vector_database=vector_database, message_history=ReplayHistory(), llm_factory=llm_factory)
+
+
+def _start_offsets(items: list[ReplayItem], rate: float | None, speedup: float | None) -> list[float]:
+    """
+    Compute when each item is sent, in seconds after the start of the replay.
+    """
+    if speedup:
+        timestamps = [item.created_at for item in items]
+        if all(timestamps):
+            first = min(timestamps)
+            return [(timestamp - first).total_seconds() / speedup for timestamp in timestamps]
+    if rate:
+        return [i / rate for i in range(len(items))]
+    return [0.0] * len(items)
+
+
+async def replay(bot, items: list[ReplayItem], rate: float = None, speedup: float = None, concurrency: int = 8,
+                 study_program: str = "") -> list[dict]:
+    """
+    Send the items to the streaming chat pipeline as an open-loop workload.
+    Items are started on schedule, but at most `concurrency` of them are answered at the same time.
+    :param bot: The chatbot to replay against
+    :param items: The items to replay
+    :param rate: Items per second, ignored if `speedup` is given
+    :param speedup: Replay with the recorded timing, compressed by this factor
+    :param concurrency: The maximum number of items in flight
+    :param study_program: The study program sent with every question, it is not recorded in the history
+    :return: One result per item, in the order of the items
+    """
+    from application.backend.chatbot.chatbot import Conversation, Message
+
+    semaphore = asyncio.Semaphore(concurrency)
+    offsets = _start_offsets(items, rate, speedup)
+    start = time.perf_counter()
+
+    async def replay_item(item: ReplayItem, offset: float) -> dict:
+        await asyncio.sleep(max(0.0, start + offset - time.perf_counter()))
+        scheduled = start + offset
+        result = {"item_id": item.item_id, "session_id": item.session_id, "question": item.question,
+                  "recorded_answer": item.recorded_answer, "answer": None, "references": [], "error": None,
+                  "ttft": None, "latency": None, "response_time": None}
+        async with semaphore:
+            began = time.perf_counter()
+            result["queue_delay"] = began - scheduled
+            conversation = Conversation(
+                conversation=[Message(**message) for message in item.history],
+                uuid=f"replay-{item.session_id}",
+                study_program=study_program,
+            )
+            try:
+                async for event in bot.chat_stream(item.question, conversation, study_program):
+                    event = json.loads(event)
+                    if event["type"] == "stream" and result["ttft"] is None:
+                        result["ttft"] = time.perf_counter() - began
+                    elif event["type"] == "final":
+                        result["answer"] = event["data"]["full_answer"]
+                        result["references"] = [
+                            document["url"] for document in event["data"].get("referenced documents", [])
+                        ]
+            except Exception as error:
+                result["error"] = f"{type(error).__name__}: {error}"
+            finished = time.perf_counter()
+        result["latency"] = finished - began
+        result["response_time"] = finished - scheduled
+        return result
+
+    return await asyncio.gather(*(replay_item(item, offset) for item, offset in zip(items, offsets)))
+
+
+def describe(values: list[float]) -> str:
+    if not values:
+        return "no samples"
+    return (f"p50 {percentile(values, 0.5) * 1000:8.1f}ms  p90 {percentile(values, 0.9) * 1000:8.1f}ms  "
+            f"p99 {percentile(values, 0.99) * 1000:8.1f}ms  max {max(values) * 1000:8.1f}ms  "
+            f"mean {statistics.mean(values) * 1000:8.1f}ms")
+
+
+def report_run(results: list[dict], elapsed: float = None):
+    """
+    Print the latency distributions of a replay run.
+    """
+    ok = [result for result in results if not result["error"]]
+    print(f"{len(results)} questions, {len(results) - len(ok)} errors"
+          + (f", {len(results) / elapsed:.2f} questions/s" if elapsed else ""))
+    for field, name in (("ttft", "time to first token"), ("latency", "latency"),
+                        ("response_time", "response time"), ("queue_delay", "queue delay")):
+        values = [result[field] for result in ok if result.get(field) is not None]
+        print(f"{name:>20}: {describe(values)}")
+
+
+def load_results(path: str) -> dict[str, dict]:
+    with open(path, mode="r", encoding="utf-8") as file:
+        return {result["item_id"]: result for result in map(json.loads, file) if result}
+
+
+def diff_results(baseline: dict[str, dict], candidate: dict[str, dict]) -> list[dict]:
+    """
+    Compare the answers of two runs item by item.
+    :return: One entry per item answered in both runs, least similar first
+    """
+    diffs = []
+    for item_id in baseline.keys() & candidate.keys():
+        before, after = baseline[item_id], candidate[item_id]
+        if before.get("answer") is None or after.get("answer") is None:
+            continue
+        diffs.append({
+            "item_id": item_id,
+            "question": after["question"],
+            "before": before["answer"],
+            "after": after["answer"],
+            "similarity": difflib.SequenceMatcher(None, before["answer"], after["answer"]).ratio(),
+            "references_changed": set(before.get("references", [])) != set(after.get("references", [])),
+        })
+    return sorted(diffs, key=lambda diff: diff["similarity"])
+
+
+def report_diff(baseline: dict[str, dict], candidate: dict[str, dict], show: int = 10):
+    """
+    Print how the answers and latencies changed between two runs.
+    """
+    diffs = diff_results(baseline, candidate)
+    if not diffs:
+        print("No items were answered in both runs")
+        return
+    identical = sum(diff["similarity"] == 1.0 for diff in diffs)
+    print(f"{len(diffs)} items compared: {identical} identical answers, "
+          f"mean similarity {statistics.mean(diff['similarity'] for diff in diffs):.3f}, "
+          f"{sum(diff['references_changed'] for diff in diffs)} with changed references")
+
+    for field in ("ttft", "latency"):
+        values = {}
+        for name, results in (("before", baseline), ("after", candidate)):
+            values[name] = [result[field] for result in results.values() if result.get(field) is not None]
+            print(f"{field + ' ' + name:>20}: {describe(values[name])}")
+        if values["before"] and values["after"]:
+            for q in (0.5, 0.95):
+                delta = percentile(values["after"], q) - percentile(values["before"], q)
+                print(f"{field + f' p{int(q * 100)} delta':>20}: {delta * 1000:+8.1f}ms")
+
+    for diff in diffs[:show]:
+        if diff["similarity"] == 1.0:
+            break
+        print(f"\n[{diff['item_id']}] similarity {diff['similarity']:.3f}: {diff['question']}")
+        print(f"  before: {diff['before'][:300]}")
+        print(f"  after:  {diff['after'][:300]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Export the history table to a dump")
+    export_parser.add_argument("--output", required=True, help="The JSON lines file to write")
+    export_parser.add_argument("--since", type=datetime.fromisoformat, help="Only sessions started after this date")
+    export_parser.add_argument("--sessions", type=int, help="The maximum number of sessions, most recent first")
+
+    run_parser = commands.add_parser("run", help="Replay recorded questions against the chat pipeline")
+    run_parser.add_argument("--source", default="postgres", help="A dump from the export command, or 'postgres'")
+    run_parser.add_argument("--output", required=True, help="The JSON lines file to write the results to")
+    run_parser.add_argument("--since", type=datetime.fromisoformat, help="Only sessions started after this date")
+    run_parser.add_argument("--sessions", type=int, help="The maximum number of sessions, most recent first")
+    run_parser.add_argument("--limit", type=int, help="The maximum number of questions to replay")
+    run_parser.add_argument("--rate", type=float, help="Questions per second, as fast as possible if omitted")
+    run_parser.add_argument("--speedup", type=float, help="Replay with the recorded timing, this many times faster")
+    run_parser.add_argument("--concurrency", type=int, default=8, help="The maximum number of questions in flight")
+    run_parser.add_argument("--study-program", default="", help="The study program sent with every question")
+    run_parser.add_argument("--stub-llm", action="store_true", help="Replace the Azure OpenAI deployment with a stub")
+    run_parser.add_argument("--stub-data", action="store_true",
+                            help="Replace the vector database and QA pairs with the curated QA pairs in memory")
+    run_parser.add_argument("--first-token-latency", type=float, default=0.3, help="Latency of the stub LLM in s")
+    run_parser.add_argument("--token-latency", type=float, default=0.02, help="Latency per token of the stub LLM in s")
+
+    diff_parser = commands.add_parser("diff", help="Compare the answers and latencies of two runs")
+    diff_parser.add_argument("baseline", help="The results of the first run")
+    diff_parser.add_argument("candidate", nargs="?", help="The results of the second run, the recorded answers if omitted")
+    diff_parser.add_argument("--show", type=int, default=10, help="The number of changed answers to print")
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        count = export_rows(load_rows_from_postgres(args.since, args.sessions), args.output)
+        print(f"Exported {count} messages to {args.output}")
+
+    elif args.command == "run":
+        if args.source == "postgres":
+            rows = load_rows_from_postgres(args.since, args.sessions)
+        else:
+            rows = load_rows_from_dump(args.source)
+        items = extract_items(rows)[:args.limit]
+        bot = create_chatbot(args.stub_llm, args.stub_data, args.first_token_latency, args.token_latency)
+        print(f"Replaying {len(items)} questions")
+
+        start = time.perf_counter()
+        results = asyncio.run(replay(bot, items, args.rate, args.speedup, args.concurrency, args.study_program))
+        elapsed = time.perf_counter() - start
+        with open(args.output, mode="w", encoding="utf-8") as file:
+            for result in results:
+                file.write(json.dumps(result) + "\n")
+        report_run(results, elapsed)
+
+    elif args.command == "diff":
+        baseline = load_results(args.baseline)
+        if args.candidate:
+            candidate = load_results(args.candidate)
+        else:
+            # Compare the replayed answers to what was answered in production
+            candidate = baseline
+            baseline = {item_id: {**result, "answer": result["recorded_answer"], "ttft": None, "latency": None}
+                        for item_id, result in candidate.items()}
+        report_diff(baseline, candidate, args.show)
+
+
+if __name__ == "__main__":
+    main()
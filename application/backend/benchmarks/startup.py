@@ -0,0 +1,100 @@
+"""
+Measure how long the API takes to import, to accept requests and to become ready.
+
+Every round starts a fresh interpreter:
+- import: the time to import the API module, which must not touch the network
+- listening: the time from starting uvicorn until /test answers
+- ready: the time until /ready reports that the databases are connected, which needs the configured services
+
+Usage: python -m application.backend.benchmarks.startup [--rounds 5] [--timeout 60]
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from application.backend.benchmarks.local_search import report
+
+IMPORT_SCRIPT = (
+    "import time; start = time.perf_counter(); import application.backend.api.api; "
+    "print(time.perf_counter() - start)"
+)
+
+
+def measure_import() -> float:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], check=True, capture_output=True, text=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _status(url: str) -> int | None:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+    except OSError:
+        return None
+
+
+def measure_server(timeout: float) -> tuple[float, float | None]:
+    """
+    Start the API with uvicorn and poll it.
+    :return: The time until it answered /test and until /ready succeeded, None if it was not ready within the timeout
+    """
+    port = _free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "application.backend.api.api:app", "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env=os.environ.copy(),
+    )
+    listening = ready = None
+    try:
+        while time.perf_counter() - start < timeout:
+            if listening is None and _status(f"http://127.0.0.1:{port}/test") == 200:
+                listening = time.perf_counter() - start
+            if listening is not None and _status(f"http://127.0.0.1:{port}/ready") == 200:
+                ready = time.perf_counter() - start
+                break
+            time.sleep(0.05)
+    finally:
+        server.terminate()
+        server.wait()
+    if listening is None:
+        raise RuntimeError(f"The API did not answer within {timeout}s")
+    return listening, ready
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=5, help="Number of cold starts to measure")
+    parser.add_argument("--timeout", type=float, default=60, help="Maximum time in s to wait for readiness")
+    args = parser.parse_args()
+
+    imports, listening, ready = [], [], []
+    for _ in range(args.rounds):
+        imports.append(measure_import())
+        listening_time, ready_time = measure_server(args.timeout)
+        listening.append(listening_time)
+        if ready_time is not None:
+            ready.append(ready_time)
+
+    report("import", imports)
+    report("listening", listening)
+    if ready:
+        report("ready", ready)
+    if len(ready) < args.rounds:
+        print(f"{args.rounds - len(ready)} of {args.rounds} starts were not ready within {args.timeout}s")
+
+
+if __name__ == "__main__":
+    main()
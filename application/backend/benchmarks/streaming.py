@@ -0,0 +1,105 @@
+"""
+Measure the server CPU time per streamed answer and the token cadence seen by clients,
+with and without SSE frame coalescing.
+
+The answers are streamed through Chatbot.chat_stream with the stubbed LLM and data of the replay harness,
+and every frame is encoded the way EventSourceResponse sends it.
+
+Usage: python -m application.backend.benchmarks.streaming [--answers 200] [--concurrency 50] [--words 300]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from sse_starlette.sse import ServerSentEvent
+
+from application.backend.benchmarks.local_search import percentile
+from application.backend.benchmarks.replay import create_chatbot
+from application.backend.chatbot.sse import SSEWriter
+
+
+async def stream_answers(bot, answers: int, concurrency: int) -> tuple[list[dict], float]:
+    """
+    Stream answers to distinct questions, so none of them are coalesced.
+    :return: The frame timings of every answer and the CPU time spent
+    """
+    from application.backend.chatbot.chatbot import Conversation
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def stream(i: int) -> dict:
+        async with semaphore:
+            start = time.perf_counter()
+            arrivals = []
+            async for frame in bot.chat_stream(f"Question number {i} about the exam registration?",
+                                               Conversation(conversation=[])):
+                ServerSentEvent(data=frame).encode()
+                if '"stream"' in frame[:20]:
+                    arrivals.append(time.perf_counter() - start)
+            return {"ttft": arrivals[0], "frames": len(arrivals),
+                    "gaps": [later - earlier for earlier, later in zip(arrivals, arrivals[1:])]}
+
+    cpu_start = time.process_time()
+    results = await asyncio.gather(*(stream(i) for i in range(answers)))
+    return results, time.process_time() - cpu_start
+
+
+async def stream_synthetic(writer: SSEWriter, answers: int, concurrency: int, words: int,
+                           token_latency: float) -> float:
+    """
+    Stream synthetic answers through the writer alone, without the chat pipeline.
+    :return: The CPU time spent
+    """
+    async def events():
+        for i in range(words):
+            await asyncio.sleep(token_latency)
+            yield "stream", f" word{i}"
+        yield "feedback", True
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def stream():
+        async with semaphore:
+            async for kind, data in writer.coalesce(events()):
+                ServerSentEvent(data=writer.frame({"type": kind, "data": data})).encode()
+
+    cpu_start = time.process_time()
+    await asyncio.gather(*(stream() for _ in range(answers)))
+    return time.process_time() - cpu_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--answers", type=int, default=200, help="Number of answers to stream")
+    parser.add_argument("--concurrency", type=int, default=50, help="Number of answers streamed at the same time")
+    parser.add_argument("--words", type=int, default=300, help="Length of the stubbed answers in words")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Latency per token of the stub LLM in s")
+    args = parser.parse_args()
+
+    bot = create_chatbot(True, True, first_token_latency=0.05, token_latency=args.token_latency,
+                         answer_words=args.words)
+    writers = {
+        "per token, json": SSEWriter(max_chars=0, encode=json.dumps),
+        "per token, orjson": SSEWriter(max_chars=0),
+        "coalesced, orjson": SSEWriter(),
+    }
+    print("Writer only:")
+    for name, writer in writers.items():
+        cpu_time = asyncio.run(stream_synthetic(writer, args.answers, args.concurrency, args.words, args.token_latency))
+        print(f"{name:>18}: cpu {cpu_time / args.answers * 1000:6.2f}ms/answer")
+
+    print("Full pipeline:")
+    for name, writer in writers.items():
+        bot.sse_writer = writer
+        results, cpu_time = asyncio.run(stream_answers(bot, args.answers, args.concurrency))
+        gaps = [gap for result in results for gap in result["gaps"]]
+        print(f"{name:>18}: cpu {cpu_time / args.answers * 1000:6.2f}ms/answer  "
+              f"frames {statistics.mean(result['frames'] for result in results):6.1f}/answer  "
+              f"ttft p50 {percentile([result['ttft'] for result in results], 0.5) * 1000:6.1f}ms  "
+              f"gap p50 {percentile(gaps, 0.5) * 1000:5.1f}ms p95 {percentile(gaps, 0.95) * 1000:5.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
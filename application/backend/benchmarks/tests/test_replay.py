@@ -0,0 +1,47 @@
+from application.backend.benchmarks.replay import diff_results, extract_items
+
+
+def _row(session_id: str, kind: str, content: str) -> dict:
+    return {"session_id": session_id, "message": {"type": kind, "data": {"content": content}},
+            "created_at": "2024-05-01T10:00:00+00:00"}
+
+
+def test_extract_items_keeps_session_context():
+    rows = [
+        _row("a", "human", "When does the semester start?"),
+        _row("b", "human", "Where is the library?"),
+        _row("a", "ai", "In October."),
+        _row("a", "human", "And when does it end?"),
+    ]
+
+    items = extract_items(rows)
+
+    assert [item.question for item in items] == [
+        "When does the semester start?", "And when does it end?", "Where is the library?"
+    ]
+    assert items[0].recorded_answer == "In October."
+    assert items[1].history == [
+        {"role": "user", "content": "When does the semester start?"},
+        {"role": "assistant", "content": "In October."},
+    ]
+    assert items[1].recorded_answer is None
+    assert items[2].history == []
+
+
+def test_diff_results_orders_least_similar_first():
+    baseline = {
+        "a:0": {"question": "q1", "answer": "Same answer [1]", "references": ["u1"]},
+        "a:2": {"question": "q2", "answer": "Old answer", "references": []},
+        "b:0": {"question": "q3", "answer": None, "references": []},
+    }
+    candidate = {
+        "a:0": {"question": "q1", "answer": "Same answer [1]", "references": ["u1"]},
+        "a:2": {"question": "q2", "answer": "Completely different [2]", "references": ["u2"]},
+        "b:0": {"question": "q3", "answer": "Answered now", "references": []},
+    }
+
+    diffs = diff_results(baseline, candidate)
+
+    assert [diff["item_id"] for diff in diffs] == ["a:2", "a:0"]
+    assert diffs[0]["references_changed"]
+    assert diffs[1]["similarity"] == 1.0
@@ -0,0 +1,118 @@
+"""
+Measure the memory per worker process and the search throughput of the local search index,
+with a private index in every worker against one index shared through SHARED_INDEX_DIR.
+
+The index is built from a synthetic corpus with random vectors and a hashed bag-of-words query embedding,
+so no services are needed. Every worker searches for a fixed time and then reports:
+- rss: the resident memory of the worker, counting shared pages in every process that maps them
+- pss: the proportional memory, where shared pages are split between the processes that map them (Linux only)
+
+Usage: python -m application.backend.benchmarks.workers [--chunks 50000] [--workers 1 2 4] [--seconds 10]
+"""
+import argparse
+import multiprocessing
+import random
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+from application.backend.datastore.collections.main.local_index import LocalHybridIndex, tokenize
+from application.backend.datastore.collections.main.schema import Chunk
+from application.backend.datastore.collections.main.shared_index import SharedIndexStore
+
+WORDS = [f"word{i}" for i in range(20000)]
+PROGRAMS = ["BMT", "MMT", "MIM", "MCS", "BIE"]
+LANGUAGES = ["English", "German"]
+DIMENSIONS = 1536
+
+
+def embed(text: str) -> list[float]:
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    for token in tokenize(text):
+        vector[zlib.crc32(token.encode()) % DIMENSIONS] += 1
+    return vector.tolist()
+
+
+def snapshot(chunks: int, seed: int = 0):
+    rng = random.Random(seed)
+    vectors = np.random.default_rng(seed)
+    for _ in range(chunks):
+        text = " ".join(rng.choices(WORDS, k=200))
+        chunk = Chunk(
+            text=text, faculty=None, target_groups=[], topic=None, subtopic=None, title=text[:40],
+            degree_programs=rng.sample(PROGRAMS, rng.randint(0, 2)), languages=[rng.choice(LANGUAGES)],
+        )
+        yield chunk, vectors.standard_normal(DIMENSIONS, dtype=np.float32).tolist()
+
+
+def memory() -> dict[str, float]:
+    """
+    The resident and proportional memory of this process in MB.
+    """
+    values = {}
+    for path, key, name in (("/proc/self/status", "VmRSS:", "rss"), ("/proc/self/smaps_rollup", "Pss:", "pss")):
+        try:
+            with open(path) as file:
+                for line in file:
+                    if line.startswith(key):
+                        values[name] = int(line.split()[1]) / 1024
+                        break
+        except OSError:
+            pass
+    return values
+
+
+def worker(args: tuple) -> dict:
+    chunks, shared_dir, seconds, start_barrier = args
+    if shared_dir is None:
+        index = LocalHybridIndex.from_snapshot(snapshot(chunks), embed)
+    else:
+        store = SharedIndexStore(shared_dir)
+        index = store.load(store.current(), embed)
+    rng = random.Random()
+    start_barrier.wait()
+
+    queries = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        query = " ".join(rng.choices(WORDS, k=6))
+        index.search(query, k=3, degree_programs={rng.choice(PROGRAMS)}, language=rng.choice(LANGUAGES))
+        queries += 1
+    return {"queries": queries, **memory()}
+
+
+def run(workers: int, chunks: int, shared_dir: str | None, seconds: float) -> list[dict]:
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager:
+        barrier = manager.Barrier(workers)
+        with context.Pool(workers) as pool:
+            return pool.map(worker, [(chunks, shared_dir, seconds, barrier)] * workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=50_000, help="Number of chunks in the synthetic corpus")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Numbers of workers to run")
+    parser.add_argument("--seconds", type=float, default=10, help="Time in s every worker searches for")
+    parser.add_argument("--dir", default=None, help="Directory for the shared index, e.g. on /dev/shm")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as shared_dir:
+        start = time.perf_counter()
+        SharedIndexStore(shared_dir).publish(LocalHybridIndex.from_snapshot(snapshot(args.chunks), embed))
+        print(f"Built and published an index of {args.chunks} chunks in {time.perf_counter() - start:.1f}s")
+
+        for mode, directory in (("private", None), ("shared", shared_dir)):
+            for workers in args.workers:
+                results = run(workers, args.chunks, directory, args.seconds)
+                throughput = sum(result["queries"] for result in results) / args.seconds
+                rss = max(result.get("rss", 0) for result in results)
+                pss = max(result.get("pss", 0) for result in results)
+                print(f"{mode:>8} x{workers}: {throughput:8.1f} queries/s  "
+                      f"rss {rss:8.1f}MB  pss {pss:8.1f}MB per worker")
+
+
+if __name__ == "__main__":
+    main()
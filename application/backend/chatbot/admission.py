@@ -0,0 +1,393 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from enum import IntEnum
+from typing import Any, AsyncIterator, Callable, Iterator, List, Optional
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from application.backend.chatbot.tokens import count_tokens
+from application.backend.metrics import LLM_IN_FLIGHT, LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT, LLM_REJECTED
+
+# Defaults for every deployment, e.g. LLM_MAX_CONCURRENCY_CHATBOTMGT overrides them for the ChatbotMGT deployment
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))  # 0 disables the token budget
+LLM_QUEUE_SIZE = int(os.getenv("LLM_QUEUE_SIZE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "20"))
+LLM_COMPLETION_ESTIMATE = int(os.getenv("LLM_COMPLETION_ESTIMATE", "300"))
+
+
+class Priority(IntEnum):
+    """
+    The priority of an LLM call, lower values are admitted first.
+    """
+
+    INTERACTIVE = 0  # A user is waiting for the result, e.g. the first filter and the streamed answer
+    BACKGROUND = 1  # Nobody is waiting, e.g. the feedback trigger, history summaries and batch jobs
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when an LLM call is not admitted, because the deployment is overloaded.
+    """
+
+    def __init__(self, deployment: str, priority: Priority, reason: str):
+        super().__init__(f"LLM call to '{deployment}' was not admitted ({reason})")
+        self.deployment = deployment
+        self.priority = priority
+        self.reason = reason
+
+
+class Grant:
+    """
+    An admitted LLM call. Recording the tokens it actually used corrects the tokens reserved for it.
+    """
+
+    def __init__(self, reserved_tokens: int):
+        self.reserved_tokens = reserved_tokens
+        self.used_tokens: int | None = None
+
+    def record(self, tokens: int):
+        self.used_tokens = tokens
+
+
+class _Waiter:
+    def __init__(self, priority: Priority, tokens: int, wake: Callable[[], None]):
+        self.priority = priority
+        self.tokens = tokens
+        self.wake = wake
+        self.enqueued_at = time.perf_counter()
+        self.granted = False
+        self.rejected: str | None = None
+
+
+class AdmissionController:
+    """
+    Limits the calls to one LLM deployment, so a burst of questions queues up in front of the API
+    instead of failing with rate limit errors at Azure.
+
+    - At most `max_concurrency` calls run at the same time
+    - Calls reserve their estimated tokens from a token bucket that refills at `tokens_per_minute`
+    - Calls that cannot start right away wait in a bounded queue, interactive calls before background calls
+    - When the queue is full, the newest background call is evicted for an interactive one, otherwise the call is
+      rejected right away, so the API can answer with 503 instead of letting the client wait
+    """
+
+    def __init__(
+        self,
+        deployment: str,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+        queue_size: int = LLM_QUEUE_SIZE,
+        queue_timeout: float = LLM_QUEUE_TIMEOUT,
+    ):
+        """
+        :param deployment: The name of the deployment, used in the metrics
+        :param max_concurrency: The maximum number of calls running at the same time
+        :param tokens_per_minute: The token budget of the deployment, 0 for no budget
+        :param queue_size: The maximum number of waiting calls
+        :param queue_timeout: The maximum time in seconds a call waits for admission
+        """
+        self.deployment = deployment
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._queue: list[tuple[int, int, _Waiter]] = []
+        self._sequence = itertools.count()
+        self._timer: threading.Timer | None = None
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def _refill(self):
+        if not self.tokens_per_minute:
+            return
+        now = time.monotonic()
+        self._tokens = min(
+            self.tokens_per_minute, self._tokens + (now - self._refilled_at) * self.tokens_per_minute / 60
+        )
+        self._refilled_at = now
+
+    def _has_tokens(self, tokens: int) -> bool:
+        # A call larger than the whole budget may start once the bucket is full, it then goes into debt
+        return not self.tokens_per_minute or self._tokens >= min(tokens, self.tokens_per_minute)
+
+    def _can_start(self, tokens: int) -> bool:
+        return self._in_flight < self.max_concurrency and self._has_tokens(tokens)
+
+    def _start(self, tokens: int):
+        self._in_flight += 1
+        if self.tokens_per_minute:
+            self._tokens -= tokens
+        LLM_IN_FLIGHT.labels(deployment=self.deployment).set(self._in_flight)
+
+    def _update_queue_depth(self):
+        for priority in Priority:
+            depth = sum(1 for _, _, waiter in self._queue if waiter.priority == priority)
+            LLM_QUEUE_DEPTH.labels(deployment=self.deployment, priority=priority.name.lower()).set(depth)
+
+    def _reject(self, priority: Priority, reason: str, waited: float = 0.0) -> AdmissionRejected:
+        LLM_REJECTED.labels(deployment=self.deployment, priority=priority.name.lower(), reason=reason).inc()
+        LLM_QUEUE_WAIT.labels(deployment=self.deployment, priority=priority.name.lower()).observe(waited)
+        return AdmissionRejected(self.deployment, priority, reason)
+
+    def _dispatch(self):
+        """
+        Admit waiting calls in order of priority for as long as there is capacity. Must hold the lock.
+        """
+        self._refill()
+        while self._queue and self._can_start(self._queue[0][2].tokens):
+            _, _, waiter = heapq.heappop(self._queue)
+            self._start(waiter.tokens)
+            waiter.granted = True
+            waiter.wake()
+        self._update_queue_depth()
+
+        if self._queue and self._in_flight < self.max_concurrency and self._timer is None:
+            # Only the token budget holds the queue back, check again once enough tokens were refilled
+            missing = min(self._queue[0][2].tokens, self.tokens_per_minute) - self._tokens
+            self._timer = threading.Timer(max(0.01, missing * 60 / self.tokens_per_minute), self._on_refill)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _on_refill(self):
+        with self._lock:
+            self._timer = None
+            self._dispatch()
+
+    def _submit(self, priority: Priority, tokens: int, wake: Callable[[], None]) -> _Waiter | None:
+        """
+        Admit a call right away or put it into the queue.
+        :return: The waiter in the queue, or None if the call was admitted right away
+        """
+        with self._lock:
+            self._refill()
+            # Calls of the same or a higher priority that are already waiting go first
+            if (not self._queue or self._queue[0][0] > priority) and self._can_start(tokens):
+                self._start(tokens)
+                LLM_QUEUE_WAIT.labels(deployment=self.deployment, priority=priority.name.lower()).observe(0)
+                return None
+
+            if len(self._queue) >= self.queue_size:
+                worst = max(range(len(self._queue)), key=lambda i: self._queue[i][:2])
+                evicted = self._queue[worst][2]
+                if evicted.priority <= priority:
+                    raise self._reject(priority, "queue_full")
+                self._queue.pop(worst)
+                heapq.heapify(self._queue)
+                evicted.rejected = "evicted"
+                evicted.wake()
+
+            waiter = _Waiter(priority, tokens, wake)
+            heapq.heappush(self._queue, (int(priority), next(self._sequence), waiter))
+            self._dispatch()
+            return waiter
+
+    def _finish_wait(self, waiter: _Waiter):
+        """
+        Check the outcome of waiting for admission, giving up the place in the queue if the call is still waiting.
+        """
+        waited = time.perf_counter() - waiter.enqueued_at
+        with self._lock:
+            if waiter.granted:
+                LLM_QUEUE_WAIT.labels(deployment=self.deployment, priority=waiter.priority.name.lower()).observe(waited)
+                return
+            if waiter.rejected is None:
+                waiter.rejected = "timeout"
+                self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+                heapq.heapify(self._queue)
+                self._update_queue_depth()
+        raise self._reject(waiter.priority, waiter.rejected, waited)
+
+    def _abandon(self, waiter: _Waiter):
+        """
+        Leave the queue because the caller was cancelled, releasing the call if it was admitted in the meantime.
+        """
+        with self._lock:
+            granted = waiter.granted
+            if not granted:
+                waiter.rejected = "cancelled"
+                self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+                heapq.heapify(self._queue)
+                self._update_queue_depth()
+        if granted:
+            self._release(Grant(waiter.tokens))
+
+    def _release(self, grant: Grant):
+        with self._lock:
+            self._in_flight -= 1
+            LLM_IN_FLIGHT.labels(deployment=self.deployment).set(self._in_flight)
+            if self.tokens_per_minute and grant.used_tokens is not None:
+                self._tokens += grant.reserved_tokens - grant.used_tokens
+            self._dispatch()
+
+    @contextmanager
+    def admit(self, priority: Priority, tokens: int) -> Iterator[Grant]:
+        """
+        Wait until a call may start, blocking the current thread.
+        :param priority: The priority of the call
+        :param tokens: The estimated number of prompt and completion tokens of the call
+        :raises AdmissionRejected: If the queue is full or the call waited too long
+        """
+        event = threading.Event()
+        waiter = self._submit(priority, tokens, event.set)
+        if waiter is not None:
+            event.wait(self.queue_timeout)
+            self._finish_wait(waiter)
+        grant = Grant(tokens)
+        try:
+            yield grant
+        finally:
+            self._release(grant)
+
+    @asynccontextmanager
+    async def admit_async(self, priority: Priority, tokens: int) -> AsyncIterator[Grant]:
+        """
+        Wait until a call may start, without blocking the event loop.
+        :param priority: The priority of the call
+        :param tokens: The estimated number of prompt and completion tokens of the call
+        :raises AdmissionRejected: If the queue is full or the call waited too long
+        """
+        loop = asyncio.get_running_loop()
+        woken = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: woken.done() or woken.set_result(None))
+
+        waiter = self._submit(priority, tokens, wake)
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(woken), self.queue_timeout)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                self._abandon(waiter)
+                raise
+            self._finish_wait(waiter)
+        grant = Grant(tokens)
+        try:
+            yield grant
+        finally:
+            self._release(grant)
+
+
+_controllers: dict[str, AdmissionController] = {}
+_controllers_lock = threading.Lock()
+
+
+def get_controller(deployment: str) -> AdmissionController:
+    """
+    Get the admission controller of a deployment, which is shared by all requests of this process.
+    The limits are read from the environment, with LLM_<LIMIT>_<DEPLOYMENT> taking precedence over LLM_<LIMIT>.
+    """
+    with _controllers_lock:
+        controller = _controllers.get(deployment)
+        if controller is None:
+            suffix = deployment.upper().replace("-", "_")
+            controller = AdmissionController(
+                deployment,
+                max_concurrency=int(os.getenv(f"LLM_MAX_CONCURRENCY_{suffix}", LLM_MAX_CONCURRENCY)),
+                tokens_per_minute=int(os.getenv(f"LLM_TOKENS_PER_MINUTE_{suffix}", LLM_TOKENS_PER_MINUTE)),
+                queue_size=int(os.getenv(f"LLM_QUEUE_SIZE_{suffix}", LLM_QUEUE_SIZE)),
+                queue_timeout=float(os.getenv(f"LLM_QUEUE_TIMEOUT_{suffix}", LLM_QUEUE_TIMEOUT)),
+            )
+            _controllers[deployment] = controller
+        return controller
+
+
+def _as_chunk(result: ChatResult) -> ChatGenerationChunk:
+    return ChatGenerationChunk(message=AIMessageChunk(content=result.generations[0].message.content))
+
+
+class AdmittedChatModel(BaseChatModel):
+    """
+    Wraps a chat model so that every call to it goes through the admission controller of its deployment.
+    """
+
+    llm: BaseChatModel
+    priority: Priority = Priority.INTERACTIVE
+    completion_tokens: int = LLM_COMPLETION_ESTIMATE  # The estimated completion tokens reserved for every call
+
+    @property
+    def _llm_type(self) -> str:
+        return self.llm._llm_type
+
+    @property
+    def controller(self) -> AdmissionController:
+        return get_controller(getattr(self.llm, "deployment_name", None) or self.llm._llm_type)
+
+    @staticmethod
+    def _count(messages: List[BaseMessage]) -> int:
+        return sum(count_tokens(message.content) for message in messages if isinstance(message.content, str))
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                  **kwargs: Any) -> ChatResult:
+        prompt_tokens = self._count(messages)
+        with self.controller.admit(self.priority, prompt_tokens + self.completion_tokens) as grant:
+            result = self.llm._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            grant.record(prompt_tokens + self._count([generation.message for generation in result.generations]))
+        return result
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                         **kwargs: Any) -> ChatResult:
+        prompt_tokens = self._count(messages)
+        async with self.controller.admit_async(self.priority, prompt_tokens + self.completion_tokens) as grant:
+            result = await self.llm._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+            grant.record(prompt_tokens + self._count([generation.message for generation in result.generations]))
+        return result
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        prompt_tokens = self._count(messages)
+        with self.controller.admit(self.priority, prompt_tokens + self.completion_tokens) as grant:
+            completion = ""
+            if type(self.llm)._stream is BaseChatModel._stream:
+                # The wrapped model does not stream, its whole answer becomes one chunk
+                result = self.llm._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+                chunks = [_as_chunk(result)]
+            else:
+                chunks = self.llm._stream(messages, stop=stop, run_manager=run_manager, **kwargs)
+            for chunk in chunks:
+                completion += chunk.text
+                yield chunk
+            grant.record(prompt_tokens + count_tokens(completion))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        prompt_tokens = self._count(messages)
+        async with self.controller.admit_async(self.priority, prompt_tokens + self.completion_tokens) as grant:
+            completion = ""
+            if type(self.llm)._astream is BaseChatModel._astream:
+                result = await self.llm._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+                chunk = _as_chunk(result)
+                completion = chunk.text
+                yield chunk
+            else:
+                async for chunk in self.llm._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+                    completion += chunk.text
+                    yield chunk
+            grant.record(prompt_tokens + count_tokens(completion))
+
+
+def admitted(llm: BaseChatModel, priority: Priority) -> AdmittedChatModel:
+    """
+    Wrap a chat model so that its calls are admission controlled with the given priority.
+    """
+    return AdmittedChatModel(llm=llm, priority=priority)
@@ -1,18 +1,26 @@
 import json
+import logging
+import time
 import uuid
 import os
 import asyncio
-from typing import List, Optional
+from typing import Callable, List, Optional
 from operator import itemgetter
 from dotenv import find_dotenv, load_dotenv
 from pydantic import BaseModel, Field
+import psycopg
 
-from langchain_openai import AzureChatOpenAI
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
 from langchain_core.runnables import RunnableParallel, RunnablePassthrough
 from langchain.schema import StrOutputParser, Document, format_document
 
 from application.backend.datastore.db import ChatbotVectorDatabase
-from application.backend.chatbot.history import PostgresChatMessageHistory
+from application.backend.datastore.sync_service import CORPUS_CHECK_SECONDS, CorpusWatcher
+from application.backend.chatbot.history import POSTGRES_USER, PostgresChatMessageHistory, conn_string
+from application.backend.chatbot.history_schema import FEEDBACK_TABLE, HistoryMaintenance
+from application.backend.chatbot.history_writer import HISTORY_WRITE_BEHIND, FeedbackWriter, HistoryWriter
 from application.backend.chatbot.prompts import (
     CONDENSE_QUESTION_PROMPT,
     ANSWER_PROMPT,
@@ -25,6 +33,21 @@ from application.backend.chatbot.utils import (
     map_study_program,
     extract_documents
 )
+from application.backend.chatbot.admission import AdmissionRejected, Priority, admitted
+from application.backend.chatbot.citations import CitationTracker
+from application.backend.chatbot.coalescing import SingleFlight
+from application.backend.chatbot.context import CONTEXT_CANDIDATES, ContextBuilder
+from application.backend.chatbot.session import SessionStore
+from application.backend.chatbot.sse import SSEWriter
+from application.backend.chatbot.summary import HistoryCompactor
+from application.backend.chatbot.tokens import count_tokens
+from application.backend.metrics import (
+    COALESCED_REQUESTS,
+    GENERATION_TTFT,
+    STAGE_LATENCY,
+    record_llm_tokens,
+    stage_timer,
+)
 
 load_dotenv(find_dotenv())
 
@@ -36,6 +59,12 @@ os.environ["LANGCHAIN_PROJECT"] = "MGTChatbot"
 openai_api_key = os.getenv("AZURE_OPENAI_API_KEY")
 azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
 
+logger = logging.getLogger(__name__)
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+COALESCE_QUESTIONS = os.getenv("COALESCE_QUESTIONS", "true").lower() == "true"
+
 
 class Message(BaseModel):
     role: str
@@ -43,25 +72,242 @@ class Message(BaseModel):
 
 
 class Conversation(BaseModel):
-    conversation: list[Message]
+    # May be left empty for a known session uuid, the history is then kept on the server
+    conversation: list[Message] = []
     uuid: Optional[str] = None
     study_program: Optional[str] = None
 
 
+class HistoryPage(BaseModel):
+    messages: list[Message]
+    # Pass as `before` to read the next older page, None once the start of the conversation is reached
+    next_cursor: Optional[int] = None
+
+
+class BatchItem(BaseModel):
+    question: str
+    study_program: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    items: list[BatchItem]
+    concurrency: int = Field(
+        default=BATCH_CONCURRENCY, ge=1, le=BATCH_MAX_CONCURRENCY,
+        description="The maximum number of answers generated at the same time",
+    )
+
+
 # Define Chatbot class (Decision-Making Module)
 class Chatbot:
-    def __init__(self, session_id: str = str(uuid.uuid4())):
+    def __init__(
+        self,
+        session_id: str = str(uuid.uuid4()),
+        vector_database: ChatbotVectorDatabase = None,
+        message_history: BaseChatMessageHistory = None,
+        llm_factory: Callable[[], BaseChatModel] = None,
+    ):
+        """
+        :param session_id: The session id of turns stored without a conversation uuid
+        :param vector_database: The vector database to retrieve from, connects to the configured one by default
+        :param message_history: The history turns are stored in, must provide `for_session` like
+        PostgresChatMessageHistory, which is used by default
+        :param llm_factory: Creates the LLM for every request, the Azure OpenAI deployment by default
+        """
         self.conversation_history = Conversation(conversation=[])
-        self.chatvec = ChatbotVectorDatabase()
-        self.postgres_history = PostgresChatMessageHistory(session_id=session_id)
+        self.chatvec = vector_database if vector_database is not None else ChatbotVectorDatabase()
+        self.postgres_history = message_history if message_history is not None \
+            else PostgresChatMessageHistory(session_id=session_id)
+        self.history_writer = None
+        self.history_maintenance = None
+        self.feedback_writer = None
+        self.corpus_watcher = None
+        self.history_compactor = HistoryCompactor()
+        try:
+            self._start_background_work()
+        except Exception:
+            self.close()  # Stop what was started, a retry starts everything again
+            raise
+        self.llm_factory = llm_factory or self._create_llm
+        self.context_builder = ContextBuilder()
+        self.sessions = SessionStore(self._load_session_messages)
+        self.in_flight = SingleFlight()
+        self.sse_writer = SSEWriter()
+
+    def _start_background_work(self):
+        if isinstance(self.postgres_history, PostgresChatMessageHistory):
+            # Autocommit, so every partition is created or dropped in its own short transaction
+            self.history_maintenance = HistoryMaintenance(
+                lambda: psycopg.connect(conn_string, autocommit=True), self.postgres_history.table_name
+            ).start()
+            if HISTORY_WRITE_BEHIND:
+                self.history_writer = HistoryWriter(
+                    lambda: psycopg.connect(conn_string), self.postgres_history.table_name
+                )
+                self.postgres_history.writer = self.history_writer
+            self.feedback_writer = FeedbackWriter(lambda: psycopg.connect(conn_string), FEEDBACK_TABLE)
+        main = self.chatvec.main
+        if CORPUS_CHECK_SECONDS > 0 and POSTGRES_USER and (main.local_search or main.hot_chunks is not None):
+            # Reload the in-memory copies of the corpus after a sync run changed it, whichever history is used
+            self.corpus_watcher = CorpusWatcher(lambda: psycopg.connect(conn_string), main.invalidate).start()
+
+    @classmethod
+    async def create(cls, session_id: str = None) -> "Chatbot":
+        """
+        Create a chatbot, connecting to the vector database and the history database at the same time.
+        If it fails, the connections and threads started so far are closed, so it can simply be retried.
+        :param session_id: The session id of turns stored without a conversation uuid
+        """
+        results = await asyncio.gather(
+            asyncio.to_thread(ChatbotVectorDatabase),
+            asyncio.to_thread(PostgresChatMessageHistory, session_id=session_id or str(uuid.uuid4())),
+            asyncio.to_thread(count_tokens, "Load the tokenizer"),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            for started in results[:2]:
+                if not isinstance(started, BaseException):
+                    await asyncio.to_thread(started.close)
+            raise errors[0]
+        vector_database, message_history, _ = results
+        bot = cls(vector_database=vector_database, message_history=message_history)
+        try:
+            await asyncio.to_thread(bot.llm_factory)  # Import the LLM client now rather than in the first request
+        except BaseException:
+            await asyncio.to_thread(bot.close)
+            raise
+        return bot
+
+    def close(self):
+        """
+        Write the turns, feedback and retrieval counts that are still queued and stop the background threads.
+        """
+        for writer in (self.history_writer, self.feedback_writer):
+            if writer is not None:
+                writer.close()
+        for thread in (self.history_maintenance, self.corpus_watcher):
+            if thread is not None:
+                thread.stop()
+        self.history_compactor.close()
+        self.chatvec.close()
+        if isinstance(self.postgres_history, PostgresChatMessageHistory):
+            self.postgres_history.close()
+
+    @staticmethod
+    def _create_llm() -> BaseChatModel:
+        from langchain_openai import AzureChatOpenAI  # Imported on first use, it is slow to import
+
+        return AzureChatOpenAI(
+            openai_api_version="2023-05-15",
+            deployment_name="ChatbotMGT",
+            azure_endpoint=azure_endpoint,
+            openai_api_key=openai_api_key,
+        )
+
+    @staticmethod
+    def _answer_chain(llm: BaseChatModel, context: str, few_shot_qa_pairs: str):
+        """
+        Create the chain that answers a question given the retrieved context and few-shot examples.
+        It is invoked with a dict containing the question and the formatted chat history.
+        """
+        return (
+            {
+                "context": lambda x: context,
+                "question": RunnablePassthrough(),
+                "chat_history": RunnablePassthrough(),
+                "few_shot_qa_pairs": lambda x: few_shot_qa_pairs,
+            }
+            | ANSWER_PROMPT
+            | llm
+            | StrOutputParser()
+        )
+
+    @staticmethod
+    def _to_messages(messages: list[BaseMessage]) -> list[Message]:
+        roles = {"human": "user", "ai": "assistant"}
+        return [Message(role=roles.get(message.type, message.type), content=message.content) for message in messages]
+
+    def _load_session_messages(self, session_id: str) -> list[Message]:
+        """
+        Load the messages of a session from PostgreSQL.
+        """
+        return self._to_messages(self.postgres_history.for_session(session_id).messages)
 
-    def _format_chat_history(self, conversation: Conversation) -> str:
-        formatted_history = ""
-        if not conversation.conversation:
-            return formatted_history
-        for message in conversation.conversation:
-            formatted_history += f"{message.role}: {message.content}\n"
-        return formatted_history.rstrip()
+    def history_page(self, session_id: str, before: int | None = None, limit: int = 50) -> HistoryPage:
+        """
+        Read the stored conversation of a session backwards, one page at a time.
+        :param session_id: The uuid of the session
+        :param before: The cursor of the previous page, None for the newest messages
+        :param limit: The maximum number of messages in the page
+        """
+        messages, cursor = self.postgres_history.for_session(session_id).page(before, limit)
+        return HistoryPage(messages=self._to_messages(messages), next_cursor=cursor)
+
+    @staticmethod
+    def _uses_session_state(conversation: Conversation) -> bool:
+        """
+        Whether the client only sent the session uuid and expects the server to provide the history.
+        """
+        return bool(conversation.uuid) and not conversation.conversation
+
+    def _format_chat_history(self, conversation: Conversation, llm: BaseChatModel) -> str:
+        """
+        Format the chat history for the prompts, summarizing older turns of long conversations.
+        In session state mode the history is taken from the session store, where it is usually already formatted.
+        """
+        if not self._uses_session_state(conversation):
+            return self.history_compactor.compact(conversation.uuid, conversation.conversation, llm)
+
+        state = self.sessions.get(conversation.uuid)
+        summary = self.history_compactor.get_summary(conversation.uuid)
+        version = (len(state.messages), summary.summarized_count if summary else 0)
+        if state.formatted_for != version:
+            state.formatted_history = self.history_compactor.compact(conversation.uuid, state.messages, llm)
+            state.formatted_for = version
+        return state.formatted_history
+
+    def _record_turn(
+        self, conversation: Conversation, question: str, answer: str, llm: BaseChatModel
+    ) -> tuple[str, str]:
+        """
+        Store a question and its answer in the history of the conversation's session.
+        :return: The session id the turn was stored under and the message id of the answer, which feedback refers to
+        """
+        message_id = str(uuid.uuid4())
+        with stage_timer("history_write"):
+            history = self.postgres_history
+            if conversation.uuid:
+                history = self.postgres_history.for_session(conversation.uuid)
+            history.add_messages([HumanMessage(content=question), AIMessage(content=answer, id=message_id)])
+            self.sessions.append(
+                history.session_id, Message(role="user", content=question), Message(role="assistant", content=answer)
+            )
+        if self._uses_session_state(conversation):
+            # Build the history for the next question now, while the client is still reading the answer
+            self._format_chat_history(conversation, llm)
+        return history.session_id, message_id
+
+    def record_feedback(self, session_id: str, message_id: str | None, classification: str, feedback: str) -> bool:
+        """
+        Queue feedback on an answer, or on the whole session without a message id, to be stored in the background.
+        :return: Whether the feedback was accepted, False if the feedback queue is full
+        """
+        if self.feedback_writer is None:
+            logger.warning(f"No feedback store configured, dropped feedback for session {session_id}")
+            return True
+        return self.feedback_writer.submit(session_id, message_id, classification, feedback)
+
+    @staticmethod
+    def _get_feedback_trigger(question: str, answer: str, llm: BaseChatModel) -> dict:
+        """
+        Decide whether to ask for feedback. This is the first work to be shed when the LLM is overloaded.
+        """
+        with stage_timer("feedback_trigger"):
+            try:
+                return get_feedback_trigger(question, answer, llm)
+            except AdmissionRejected as error:
+                logger.info(f"Skipped the feedback trigger: {error}")
+                return {"trigger_feedback": False}
 
     def chat(
         self, question: str, conversation: Conversation, study_program: str = ""
@@ -73,99 +319,63 @@ class Chatbot:
         :return: The chatbot's answer and the session id
         """
 
-        llm = AzureChatOpenAI(
-            openai_api_version="2023-05-15",
-            deployment_name="ChatbotMGT",
-            azure_endpoint=azure_endpoint,
-            openai_api_key=openai_api_key,
-        )
+        llm = self.llm_factory()
+        interactive_llm = admitted(llm, Priority.INTERACTIVE)
+        background_llm = admitted(llm, Priority.BACKGROUND)
 
-        history = self._format_chat_history(conversation)
-        first_filter_result = parse_and_filter_question(question, history, llm)
+        history = self._format_chat_history(conversation, background_llm)
+        with stage_timer("first_filter"):
+            first_filter_result = parse_and_filter_question(question, history, interactive_llm)
 
         if first_filter_result and first_filter_result.get("decision") == "stop":
-            print("First filter applied, stopping here.")
-            self.postgres_history.add_user_message(question)
-            self.postgres_history.add_ai_message(
-                first_filter_result.get("answer", "Stopped at first filter")
+            logger.debug("First filter applied, stopping here.")
+            session_id, message_id = self._record_turn(
+                conversation, question, first_filter_result.get("answer", "Stopped at first filter"), background_llm
             )
             return {
                 "answer": first_filter_result.get(
                     "answer", "Something didn't work with filtering"
                 ),
-                "session_id": self.postgres_history.session_id,
+                "session_id": session_id,
+                "message_id": message_id,
             }
 
         # to-do: get degree program from frontend
         language_of_query = "English"  # first_filter_result.get("language", "English")
         degree_program = map_study_program(study_program)
-        print(f"Degree program: {degree_program}")
-
         keyword_string = first_filter_result.get("keywords", "")
+        logger.debug(f"Degree program: {degree_program}, keywords: {keyword_string}")
 
-        print(f"keyword_string: {keyword_string}")
-
-        few_shot_qa_pairs = get_qa_pairs(degree_program, language_of_query)
-        print(f"Few shot QA pairs: {few_shot_qa_pairs}")
-        print("-------------------")
+        with stage_timer("few_shot"):
+            few_shot_qa_pairs = get_qa_pairs(degree_program, language_of_query)
 
-        """ _inputs = RunnableParallel(
-            standalone_answer=RunnablePassthrough.assign(
-                chat_history=lambda x: self._format_chat_history(x["chat_history"])
+        with stage_timer("retrieval"):
+            docs_from_vdb = self.chatvec.main.search(
+                query=keyword_string,
+                k=CONTEXT_CANDIDATES,
+                language=language_of_query,
+                degree_programs=degree_program,
             )
-            | CONDENSE_QUESTION_PROMPT
-            | llm
-            | StrOutputParser(),
-        )
-        print("Type, ", type(_inputs))
-        print(f"Inputs: {_inputs}")
-        print("-------------------") """
-
-        _context = {
-            "context": lambda x: " ".join(
-                [
-                    f"{res.text}, {res.subtopic}, {res.url}"
-                    for res in self.chatvec.main.search(
-                        query=keyword_string,
-                        k=3,
-                        language=language_of_query,
-                        degree_programs=degree_program,
-                    )
-                ]
-            ),
-            # "question": itemgetter("question"),  # itemgetter("standalone_question")
-            # "few_shot_qa_pairs": itemgetter("few_shot_qa_pairs"),
-        }
+        context, _ = self.context_builder.build(keyword_string, docs_from_vdb)
 
-        conversational_qa_chain = (
-            {
-                "context": _context,
-                "question": RunnablePassthrough(),
-                "chat_history": RunnablePassthrough(),
-                "few_shot_qa_pairs": lambda x: few_shot_qa_pairs,
-            }
-            | ANSWER_PROMPT
-            | llm
-            | StrOutputParser()
-        )
+        conversational_qa_chain = self._answer_chain(interactive_llm, context, few_shot_qa_pairs)
 
-        answer = conversational_qa_chain.invoke(
-            {"question": question, "chat_history": conversation.conversation}
+        with stage_timer("generation"):
+            answer = conversational_qa_chain.invoke(
+                {"question": question, "chat_history": history}
+            )
+        prompt = ANSWER_PROMPT.format(
+            context=context, question=question, chat_history=history, few_shot_qa_pairs=few_shot_qa_pairs
         )
-        print(f"Answer: {answer}")
-        print("-------------------")
+        record_llm_tokens("answer", count_tokens(prompt), count_tokens(answer))
 
-        self.postgres_history.add_user_message(question)
-        self.postgres_history.add_ai_message(answer)
+        session_id, message_id = self._record_turn(conversation, question, answer, background_llm)
 
-        feedback_trigger = get_feedback_trigger(question, answer, llm)
-        print(feedback_trigger)
-        print(f"Feedback trigger: {feedback_trigger}")
+        feedback_trigger = self._get_feedback_trigger(question, answer, background_llm)
+        logger.debug(f"Feedback trigger: {feedback_trigger}")
         # to-do: pass feedback_trigger to frontend, create api endpoint to store feedback
-        if feedback_trigger.get("trigger_feedback", False):
-            print("Feedback triggered")
 
-        return {"answer": answer, "session_id": self.postgres_history.session_id}
+        return {"answer": answer, "session_id": session_id, "message_id": message_id}
 
     async def chat_stream(
         self, question: str, conversation: Conversation, study_program: str = ""
@@ -176,126 +386,209 @@ class Chatbot:
         :param chat_history: The chat history
         :yield: The chatbot's answer, the session id, and the feedback trigger
         """
-        print(conversation)
-        llm = AzureChatOpenAI(
-            openai_api_version="2023-05-15",
-            deployment_name="ChatbotMGT",
-            azure_endpoint=azure_endpoint,
-            openai_api_key=openai_api_key,
-        )
-
-        history = self._format_chat_history(conversation)
-        first_filter_result = parse_and_filter_question(question, history, llm)
+        llm = self.llm_factory()
+        interactive_llm = admitted(llm, Priority.INTERACTIVE)
+        background_llm = admitted(llm, Priority.BACKGROUND)
+
+        # A cold session is loaded from PostgreSQL and may be summarized, which must not block the event loop
+        history = await asyncio.to_thread(self._format_chat_history, conversation, background_llm)
+        if COALESCE_QUESTIONS and not history:
+            # Without a history the answer only depends on the question and study program,
+            # so identical questions that are asked at the same time share one pipeline
+            key = (" ".join(question.split()).casefold(), study_program or "")
+            events = self.in_flight.subscribe(
+                key, lambda: self._answer_events(question, "", study_program, interactive_llm, background_llm)
+            )
+        else:
+            COALESCED_REQUESTS.labels(role="bypassed").inc()
+            events = self._answer_events(question, history, study_program, interactive_llm, background_llm)
+
+        answer = None
+        session_id = message_id = None
+        async for kind, data in self.sse_writer.coalesce(events):
+            if kind == "stream":
+                data_to_send = {"type": "stream", "data": data}
+                yield self.sse_writer.frame(data_to_send)
+            elif kind == "reference":
+                # Sent as soon as a document is cited for the first time, so sources can be shown during the stream
+                yield self.sse_writer.frame({"type": "reference", "data": data})
+            elif kind == "answer":
+                # Every subscriber stores the turn in its own session
+                answer = data
+                session_id, message_id = await asyncio.to_thread(
+                    self._record_turn, conversation, question, answer["full_answer"], background_llm
+                )
+            elif kind == "feedback":
+                final_data = {
+                    "type": "final",
+                    "data": {
+                        "session_id": session_id,
+                        "message_id": message_id,
+                        "full_answer": answer["full_answer"],
+                        "feedback_trigger": data,
+                        **({"referenced documents": answer["referenced documents"]}
+                           if "referenced documents" in answer else {}),
+                    },
+                }
+                yield self.sse_writer.frame(final_data)
+
+    async def _answer_events(
+        self,
+        question: str,
+        history: str,
+        study_program: str,
+        interactive_llm: BaseChatModel,
+        background_llm: BaseChatModel,
+    ):
+        """
+        Run the pipeline for a streamed answer, independently of the session it is streamed to.
+        :yield: ("stream", chunk) for every chunk of the answer, ("reference", document) when a document is cited
+        for the first time, then ("answer", {"full_answer", ...}) and finally ("feedback", trigger_feedback)
+        """
+        with stage_timer("first_filter"):
+            # In a thread, so waiting for admission does not block the event loop
+            first_filter_result = await asyncio.to_thread(
+                parse_and_filter_question, question, history, interactive_llm
+            )
 
         if first_filter_result and first_filter_result.get("decision") == "stop":
-            print("First filter applied, stopping here.")
+            logger.debug("First filter applied, stopping here.")
             answer = first_filter_result.get("answer", "Stopped at first filter")
-            
-            self.postgres_history.add_user_message(question)
-            self.postgres_history.add_ai_message(answer)
-
-            final_data = {
-                "type": "final",
-                "data": {
-                    "session_id": self.postgres_history.session_id,
-                    "full_answer": answer,
-                    "feedback_trigger": False,
-                },
-            }
 
             chunk_size = 5
             chunks = answer.split(" ")
 
             for i in range(0, len(chunks), chunk_size):
-                data_to_send = {"type": "stream", "data": " ".join(chunks[i : i + chunk_size])}
-                yield f"{json.dumps(data_to_send)}\n\n"
+                yield "stream", " ".join(chunks[i : i + chunk_size])
 
-            yield f"{json.dumps(final_data)}\n\n"
+            yield "answer", {"full_answer": answer}
+            yield "feedback", False
 
         else:
             language_of_query = first_filter_result.get("language", "English")
             degree_program = map_study_program(study_program)
-            
-            print(f"Degree program: {degree_program}")
-            print("-------------------")
             keyword_string = first_filter_result.get("keywords", "")
+            logger.debug(f"Degree program: {degree_program}, keywords: {keyword_string}")
 
-            print(f"keyword_string: {keyword_string}")
-            print("-------------------")
-
-            few_shot_qa_pairs = get_qa_pairs(degree_program, language_of_query)
-            print(f"Few shot QA pairs: {few_shot_qa_pairs}")
-            print("-------------------")
-
-
-            context = ""
-            look_up_table = {}
-
-            docs_from_vdb = self.chatvec.main.search(
-                query=question,
-                k=3,
-                language=language_of_query,
-                degree_programs=degree_program,
-            )
-            
-            
-            for i, res in enumerate(docs_from_vdb):
-                replaced_text = res.text.replace('\n', ' ')
-                context += f"Document Index: {i+1}, {replaced_text}, {res.subtopic} \n"
-                look_up_table[i+1] = {"title": res.title, "url": res.url}
-
-            print(f"look_up_table: {look_up_table}")
-            print("-------------------")
-            
-            
-            _context = {
-                "context": context     # "question": itemgetter("question"),  # itemgetter("standalone_question")
-                # "few_shot_qa_pairs": itemgetter("few_shot_qa_pairs"),
-            }
-            print(f"_context: {_context}")
+            # Both reach Weaviate or embed the query, in threads so other streams keep flowing meanwhile
+            with stage_timer("few_shot"):
+                few_shot_qa_pairs = await asyncio.to_thread(get_qa_pairs, degree_program, language_of_query)
 
-            
+            with stage_timer("retrieval"):
+                docs_from_vdb = await asyncio.to_thread(
+                    self.chatvec.main.search,
+                    query=question,
+                    k=CONTEXT_CANDIDATES,
+                    language=language_of_query,
+                    degree_programs=degree_program,
+                )
+            context, look_up_table = self.context_builder.build(question, docs_from_vdb)
 
-            conversational_qa_chain = (
-                {
-                    "context": lambda x: _context,
-                    "question": RunnablePassthrough(),
-                    "chat_history": RunnablePassthrough(),
-                    "few_shot_qa_pairs": lambda x: few_shot_qa_pairs,
-                }
-                | ANSWER_PROMPT
-                | llm
-                | StrOutputParser()
-            )
+            conversational_qa_chain = self._answer_chain(interactive_llm, context, few_shot_qa_pairs)
 
             answer = ""
+            citations = CitationTracker(look_up_table)
+            generation_start = time.perf_counter()
 
             async for chunk in conversational_qa_chain.astream(
                 {"question": question, "chat_history": history}
             ):
-                data_to_send = {"type": "stream", "data": chunk}
-                yield f"{json.dumps(data_to_send)}\n\n"
+                if not answer and chunk:
+                    GENERATION_TTFT.observe(time.perf_counter() - generation_start)
+                yield "stream", chunk
+                for document in citations.feed(chunk):
+                    yield "reference", document
                 answer += chunk
 
-            self.postgres_history.add_user_message(question)
-            self.postgres_history.add_ai_message(answer)
-
-            feedback_trigger = get_feedback_trigger(question, answer, llm)
-            print(f"Feedback trigger: {feedback_trigger}")
-
-            
-            
-            final_data = {
-                "type": "final",
-                "data": {
-                    "session_id": self.postgres_history.session_id,
-                    "full_answer": answer,
-                    "feedback_trigger": feedback_trigger.get("trigger_feedback", False),
-                    "referenced documents": extract_documents(answer, look_up_table)
-                },
+            STAGE_LATENCY.labels(stage="generation").observe(time.perf_counter() - generation_start)
+            prompt = ANSWER_PROMPT.format(
+                context=context, question=question, chat_history=history, few_shot_qa_pairs=few_shot_qa_pairs
+            )
+            record_llm_tokens("answer", count_tokens(prompt), count_tokens(answer))
+
+            yield "answer", {"full_answer": answer, "referenced documents": citations.documents}
+
+            feedback_trigger = await asyncio.to_thread(self._get_feedback_trigger, question, answer, background_llm)
+            logger.debug(f"Feedback trigger: {feedback_trigger}")
+            yield "feedback", feedback_trigger.get("trigger_feedback", False)
+
+    async def chat_batch(self, items: list[BatchItem], concurrency: int = BATCH_CONCURRENCY):
+        """
+        Answer many independent questions, e.g. to check the answers to curated questions after a corpus sync.
+        Identical questions are answered once, and the first filter, retrieval and few-shot examples are shared
+        between all questions that need the same input. The conversation history is not stored.
+        :param items: The questions and the study programs they are asked for
+        :param concurrency: The maximum number of LLM calls running at the same time
+        :yield: One result per item as soon as it is done, with the index of the item in the request
+        """
+        # Batch jobs never take capacity from users who are waiting for an answer
+        llm = admitted(self.llm_factory(), Priority.BACKGROUND)
+        semaphore = asyncio.Semaphore(concurrency)
+        shared_tasks: dict[tuple, asyncio.Task] = {}
+
+        def shared(key: tuple, make_coroutine) -> asyncio.Task:
+            # Every distinct piece of work is only started once, all questions needing it await the same task
+            if key not in shared_tasks:
+                shared_tasks[key] = asyncio.ensure_future(make_coroutine())
+            return shared_tasks[key]
+
+        async def first_filter(question: str) -> dict:
+            async with semaphore:
+                return await asyncio.to_thread(parse_and_filter_question, question, "", llm)
+
+        async def answer(question: str, study_program: str) -> dict:
+            first_filter_result = await shared(("filter", question), lambda: first_filter(question))
+            if first_filter_result.get("decision") == "stop":
+                return {"answer": first_filter_result.get("answer"), "filtered": True, "referenced documents": []}
+
+            language_of_query = first_filter_result.get("language", "English")
+            degree_program = map_study_program(study_program)
+            few_shot_qa_pairs = await shared(
+                ("few_shot", degree_program, language_of_query),
+                lambda: asyncio.to_thread(get_qa_pairs, degree_program, language_of_query),
+            )
+            docs_from_vdb = await shared(
+                ("retrieval", question, degree_program, language_of_query),
+                lambda: asyncio.to_thread(
+                    self.chatvec.main.search,
+                    query=question,
+                    k=CONTEXT_CANDIDATES,
+                    language=language_of_query,
+                    degree_programs=degree_program,
+                ),
+            )
+            context, look_up_table = self.context_builder.build(question, docs_from_vdb)
+
+            async with semaphore:
+                with stage_timer("generation"):
+                    answer = await self._answer_chain(llm, context, few_shot_qa_pairs).ainvoke(
+                        {"question": question, "chat_history": ""}
+                    )
+            return {
+                "answer": answer,
+                "filtered": False,
+                "referenced documents": extract_documents(answer, look_up_table),
             }
 
-            yield f"{json.dumps(final_data)}\n\n"
+        async def answer_group(key: tuple[str, str], indices: list[int]) -> tuple[list[int], dict]:
+            try:
+                return indices, await answer(*key)
+            except Exception as error:
+                logger.exception(f"Failed to answer batch question '{key[0]}'")
+                return indices, {"error": str(error)}
+
+        # Group identical questions, ignoring differences in whitespace
+        groups: dict[tuple[str, str], list[int]] = {}
+        for index, item in enumerate(items):
+            key = (" ".join(item.question.split()), item.study_program or "")
+            groups.setdefault(key, []).append(index)
+
+        tasks = [answer_group(key, indices) for key, indices in groups.items()]
+        for finished in asyncio.as_completed(tasks):
+            indices, result = await finished
+            for index in indices:
+                yield {"index": index, "question": items[index].question,
+                       "study_program": items[index].study_program, **result}
 
 
 # Main function to test chatbot locally in terminal
@@ -0,0 +1,50 @@
+import re
+
+_CITATION_PATTERN = re.compile(r"\[([0-9]+)\]")
+
+
+class CitationTracker:
+    """
+    Resolves the document citations of an answer while it is streamed.
+    Chunks are scanned as they arrive, and the beginning of a citation marker at the end of a chunk is kept
+    until the next chunk completes it, so markers like "[1" + "2]" are still found.
+    """
+
+    def __init__(self, look_up_table: dict[int, dict], max_marker_length: int = 8):
+        """
+        :param look_up_table: Maps the document indices in the context to the title and url of the document
+        :param max_marker_length: The longest unfinished marker kept between chunks
+        """
+        self.look_up_table = look_up_table
+        self.max_marker_length = max_marker_length
+        self.documents: list[dict] = []  # Every resolved citation in the order of the answer, like extract_documents
+        self._seen: set[int] = set()
+        self._pending = ""
+
+    def feed(self, chunk: str) -> list[dict]:
+        """
+        Scan the next chunk of the answer.
+        :param chunk: The chunk
+        :return: The documents that are cited for the first time, with their index, title and url
+        """
+        text = self._pending + chunk
+        new_documents = []
+        for match in _CITATION_PATTERN.finditer(text):
+            index = int(match.group(1))
+            document = self.look_up_table.get(index)
+            if not document:
+                continue
+            document = {"index": index, **document}
+            self.documents.append(document)
+            if index not in self._seen:
+                self._seen.add(index)
+                new_documents.append(document)
+
+        # Keep an unfinished marker like "[1" for the next chunk
+        start = text.rfind("[")
+        tail = text[start + 1:] if start != -1 else ""
+        if start != -1 and len(text) - start <= self.max_marker_length and (not tail or tail.isdigit()):
+            self._pending = text[start:]
+        else:
+            self._pending = ""
+        return new_documents
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Hashable
+
+from application.backend.metrics import COALESCED_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    """
+    The events of one running pipeline. They are kept until the pipeline is done,
+    so subscribers that join late still receive the stream from its start.
+    """
+
+    def __init__(self):
+        self.events: list = []
+        self.done = False
+        self.error: BaseException | None = None
+        self._changed = asyncio.Condition()
+
+    async def publish(self, event):
+        async with self._changed:
+            self.events.append(event)
+            self._changed.notify_all()
+
+    async def finish(self, error: BaseException = None):
+        async with self._changed:
+            self.done = True
+            self.error = error
+            self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator:
+        """
+        Iterate over all events of the flight, waiting for new ones until it is done.
+        :raises: The error the pipeline failed with
+        """
+        position = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: position < len(self.events) or self.done)
+                events = self.events[position:]
+                done, error = self.done, self.error
+            for event in events:
+                yield event
+            position += len(events)
+            if done and position == len(self.events):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """
+    Coalesces identical requests that are in flight at the same time:
+    the first request starts the pipeline, every identical request that arrives before it is done
+    attaches to it and receives the same events.
+    The pipeline runs in its own task, so it is not cancelled when the request that started it goes away.
+    """
+
+    def __init__(self):
+        self._flights: dict[Hashable, Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def _run(self, key: Hashable, flight: Flight, events: AsyncIterator):
+        try:
+            async for event in events:
+                await flight.publish(event)
+        except BaseException as error:
+            await flight.finish(error)
+        else:
+            await flight.finish()
+        finally:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def subscribe(self, key: Hashable, start: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """
+        Receive the events of the pipeline for the given key, starting it if none is running.
+        :param key: Identifies requests that produce the same events
+        :param start: Creates the pipeline's event iterator, only called if no identical request is in flight
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight()
+            self._flights[key] = flight
+            asyncio.ensure_future(self._run(key, flight, start()))
+            COALESCED_REQUESTS.labels(role="leader").inc()
+        else:
+            COALESCED_REQUESTS.labels(role="follower").inc()
+        return flight.subscribe()
@@ -0,0 +1,120 @@
+import os
+import re
+
+from application.backend.chatbot.tokens import count_tokens
+from application.backend.datastore.collections.main.schema import Chunk
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", "8"))
+CONTEXT_COMPRESSION = os.getenv("CONTEXT_COMPRESSION", "false").lower() == "true"
+
+_WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+
+def _words(text: str) -> list[str]:
+    return _WORD_PATTERN.findall(text.lower())
+
+
+def _shingles(text: str, size: int = 3) -> set[tuple[str, ...]]:
+    """
+    Split a text into overlapping word n-grams, which are used to detect (near) duplicate chunks.
+    """
+    words = _words(text)
+    if len(words) < size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class ContextBuilder:
+    """
+    Builds the context of the answer prompt from the retrieved chunks.
+
+    - Chunks are packed in order of relevance until the token budget is used up
+    - Chunks that (nearly) duplicate or are contained in an already packed chunk are dropped
+    - Optionally, chunks are compressed to the sentences that are most relevant to the query
+
+    The document indices in the context are assigned to the packed chunks only,
+    so they always match the keys of the returned look-up table.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = CONTEXT_TOKEN_BUDGET,
+        duplicate_threshold: float = 0.8,
+        compress: bool = CONTEXT_COMPRESSION,
+        max_sentences: int = 4,
+    ):
+        self.token_budget = token_budget
+        self.duplicate_threshold = duplicate_threshold
+        self.compress = compress
+        self.max_sentences = max_sentences
+
+    def _is_duplicate(self, shingles: set, packed_shingles: list[set]) -> bool:
+        """
+        Check whether a chunk is a near-duplicate of, or overlaps heavily with, one of the packed chunks.
+        The overlap is measured relative to the smaller chunk, so a chunk that is contained in another is a duplicate.
+        """
+        if not shingles:
+            return True
+        for other in packed_shingles:
+            if not other:
+                continue
+            overlap = len(shingles & other) / min(len(shingles), len(other))
+            if overlap >= self.duplicate_threshold:
+                return True
+        return False
+
+    def _compress(self, text: str, query: str) -> str:
+        """
+        Reduce a chunk to the sentences that share the most words with the query, keeping their original order.
+        """
+        sentences = [sentence for sentence in _SENTENCE_PATTERN.split(text) if sentence.strip()]
+        if len(sentences) <= self.max_sentences:
+            return text
+        query_words = {word for word in _words(query) if len(word) > 2}
+        scored = [
+            (len(query_words.intersection(_words(sentence))), -i, i)
+            for i, sentence in enumerate(sentences)
+        ]
+        selected = sorted(i for _, _, i in sorted(scored, reverse=True)[:self.max_sentences])
+        return " ".join(sentences[i] for i in selected)
+
+    @staticmethod
+    def _format_entry(index: int, text: str, chunk: Chunk) -> str:
+        return f"Document Index: {index}, {text}, {chunk.subtopic} \n"
+
+    def build(self, query: str, chunks: list[Chunk]) -> tuple[str, dict[int, dict]]:
+        """
+        Pack the given chunks into a context string that fits the token budget.
+        :param query: The query the chunks were retrieved for, used for compression
+        :param chunks: The retrieved chunks, ordered from most to least relevant
+        :return: The context string and a look-up table from document index to title and url
+        """
+        context = ""
+        look_up_table = {}
+        packed_shingles = []
+        remaining = self.token_budget
+
+        for chunk in chunks:
+            text = chunk.text.replace("\n", " ").strip()
+            shingles = _shingles(text)
+            if self._is_duplicate(shingles, packed_shingles):
+                continue
+            if self.compress:
+                text = self._compress(text, query)
+
+            index = len(look_up_table) + 1
+            entry = self._format_entry(index, text, chunk)
+            tokens = count_tokens(entry)
+            if tokens > remaining:
+                # A less relevant but shorter chunk might still fit
+                continue
+
+            context += entry
+            url = f"{chunk.url}#page={chunk.page}" if chunk.url and chunk.page else chunk.url
+            look_up_table[index] = {"title": chunk.title, "url": url}
+            packed_shingles.append(shingles)
+            remaining -= tokens
+
+        return context, look_up_table
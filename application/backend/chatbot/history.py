@@ -1,5 +1,7 @@
 import json
 import logging
+import threading
+from collections import OrderedDict, deque
 from typing import List
 import psycopg
 from psycopg.rows import dict_row
@@ -16,6 +18,10 @@ from langchain_core.messages import (
     messages_from_dict,
 )
 
+from application.backend.chatbot.history_schema import HISTORY_TABLE, create_feedback_table, create_schema
+from application.backend.chatbot.history_writer import HistoryWriter
+from application.backend.chatbot.session import WORKERS
+
 host = "som-postgres.postgres.database.azure.com"
 dbname = "postgres"
 user = os.environ.get("POSTGRES_USER")
@@ -24,6 +30,99 @@ password = os.environ.get("POSTGRES_PASSWORD")
 conn_string = "host={0} user={1} dbname={2} password={3}".format(
     host, user, dbname, password
 )
+POSTGRES_USER = user  # Unset when no database is configured, like in the tests
+
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "200"))
+HISTORY_TAIL_SIZE = int(os.getenv("HISTORY_TAIL_SIZE", "20"))
+HISTORY_TAIL_SESSIONS = int(os.getenv("HISTORY_TAIL_SESSIONS", "10000" if WORKERS == 1 else "0"))
+
+
+def _with_pending(stored: List[BaseMessage], pending: List[BaseMessage]) -> List[BaseMessage]:
+    """
+    Append the messages that were queued for the writer before the stored ones were read.
+    The writer may have written the first of them in the meantime, they end the stored messages then.
+    """
+    for overlap in range(min(len(stored), len(pending)), 0, -1):
+        if stored[-overlap:] == pending[:overlap]:
+            return stored + pending[overlap:]
+    return stored + pending
+
+
+class SessionTail:
+    """
+    The most recent messages of a session, already deserialized.
+    """
+
+    messages: deque
+    complete: bool  # Whether the tail holds every message of the session
+
+    def __init__(self, messages: List[BaseMessage], complete: bool, max_messages: int):
+        self.messages = deque(messages, maxlen=max_messages)
+        self.complete = complete and len(messages) <= max_messages
+
+    def append(self, messages: List[BaseMessage]):
+        if len(self.messages) + len(messages) > self.messages.maxlen:
+            self.complete = False
+        self.messages.extend(messages)
+
+
+class HistoryTailCache:
+    """
+    Keeps the last messages of the most recently used sessions in memory and updates them when messages are added,
+    so reading the last turns of an active session needs no query.
+    """
+
+    def __init__(self, tail_size: int = HISTORY_TAIL_SIZE, max_sessions: int = HISTORY_TAIL_SESSIONS):
+        """
+        :param tail_size: The number of messages kept per session
+        :param max_sessions: The maximum number of sessions kept, the least recently used ones are evicted
+        """
+        self.tail_size = tail_size
+        self.max_sessions = max_sessions
+        self._tails: OrderedDict[str, SessionTail] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str, count: int) -> List[BaseMessage] | None:
+        """
+        The last `count` messages of a session, or None if they are not all cached.
+        """
+        with self._lock:
+            tail = self._tails.get(session_id)
+            if tail is None or (len(tail.messages) < count and not tail.complete):
+                return None
+            self._tails.move_to_end(session_id)
+            return list(tail.messages)[-count:] if count else []
+
+    def get_all(self, session_id: str) -> List[BaseMessage] | None:
+        """
+        Every message of a session, or None if the session does not fit into its tail.
+        """
+        with self._lock:
+            tail = self._tails.get(session_id)
+            if tail is None or not tail.complete:
+                return None
+            self._tails.move_to_end(session_id)
+            return list(tail.messages)
+
+    def put(self, session_id: str, messages: List[BaseMessage], complete: bool):
+        with self._lock:
+            self._tails[session_id] = SessionTail(messages, complete, self.tail_size)
+            self._tails.move_to_end(session_id)
+            while len(self._tails) > self.max_sessions:
+                self._tails.popitem(last=False)
+
+    def append(self, session_id: str, messages: List[BaseMessage]):
+        """
+        Append added messages to the tail of a session if it is cached.
+        """
+        with self._lock:
+            tail = self._tails.get(session_id)
+            if tail is not None:
+                tail.append(messages)
+
+    def discard(self, session_id: str):
+        with self._lock:
+            self._tails.pop(session_id, None)
 
 
 class PostgresChatMessageHistory(BaseChatMessageHistory):
@@ -33,69 +132,131 @@ class PostgresChatMessageHistory(BaseChatMessageHistory):
         self,
         session_id: str,
         connection_string: str = conn_string,
-        table_name: str = "message_store_19_03_2024",
+        table_name: str = HISTORY_TABLE,
+        connection: psycopg.Connection | None = None,
+        writer: HistoryWriter | None = None,
+        tails: HistoryTailCache | None = None,
     ):
+        """
+        :param connection: An open autocommit connection to share with other histories.
+        The table is expected to exist already and the connection is not closed by this history.
+        :param writer: Writes added messages in the background instead of in the request, if given
+        :param tails: The cache of recent messages to share with other histories, a new one by default
+        """
+        self.connection = None
+        self.cursor = None
+        self._owns_connection = connection is None
         try:
-            self.connection = psycopg.connect(connection_string)
+            # Reads are not wrapped in a transaction, an idle one would block the partition maintenance
+            self.connection = connection if connection is not None \
+                else psycopg.connect(connection_string, autocommit=True)
             self.cursor = self.connection.cursor(row_factory=dict_row)
         except psycopg.OperationalError as error:
             print(f"Error: {error}")
 
         self.session_id = session_id
         self.table_name = table_name
+        self.writer = writer
+        self.tails = tails if tails is not None else HistoryTailCache()
 
-        self._create_table_if_not_exists()
+        if self._owns_connection:
+            try:
+                self._create_table_if_not_exists()
+            except Exception:
+                self.close()
+                raise
+
+    def for_session(self, session_id: str) -> "PostgresChatMessageHistory":
+        """
+        Create a history for another session which shares this history's connection.
+        :param session_id: The id of the other session
+        """
+        return PostgresChatMessageHistory(
+            session_id, table_name=self.table_name, connection=self.connection, writer=self.writer, tails=self.tails
+        )
 
     def _create_table_if_not_exists(self) -> None:
-        create_table_query = f"""CREATE TABLE IF NOT EXISTS {self.table_name} (
-            id SERIAL PRIMARY KEY,
-            session_id TEXT NOT NULL,
-            message JSONB NOT NULL,
-            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
-            feedback_classification TEXT DEFAULT NULL,
-            feedback TEXT DEFAULT NULL
-        );"""
-        self.cursor.execute(create_table_query)
+        create_schema(self.connection, self.table_name)
+        create_feedback_table(self.connection)
         self.connection.commit()
 
     @property
     def messages(self) -> List[BaseMessage]:  # type: ignore
-        """Retrieve the messages from PostgreSQL"""
-        query = (
-            f"SELECT message FROM {self.table_name} WHERE session_id = %s ORDER BY id;"
-        )
-        self.cursor.execute(query, (self.session_id,))
-        items = [record["message"] for record in self.cursor.fetchall()]
-        messages = messages_from_dict(items)
+        """Retrieve the messages from PostgreSQL, page by page"""
+        cached = self.tails.get_all(self.session_id)
+        if cached is not None:
+            return cached
+
+        pending = self._pending()  # Before reading, so messages written in between are not missed
+        messages = []
+        query = sql.SQL(
+            "SELECT id, message FROM {} WHERE session_id = %s AND id > %s ORDER BY id LIMIT %s;"
+        ).format(sql.Identifier(self.table_name))
+        after = 0
+        while True:
+            self.cursor.execute(query, (self.session_id, after, HISTORY_PAGE_SIZE))
+            records = self.cursor.fetchall()
+            messages.extend(messages_from_dict([record["message"] for record in records]))
+            if len(records) < HISTORY_PAGE_SIZE:
+                break
+            after = records[-1]["id"]
+        messages = _with_pending(messages, pending)
+        self.tails.put(self.session_id, messages[-self.tails.tail_size:], complete=len(messages) <= self.tails.tail_size)
         return messages
 
+    def page(self, before: int | None = None, limit: int = HISTORY_PAGE_SIZE) -> tuple[List[BaseMessage], int | None]:
+        """
+        Read the messages of the session backwards, one page at a time.
+        The newest page also holds the messages that are queued for the writer.
+        :param before: The cursor returned with the previous page, None for the newest page
+        :param limit: The maximum number of stored messages in the page
+        :return: The messages of the page, oldest first, and the cursor of the next older page or None at the start
+        """
+        query = sql.SQL("SELECT id, message FROM {} WHERE session_id = %s {} ORDER BY id DESC LIMIT %s;").format(
+            sql.Identifier(self.table_name), sql.SQL("AND id < %s") if before is not None else sql.SQL("")
+        )
+        params = (self.session_id, before, limit) if before is not None else (self.session_id, limit)
+        pending = self._pending() if before is None else []
+        self.cursor.execute(query, params)
+        records = self.cursor.fetchall()[::-1]
+        messages = _with_pending(messages_from_dict([record["message"] for record in records]), pending)
+        return messages, records[0]["id"] if len(records) == limit else None
+
+    def _pending(self) -> List[BaseMessage]:
+        return self.writer.pending(self.session_id) if self.writer is not None else []
+
     def add_message(self, message: BaseMessage) -> None:
         """Append the message to the record in PostgreSQL"""
+        self.add_messages([message])
 
-        query = sql.SQL("INSERT INTO {} (session_id, message) VALUES (%s, %s);").format(
-            sql.Identifier(self.table_name)
-        )
-        self.cursor.execute(
-            query, (self.session_id, json.dumps(message_to_dict(message)))
-        )
-        self.connection.commit()
+    def add_messages(self, messages: List[BaseMessage]) -> None:
+        """Append the messages to the record in PostgreSQL in one transaction, or queue them for the writer"""
+        self.tails.append(self.session_id, messages)
+        if self.writer is not None and self.writer.submit(self.session_id, messages):
+            return
+        # Without a writer, or when its queue is full, the messages are written right away
 
-    def add_feedback_to_message(self, feedback: str, feedback_classification: str) -> None:
-        """Update the feedback for all messages in the PostgreSQL database based on session ID."""
-        query = sql.SQL("UPDATE {} SET feedback = %s, feedback_classification = %s WHERE session_id = %s;").format(
+        query = sql.SQL("INSERT INTO {} (session_id, message) VALUES (%s, %s);").format(
             sql.Identifier(self.table_name)
         )
-        self.cursor.execute(query, (feedback, feedback_classification, self.session_id))
-        self.connection.commit()
+        with self.connection.transaction():
+            self.cursor.executemany(
+                query, [(self.session_id, json.dumps(message_to_dict(message))) for message in messages]
+            )
 
     def clear(self) -> None:
         """Clear session memory from PostgreSQL"""
+        self.tails.discard(self.session_id)
         query = f"DELETE FROM {self.table_name} WHERE session_id = %s;"
         self.cursor.execute(query, (self.session_id,))
         self.connection.commit()
 
-    def __del__(self) -> None:
+    def close(self) -> None:
+        """Close the connection if this history opened it"""
         if self.cursor:
             self.cursor.close()
-        if self.connection:
+        if self.connection and self._owns_connection:
             self.connection.close()
+
+    def __del__(self) -> None:
+        self.close()
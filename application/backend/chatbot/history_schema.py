@@ -0,0 +1,275 @@
+"""
+Schema of the chat history table.
+
+The history is range partitioned by month on `created_at` and indexed on `(session_id, id)`,
+so reading and clearing the turns of a session only touches the index entries of that session.
+Partitions are created ahead of time and expired months are dropped as a whole instead of deleted row by row.
+The turns of the unpartitioned legacy table are copied into the new table when its schema is created,
+as long as it is empty, so existing conversations stay available after the switch.
+
+Usage:
+    python -m application.backend.chatbot.history_schema maintain
+    python -m application.backend.chatbot.history_schema migrate [--source message_store_19_03_2024]
+"""
+import argparse
+import logging
+import os
+import re
+import threading
+from datetime import date, datetime, timezone
+from typing import Callable
+
+import psycopg
+from psycopg import sql
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TABLE = os.getenv("HISTORY_TABLE", "chat_history")
+FEEDBACK_TABLE = os.getenv("FEEDBACK_TABLE", "chat_feedback")
+LEGACY_HISTORY_TABLE = "message_store_19_03_2024"
+HISTORY_PARTITIONS_AHEAD = int(os.getenv("HISTORY_PARTITIONS_AHEAD", "2"))
+HISTORY_RETENTION_MONTHS = int(os.getenv("HISTORY_RETENTION_MONTHS", "0"))  # 0 keeps the history forever
+HISTORY_MAINTENANCE_INTERVAL_HOURS = float(os.getenv("HISTORY_MAINTENANCE_INTERVAL_HOURS", "24"))
+# Maintenance gives up instead of queueing the history reads and writes behind its exclusive locks
+HISTORY_MAINTENANCE_LOCK_TIMEOUT_MS = int(os.getenv("HISTORY_MAINTENANCE_LOCK_TIMEOUT_MS", "5000"))
+
+_PARTITION_SUFFIX = re.compile(r"_p(\d{4})_(\d{2})$")
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table_name: str, month: date) -> str:
+    return f"{table_name}_p{month.year:04d}_{month.month:02d}"
+
+
+def _this_month() -> date:
+    today = datetime.now(timezone.utc).date()
+    return today.replace(day=1)
+
+
+def create_schema(
+    connection: psycopg.Connection, table_name: str = HISTORY_TABLE, legacy_table: str | None = LEGACY_HISTORY_TABLE
+):
+    """
+    Create the partitioned history table, its index and the partitions of the coming months, if they do not exist.
+    Rows outside all monthly partitions go to a default partition, so a missed maintenance never fails a write.
+    :param legacy_table: The unpartitioned table to migrate from while the new one is empty, None to skip it.
+    Only the startup migrates, a table emptied by the retention must not be refilled with expired turns
+    """
+    table = sql.Identifier(table_name)
+    with connection.transaction():
+        connection.execute(sql.SQL("""CREATE TABLE IF NOT EXISTS {} (
+            id BIGSERIAL,
+            session_id TEXT NOT NULL,
+            message JSONB NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            feedback_classification TEXT DEFAULT NULL,
+            feedback TEXT DEFAULT NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);""").format(table))
+        connection.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (session_id, id);").format(
+            sql.Identifier(f"{table_name}_session_idx"), table
+        ))
+        connection.execute(sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} DEFAULT;").format(
+            sql.Identifier(f"{table_name}_default"), table
+        ))
+    ensure_partitions(connection, table_name)
+    if legacy_table is not None:
+        migrate(connection, legacy_table, table_name)
+
+
+def create_feedback_table(connection: psycopg.Connection, table_name: str = FEEDBACK_TABLE):
+    """
+    Create the append-only feedback table if it does not exist.
+    Feedback refers to a session and, if it rates one answer, to the id of that answer's message.
+    """
+    with connection.transaction():
+        connection.execute(sql.SQL("""CREATE TABLE IF NOT EXISTS {} (
+            id BIGSERIAL PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            message_id TEXT DEFAULT NULL,
+            classification TEXT NOT NULL,
+            feedback TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );""").format(sql.Identifier(table_name)))
+        connection.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (session_id);").format(
+            sql.Identifier(f"{table_name}_session_idx"), sql.Identifier(table_name)
+        ))
+
+
+def ensure_partitions(
+    connection: psycopg.Connection,
+    table_name: str = HISTORY_TABLE,
+    start: date | None = None,
+    months_ahead: int = HISTORY_PARTITIONS_AHEAD,
+) -> list[str]:
+    """
+    Create the monthly partitions from `start` up to `months_ahead` months after the current one.
+    Rows of a new partition's month that were written to the default partition are moved into it.
+    :return: The names of the created partitions
+    """
+    created = []
+    month = (start or _this_month()).replace(day=1)
+    last = add_months(_this_month(), months_ahead)
+    while month <= last:
+        name = partition_name(table_name, month)
+        if not _exists(connection, name):
+            _create_partition(connection, table_name, name, month, add_months(month, 1))
+            created.append(name)
+        month = add_months(month, 1)
+    if created:
+        logger.info(f"Created history partitions {', '.join(created)}")
+    return created
+
+
+def _exists(connection: psycopg.Connection, name: str) -> bool:
+    return connection.execute("SELECT to_regclass(%s) IS NOT NULL;", (name,)).fetchone()[0]
+
+
+def _create_partition(connection: psycopg.Connection, table_name: str, name: str, start: date, end: date):
+    table, partition, default = (sql.Identifier(table_name), sql.Identifier(name),
+                                 sql.Identifier(f"{table_name}_default"))
+    bounds = sql.SQL("created_at >= {} AND created_at < {}").format(sql.Literal(start), sql.Literal(end))
+    with connection.transaction():
+        # A partition cannot be attached while the default partition holds rows of its range, so they are moved
+        connection.execute(sql.SQL("CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS);").format(partition, table))
+        connection.execute(sql.SQL("WITH moved AS (DELETE FROM {} WHERE {} RETURNING *) INSERT INTO {} "
+                                   "SELECT * FROM moved;").format(default, bounds, partition))
+        connection.execute(sql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM ({}) TO ({});").format(
+            table, partition, sql.Literal(start), sql.Literal(end)
+        ))
+
+
+def drop_expired_partitions(
+    connection: psycopg.Connection,
+    table_name: str = HISTORY_TABLE,
+    retention_months: int = HISTORY_RETENTION_MONTHS,
+) -> list[str]:
+    """
+    Drop the monthly partitions that ended more than `retention_months` months ago.
+    :return: The names of the dropped partitions
+    """
+    if retention_months <= 0:
+        return []
+    cutoff = add_months(_this_month(), -retention_months)
+    partitions = connection.execute(
+        "SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass(%s);", (table_name,)
+    ).fetchall()
+    dropped = []
+    for (name,) in partitions:
+        match = _PARTITION_SUFFIX.search(name)
+        if match and add_months(date(int(match[1]), int(match[2]), 1), 1) <= cutoff:
+            with connection.transaction():
+                connection.execute(sql.SQL("DROP TABLE {};").format(sql.Identifier(name)))
+            dropped.append(name)
+    if dropped:
+        logger.info(f"Dropped expired history partitions {', '.join(dropped)}")
+    return dropped
+
+
+def maintain(connection: psycopg.Connection, table_name: str = HISTORY_TABLE):
+    """
+    Create the partitions of the coming months and drop the expired ones.
+    Fails if a lock is not granted within HISTORY_MAINTENANCE_LOCK_TIMEOUT_MS, the next maintenance tries again.
+    """
+    connection.execute(sql.SQL("SET lock_timeout = {};").format(sql.Literal(HISTORY_MAINTENANCE_LOCK_TIMEOUT_MS)))
+    create_schema(connection, table_name, legacy_table=None)
+    drop_expired_partitions(connection, table_name)
+
+
+def _is_empty(connection: psycopg.Connection, table_name: str) -> bool:
+    return not connection.execute(sql.SQL("SELECT EXISTS (SELECT 1 FROM {});").format(
+        sql.Identifier(table_name)
+    )).fetchone()[0]
+
+
+def migrate(connection: psycopg.Connection, source: str = LEGACY_HISTORY_TABLE, table_name: str = HISTORY_TABLE) -> int:
+    """
+    Copy the turns of an unpartitioned history table into the partitioned one, in their original order.
+    The turns are only copied while the partitioned table is empty, so running it again does not duplicate them.
+    Concurrent processes wait for the one copying, the copy is a single transaction.
+    :return: The number of copied rows
+    """
+    if not _exists(connection, source) or not _is_empty(connection, table_name):
+        return 0
+    first = connection.execute(sql.SQL("SELECT MIN(created_at) FROM {};").format(sql.Identifier(source))).fetchone()[0]
+    if first is None:
+        return 0
+    ensure_partitions(connection, table_name, start=first.date())
+    with connection.transaction():
+        connection.execute("SELECT pg_advisory_xact_lock(hashtext(%s));", (f"migrate {table_name}",))
+        if not _is_empty(connection, table_name):  # Another process copied the turns while this one waited
+            return 0
+        cursor = connection.execute(sql.SQL(
+            "INSERT INTO {} (session_id, message, created_at, feedback_classification, feedback) "
+            "SELECT session_id, message, created_at, feedback_classification, feedback FROM {} ORDER BY id;"
+        ).format(sql.Identifier(table_name), sql.Identifier(source)))
+        logger.info(f"Copied {cursor.rowcount} messages from {source} to {table_name}")
+        return cursor.rowcount
+
+
+class HistoryMaintenance:
+    """
+    Runs the partition maintenance in a background thread, so a long-running API creates the partitions of new months.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], psycopg.Connection],
+        table_name: str = HISTORY_TABLE,
+        interval: float = HISTORY_MAINTENANCE_INTERVAL_HOURS * 3600,
+    ):
+        """
+        :param connect: Opens an autocommit connection, otherwise the whole pass would run in one transaction
+        holding the locks of every dropped partition
+        :param table_name: The partitioned history table
+        :param interval: The time in seconds between two maintenance passes
+        """
+        self.connect = connect
+        self.table_name = table_name
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="history-maintenance", daemon=True)
+
+    def start(self) -> "HistoryMaintenance":
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                with self.connect() as connection:
+                    maintain(connection, self.table_name)
+            except Exception as error:
+                logger.error(f"History maintenance failed: {error}")
+
+    def stop(self):
+        self._stopped.set()
+
+
+def main():
+    from application.backend.chatbot.history import conn_string
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("maintain", help="Create upcoming partitions and drop expired ones")
+    migrate_parser = commands.add_parser("migrate", help="Copy an unpartitioned history table into the new schema")
+    migrate_parser.add_argument("--source", default=LEGACY_HISTORY_TABLE, help="The table to copy from")
+    args = parser.parse_args()
+
+    with psycopg.connect(conn_string, autocommit=True) as connection:
+        if args.command == "maintain":
+            maintain(connection)
+        else:
+            create_schema(connection, legacy_table=None)
+            rows = migrate(connection, args.source)
+            print(f"Copied {rows} messages from {args.source} to {HISTORY_TABLE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import abc
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Iterable
+
+import psycopg
+from langchain_core.messages import BaseMessage, message_to_dict
+from psycopg import sql
+
+from application.backend.metrics import WRITE_QUEUE_DEPTH, stage_timer
+
+logger = logging.getLogger(__name__)
+
+HISTORY_WRITE_BEHIND = os.getenv("HISTORY_WRITE_BEHIND", "true").lower() == "true"
+HISTORY_WRITE_QUEUE_SIZE = int(os.getenv("HISTORY_WRITE_QUEUE_SIZE", "10000"))
+HISTORY_WRITE_BATCH_SIZE = int(os.getenv("HISTORY_WRITE_BATCH_SIZE", "500"))
+HISTORY_FLUSH_INTERVAL_MS = int(os.getenv("HISTORY_FLUSH_INTERVAL_MS", "200"))
+
+
+class BatchWriter(abc.ABC):
+    """
+    Appends rows to a table in the background, so requests do not wait for the database.
+
+    - Items are queued and written by a worker thread with its own connection
+    - Everything that is queued when the worker wakes up is written with one COPY in one transaction
+    - The queue is bounded, when it is full submissions are rejected right away instead of blocking the caller
+    - Failed batches are retried with a backoff, so a database outage does not lose items right away
+    - Closing the writer flushes all queued items, which the API does on shutdown
+    """
+
+    columns: tuple[str, ...]
+    stage = "history_flush"  # The stage the writes are timed as
+
+    def __init__(
+        self,
+        connect: Callable[[], psycopg.Connection],
+        table_name: str,
+        max_queue: int = HISTORY_WRITE_QUEUE_SIZE,
+        batch_size: int = HISTORY_WRITE_BATCH_SIZE,
+        flush_interval: float = HISTORY_FLUSH_INTERVAL_MS / 1000,
+        max_attempts: int = 5,
+    ):
+        """
+        :param connect: Opens a connection to the database
+        :param table_name: The table the rows are appended to
+        :param max_queue: The maximum number of queued items
+        :param batch_size: The maximum number of items written in one transaction
+        :param flush_interval: The maximum time in seconds an item waits before it is written
+        :param max_attempts: The number of times a batch is tried before it is dropped
+        """
+        self.connect = connect
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._closed = threading.Event()
+        self._connection: psycopg.Connection | None = None
+        self._worker = threading.Thread(target=self._run, name=f"writer-{table_name}", daemon=True)
+        self._worker.start()
+
+    def _put(self, item, block: bool = True):
+        """
+        Queue an item.
+        :param block: Whether to wait for space in the queue, otherwise queue.Full is raised
+        """
+        if self._closed.is_set():
+            raise RuntimeError(f"The writer of {self.table_name} is closed")
+        self._queue.put(item, block=block)
+        WRITE_QUEUE_DEPTH.labels(table=self.table_name).set(self._queue.qsize())
+
+    @abc.abstractmethod
+    def _rows(self, item) -> Iterable[tuple]:
+        """
+        The rows an item is written as, with one value per column.
+        """
+
+    def _take_batch(self) -> list:
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: list):
+        if self._connection is None or self._connection.closed:
+            self._connection = self.connect()
+        copy_query = sql.SQL("COPY {} ({}) FROM STDIN").format(
+            sql.Identifier(self.table_name), sql.SQL(", ").join(map(sql.Identifier, self.columns))
+        )
+        with stage_timer(self.stage):
+            with self._connection.transaction():
+                with self._connection.cursor() as cursor:
+                    with cursor.copy(copy_query) as copy:
+                        for item in batch:
+                            for row in self._rows(item):
+                                copy.write_row(row)
+
+    def _written(self, batch: list):
+        for _ in batch:
+            self._queue.task_done()
+        WRITE_QUEUE_DEPTH.labels(table=self.table_name).set(self._queue.qsize())
+
+    def _run(self):
+        while not (self._closed.is_set() and self._queue.empty()):
+            batch = self._take_batch()
+            for attempt in range(1, self.max_attempts + 1):
+                if not batch:
+                    break
+                try:
+                    self._write(batch)
+                    break
+                except Exception as error:
+                    logger.error(f"Failed to write {len(batch)} items to {self.table_name} (attempt {attempt}): {error}")
+                    if self._connection is not None:
+                        self._connection.close()
+                    if attempt < self.max_attempts:
+                        time.sleep(min(0.5 * 2 ** (attempt - 1), 10))
+            else:
+                logger.error(f"Dropping {len(batch)} items that could not be written to {self.table_name}")
+            if batch:
+                self._written(batch)
+        if self._connection is not None:
+            self._connection.close()
+
+    def flush(self):
+        """
+        Wait until every queued item is written.
+        """
+        self._queue.join()
+
+    def close(self, timeout: float = 30):
+        """
+        Write all queued items and stop the worker.
+        :param timeout: The maximum time in seconds to wait for the queue to be written
+        """
+        self._closed.set()
+        self._worker.join(timeout)
+        if self._worker.is_alive():
+            logger.error(f"The writer of {self.table_name} did not finish within {timeout}s, "
+                         f"{self._queue.qsize()} items are lost")
+
+
+class HistoryWriter(BatchWriter):
+    """
+    Writes the turns of chat sessions to the history table.
+    Queued turns stay readable through `pending` until they are written.
+    """
+
+    columns = ("session_id", "message")
+
+    def __init__(self, connect: Callable[[], psycopg.Connection], table_name: str, **kwargs):
+        super().__init__(connect, table_name, **kwargs)
+        self._pending: dict[str, list[BaseMessage]] = {}  # Queued messages per session, for reads before the write
+        self._lock = threading.Lock()
+
+    def submit(self, session_id: str, messages: list[BaseMessage]) -> bool:
+        """
+        Queue the messages of a turn to be written in order, without waiting.
+        It is called from the request handlers, which must not stall while the database is unreachable.
+        :param session_id: The session the messages belong to
+        :param messages: The messages, written in one transaction
+        :return: Whether the messages were queued, False if the queue is full
+        """
+        with self._lock:  # The worker cannot mark the turn as written before it is pending
+            try:
+                self._put((session_id, messages), block=False)
+            except queue.Full:
+                logger.warning(f"History queue is full, rejected a turn of session {session_id}")
+                return False
+            self._pending.setdefault(session_id, []).extend(messages)
+        return True
+
+    def pending(self, session_id: str) -> list[BaseMessage]:
+        """
+        The messages of a session that are queued but not written yet.
+        """
+        with self._lock:
+            return list(self._pending.get(session_id, []))
+
+    def _rows(self, item: tuple[str, list[BaseMessage]]) -> Iterable[tuple]:
+        session_id, messages = item
+        for message in messages:
+            yield session_id, json.dumps(message_to_dict(message))
+
+    def _written(self, batch: list[tuple[str, list[BaseMessage]]]):
+        with self._lock:
+            for session_id, messages in batch:
+                pending = self._pending.get(session_id, [])
+                del pending[:len(messages)]
+                if not pending:
+                    self._pending.pop(session_id, None)
+        super()._written(batch)
+
+
+class FeedbackWriter(BatchWriter):
+    """
+    Appends feedback on answers to the feedback table.
+    """
+
+    columns = ("session_id", "message_id", "classification", "feedback")
+    stage = "feedback_flush"
+
+    def submit(self, session_id: str, message_id: str | None, classification: str, feedback: str) -> bool:
+        """
+        Queue a feedback submission without waiting.
+        :param session_id: The session of the rated answer
+        :param message_id: The id of the rated answer, None for feedback on the whole session
+        :return: Whether the feedback was queued, False if the queue is full
+        """
+        try:
+            self._put((session_id, message_id, classification, feedback), block=False)
+        except queue.Full:
+            logger.warning(f"Feedback queue is full, rejected feedback for session {session_id}")
+            return False
+        return True
+
+    def _rows(self, item: tuple) -> Iterable[tuple]:
+        yield item
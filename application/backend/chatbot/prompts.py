@@ -133,4 +133,23 @@ create_email_template = """
     Email:
 """
 
+summarize_history_template = """
+    Progressively summarize the lines of a conversation between a student and the TUM School of Management chatbot,
+    adding onto the previous summary and returning a new summary.
+    Keep facts that might matter for later questions, such as the student's degree program, semester and concrete requests.
+    Write the summary in the same language as the conversation and keep it short.
+
+    <summary>
+    {summary}
+    </summary>
+
+    <new_lines>
+    {new_lines}
+    </new_lines>
+
+    New summary:
+"""
+
+SUMMARIZE_HISTORY_PROMPT = PromptTemplate.from_template(summarize_history_template)
+
 DEFAULT_DOCUMENT_PROMPT = PromptTemplate.from_template(template="{page_content}")
@@ -0,0 +1,88 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+from application.backend.metrics import CACHE_HITS, CACHE_MISSES
+
+# uvicorn starts this many worker processes. Per-process caches of sessions would go stale when another worker
+# serves the next turn, so they are off by default with more than one worker
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "5000" if WORKERS == 1 else "0"))
+
+
+class SessionState:
+    """
+    The server-side state of a chat session.
+    Besides the messages, it holds the formatted history for the next prompt once it has been built,
+    together with the version of the session it was built for.
+    """
+
+    messages: list
+    formatted_history: str | None
+    formatted_for: tuple | None
+
+    def __init__(self, messages: list):
+        self.messages = messages
+        self.formatted_history = None
+        self.formatted_for = None
+
+
+class SessionStore:
+    """
+    A hot in-memory cache of recent chat sessions, so clients only have to send the session uuid and their new
+    question instead of the whole conversation.
+    The least recently used sessions are evicted, and sessions that are not cached are loaded from the backing store.
+    """
+
+    def __init__(self, load_messages: Callable[[str], list], max_sessions: int = SESSION_CACHE_SIZE):
+        """
+        :param load_messages: Loads the messages of a session that is not cached, oldest first
+        :param max_sessions: The maximum number of sessions kept in memory
+        """
+        self.load_messages = load_messages
+        self.max_sessions = max_sessions
+        self._sessions: OrderedDict[str, SessionState] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> SessionState:
+        """
+        Get the state of a session, loading it from the backing store on a cache miss.
+        :param session_id: The uuid of the session
+        """
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is not None:
+                self._sessions.move_to_end(session_id)
+                CACHE_HITS.labels(cache="session").inc()
+                return state
+
+        CACHE_MISSES.labels(cache="session").inc()
+        state = SessionState(self.load_messages(session_id))
+        with self._lock:
+            # Another request might have loaded the session in the meantime
+            state = self._sessions.setdefault(session_id, state)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return state
+
+    def append(self, session_id: str, *messages):
+        """
+        Append messages to a session if it is cached. Uncached sessions are loaded with all messages on their next use.
+        :param session_id: The uuid of the session
+        :param messages: The new messages
+        """
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is not None:
+                state.messages.extend(messages)
+                state.formatted_history = None
+                state.formatted_for = None
+
+    def discard(self, session_id: str):
+        """
+        Remove a session from the cache.
+        """
+        with self._lock:
+            self._sessions.pop(session_id, None)
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import os
+from collections import deque
+from typing import AsyncIterator, Callable
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+SSE_FRAME_MAX_CHARS = int(os.getenv("SSE_FRAME_MAX_CHARS", "64"))
+SSE_FRAME_MAX_DELAY_MS = int(os.getenv("SSE_FRAME_MAX_DELAY_MS", "50"))
+
+
+def dumps(data) -> str:
+    """
+    Serialize data to JSON, with orjson if it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(data).decode("utf-8")
+    return json.dumps(data)
+
+
+class SSEWriter:
+    """
+    Turns the events of the chat pipeline into SSE frames.
+
+    Consecutive answer chunks are coalesced into one frame until it holds `max_chars` characters
+    or the oldest chunk in it has waited `max_delay` seconds. The first chunk of an answer is always sent right away,
+    so coalescing never delays the time to first token. Other events flush pending chunks before they are sent.
+    """
+
+    def __init__(
+        self,
+        max_chars: int = SSE_FRAME_MAX_CHARS,
+        max_delay: float = SSE_FRAME_MAX_DELAY_MS / 1000,
+        encode: Callable[[dict], str] = dumps,
+    ):
+        """
+        :param max_chars: The size at which a frame is sent, 0 sends every chunk in its own frame
+        :param max_delay: The maximum time in seconds a chunk waits for more chunks
+        :param encode: Serializes the data of a frame
+        """
+        self.max_chars = max_chars
+        self.max_delay = max_delay
+        self.encode = encode
+
+    def frame(self, data: dict) -> str:
+        return f"{self.encode(data)}\n\n"
+
+    async def coalesce(self, events: AsyncIterator[tuple[str, object]]) -> AsyncIterator[tuple[str, object]]:
+        """
+        Merge consecutive ("stream", chunk) events.
+        :param events: (kind, data) events of the pipeline
+        :yield: The same events, with runs of stream events merged into fewer, larger ones
+        """
+        if self.max_chars <= 0 or self.max_delay <= 0:
+            async for event in events:
+                yield event
+            return
+
+        loop = asyncio.get_running_loop()
+        ready = deque()  # Events that can be sent
+        wake = asyncio.Event()
+        buffer: list[str] = []
+        buffered_chars = 0
+        timer: asyncio.TimerHandle | None = None
+        finished = False
+        error: BaseException | None = None
+
+        def flush():
+            nonlocal buffered_chars, timer
+            if timer is not None:
+                timer.cancel()
+                timer = None
+            if buffer:
+                ready.append(("stream", "".join(buffer)))
+                buffer.clear()
+                buffered_chars = 0
+            wake.set()
+
+        async def read():
+            # Reads in its own task, so a frame can be sent when its window ends even if no new chunk arrives.
+            # This costs one task and one timer per frame instead of a task per chunk.
+            nonlocal buffered_chars, timer, finished, error
+            first_chunk = True
+            try:
+                async for kind, data in events:
+                    if kind != "stream":
+                        flush()
+                        ready.append((kind, data))
+                    elif first_chunk and data:
+                        first_chunk = False
+                        ready.append((kind, data))
+                        wake.set()
+                    else:
+                        buffer.append(data)
+                        buffered_chars += len(data)
+                        if buffered_chars >= self.max_chars:
+                            flush()
+                        elif timer is None:
+                            timer = loop.call_later(self.max_delay, flush)
+            except BaseException as exception:
+                error = exception
+            finally:
+                flush()
+                finished = True
+
+        reader = asyncio.ensure_future(read())
+        try:
+            while True:
+                await wake.wait()
+                wake.clear()
+                while ready:
+                    yield ready.popleft()
+                if finished:
+                    if error is not None:
+                        raise error
+                    return
+        finally:
+            reader.cancel()
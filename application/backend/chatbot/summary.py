@@ -0,0 +1,185 @@
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.language_models import BaseChatModel
+
+from application.backend.chatbot.prompts import SUMMARIZE_HISTORY_PROMPT
+from application.backend.chatbot.tokens import count_tokens, truncate_to_tokens
+from application.backend.metrics import CACHE_HITS, CACHE_MISSES, record_llm_tokens
+
+logger = logging.getLogger(__name__)
+
+HISTORY_RECENT_TURNS = int(os.getenv("HISTORY_RECENT_TURNS", "3"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1000"))
+HISTORY_MAX_SESSIONS = int(os.getenv("HISTORY_MAX_SESSIONS", "10000"))
+
+
+def format_messages(messages: list) -> str:
+    """
+    Format chat messages as one "role: content" line per message.
+    :param messages: Objects with a `role` and a `content` attribute
+    :return: The formatted messages
+    """
+    return "\n".join(f"{message.role}: {message.content}" for message in messages)
+
+
+def fingerprint(messages: list) -> str:
+    """
+    Hash the given messages, so a cached summary is only reused for the conversation it was created from.
+    """
+    sha1 = hashlib.sha1()
+    for message in messages:
+        sha1.update(f"{message.role}\0{message.content}\0".encode("utf-8"))
+    return sha1.hexdigest()
+
+
+class SessionSummary:
+    """
+    The rolling summary of the older part of a conversation.
+    """
+
+    summary: str
+    summarized_count: int  # The number of messages from the start of the conversation that the summary covers
+    fingerprint: str  # The fingerprint of the summarized messages
+
+    def __init__(self, summary: str = "", summarized_count: int = 0, fingerprint: str = ""):
+        self.summary = summary
+        self.summarized_count = summarized_count
+        self.fingerprint = fingerprint
+
+    def covers(self, messages: list) -> bool:
+        """
+        Whether this summary was created from the start of the given messages.
+        """
+        return self.summarized_count <= len(messages) and \
+            self.fingerprint == fingerprint(messages[:self.summarized_count])
+
+
+class HistoryCompactor:
+    """
+    Compacts chat histories so their size does not grow with the length of the conversation.
+
+    - The last turns of a conversation are kept verbatim
+    - Older messages are folded into a summary which is cached per session and updated incrementally
+    - Summaries are refreshed in the background, a request never waits for the LLM to summarize
+    - The formatted history is bounded by a token budget
+    """
+
+    def __init__(
+        self,
+        recent_turns: int = HISTORY_RECENT_TURNS,
+        token_budget: int = HISTORY_TOKEN_BUDGET,
+        max_sessions: int = HISTORY_MAX_SESSIONS,
+    ):
+        self.recent_messages = recent_turns * 2  # One turn is a question and an answer
+        self.token_budget = token_budget
+        self.max_sessions = max_sessions
+        self._summaries: OrderedDict[str, SessionSummary] = OrderedDict()
+        self._refreshing: set[str] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+
+    def get_summary(self, session_id: str) -> SessionSummary | None:
+        with self._lock:
+            summary = self._summaries.get(session_id)
+            if summary is not None:
+                self._summaries.move_to_end(session_id)
+            return summary
+
+    def _store_summary(self, session_id: str, summary: SessionSummary):
+        with self._lock:
+            current = self._summaries.get(session_id)
+            # Never replace a summary of the same conversation with one that covers less of it
+            if current is None or current.summarized_count < summary.summarized_count \
+                    or current.fingerprint != summary.fingerprint:
+                self._summaries[session_id] = summary
+                self._summaries.move_to_end(session_id)
+            while len(self._summaries) > self.max_sessions:
+                self._summaries.popitem(last=False)
+
+    def compact(self, session_id: str | None, messages: list, llm: BaseChatModel) -> str:
+        """
+        Format the chat history of a session for use in a prompt.
+        :param session_id: The uuid of the session, summaries are only kept for sessions with an id
+        :param messages: All messages of the conversation, oldest first
+        :param llm: The LLM used to summarize older messages in the background
+        :return: The compacted chat history
+        """
+        if not messages:
+            return ""
+        older = messages[:-self.recent_messages] if self.recent_messages else list(messages)
+
+        summary = ""
+        summarized_count = 0
+        if older and session_id:
+            cached = self.get_summary(session_id)
+            if cached is not None and not cached.covers(older):
+                cached = None  # The session id was reused for a different conversation
+            if cached is not None and cached.summarized_count == len(older):
+                CACHE_HITS.labels(cache="history_summary").inc()
+            else:
+                CACHE_MISSES.labels(cache="history_summary").inc()
+                self._schedule_refresh(session_id, older, cached, llm)
+            # A summary that lags behind is still used, the messages it does not cover yet are kept verbatim
+            if cached is not None:
+                summary = cached.summary
+                summarized_count = cached.summarized_count
+        return self._fit_to_budget(summary, messages[summarized_count:])
+
+    def _fit_to_budget(self, summary: str, messages: list) -> str:
+        """
+        Combine the summary and the messages it does not cover, dropping the oldest messages
+        and finally cutting the summary until everything fits the token budget.
+        """
+        lines = [f"{message.role}: {message.content}" for message in messages]
+        line_tokens = [count_tokens(line) for line in lines]
+        remaining = self.token_budget
+        kept = []
+        # Walk backwards so the newest messages are the last to go
+        for line, tokens in zip(reversed(lines), reversed(line_tokens)):
+            if tokens > remaining:
+                break
+            kept.insert(0, line)
+            remaining -= tokens
+
+        if summary:
+            summary = truncate_to_tokens(summary, remaining - count_tokens("summary: "))
+        if summary:
+            kept.insert(0, f"summary: {summary}")
+        return "\n".join(kept)
+
+    def close(self):
+        """
+        Stop the summary threads, summaries that are still running are dropped with the process.
+        """
+        self._executor.shutdown(wait=False)
+
+    def _schedule_refresh(self, session_id: str, older: list, cached: SessionSummary | None, llm: BaseChatModel):
+        with self._lock:
+            if session_id in self._refreshing:
+                return
+            self._refreshing.add(session_id)
+        self._executor.submit(self._refresh, session_id, list(older), cached, llm)
+
+    def _refresh(self, session_id: str, older: list, cached: SessionSummary | None, llm: BaseChatModel):
+        """
+        Fold the messages that are not yet covered by the cached summary into it.
+        """
+        try:
+            previous = cached if cached is not None else SessionSummary()
+            new_lines = format_messages(older[previous.summarized_count:])
+            prompt = SUMMARIZE_HISTORY_PROMPT.format(summary=previous.summary, new_lines=new_lines)
+            response = llm.invoke(prompt)
+            record_llm_tokens("history_summary", count_tokens(prompt), count_tokens(response.content))
+            self._store_summary(
+                session_id, SessionSummary(response.content.strip(), len(older), fingerprint(older))
+            )
+        except Exception as error:
+            logger.warning(f"Failed to summarize the history of session {session_id}: {error}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(session_id)
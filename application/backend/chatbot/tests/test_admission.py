@@ -0,0 +1,73 @@
+import asyncio
+import threading
+
+import pytest
+
+from application.backend.chatbot.admission import AdmissionController, AdmissionRejected, Priority
+
+
+def test_interactive_calls_are_admitted_before_background_calls():
+    async def run():
+        controller = AdmissionController("test", max_concurrency=1, queue_size=10, queue_timeout=5)
+        order = []
+
+        async def call(name: str, priority: Priority):
+            async with controller.admit_async(priority, 10):
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        async with controller.admit_async(Priority.INTERACTIVE, 10):
+            tasks = [asyncio.create_task(call("background", Priority.BACKGROUND))]
+            await asyncio.sleep(0)
+            tasks.append(asyncio.create_task(call("interactive", Priority.INTERACTIVE)))
+            await asyncio.sleep(0)
+            assert controller.queue_depth == 2
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["interactive", "background"]
+
+
+def test_full_queue_rejects_or_evicts():
+    controller = AdmissionController("test", max_concurrency=1, queue_size=1, queue_timeout=5)
+    outcome = {}
+
+    def interactive():
+        with controller.admit(Priority.INTERACTIVE, 10):
+            outcome["interactive"] = "admitted"
+
+    def background():
+        try:
+            with controller.admit(Priority.BACKGROUND, 10):
+                outcome["background"] = "admitted"
+        except AdmissionRejected as error:
+            outcome["background"] = error.reason
+
+    with controller.admit(Priority.INTERACTIVE, 10):
+        thread = threading.Thread(target=background)
+        thread.start()
+        while controller.queue_depth == 0:
+            pass
+        # A background call cannot take the place of another one...
+        with pytest.raises(AdmissionRejected, match="queue_full"):
+            with controller.admit(Priority.BACKGROUND, 10):
+                pass
+        # ...but an interactive call evicts it
+        threads = [thread, threading.Thread(target=interactive)]
+        threads[1].start()
+        thread.join(timeout=5)
+    threads[1].join(timeout=5)
+
+    assert outcome == {"background": "evicted", "interactive": "admitted"}
+
+
+def test_token_budget_delays_calls():
+    controller = AdmissionController("test", max_concurrency=10, tokens_per_minute=600, queue_size=10, queue_timeout=0.05)
+
+    with controller.admit(Priority.INTERACTIVE, 600) as grant:
+        grant.record(600)
+    # The bucket is empty and refills 10 tokens per second
+    with pytest.raises(AdmissionRejected, match="timeout"):
+        with controller.admit(Priority.INTERACTIVE, 100):
+            pass
+    assert controller.in_flight == 0 and controller.queue_depth == 0
@@ -0,0 +1,22 @@
+from application.backend.chatbot.citations import CitationTracker
+
+LOOK_UP_TABLE = {
+    1: {"title": "Exams", "url": "https://example.com/exams"},
+    12: {"title": "Thesis", "url": "https://example.com/thesis"},
+}
+
+
+def test_markers_split_across_chunks_are_resolved_once():
+    tracker = CitationTracker(LOOK_UP_TABLE)
+
+    new_documents = [tracker.feed(chunk) for chunk in ["Register in time [", "1]. For the thesis see [1", "2", "] and [1]", " [7]."]]
+
+    assert new_documents == [
+        [],
+        [{"index": 1, "title": "Exams", "url": "https://example.com/exams"}],
+        [],
+        [{"index": 12, "title": "Thesis", "url": "https://example.com/thesis"}],
+        [],
+    ]
+    # Like extract_documents, every resolved citation is kept for the final event
+    assert [document["index"] for document in tracker.documents] == [1, 12, 1]
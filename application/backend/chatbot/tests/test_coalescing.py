@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+
+from application.backend.chatbot.coalescing import SingleFlight
+
+
+async def _collect(events) -> list:
+    return [event async for event in events]
+
+
+def test_identical_requests_share_one_pipeline():
+    started = []
+
+    async def pipeline(name: str):
+        started.append(name)
+        for i in range(3):
+            await asyncio.sleep(0.01)
+            yield f"{name}-{i}"
+
+    async def run():
+        single_flight = SingleFlight()
+        first = asyncio.create_task(_collect(single_flight.subscribe("q", lambda: pipeline("a"))))
+        await asyncio.sleep(0.015)
+        # Joins after the first event, but still receives the whole stream
+        second = asyncio.create_task(_collect(single_flight.subscribe("q", lambda: pipeline("b"))))
+        other = asyncio.create_task(_collect(single_flight.subscribe("other", lambda: pipeline("c"))))
+        results = await asyncio.gather(first, second, other)
+        assert len(single_flight) == 0
+        return results
+
+    first, second, other = asyncio.run(run())
+
+    assert started == ["a", "c"]
+    assert first == second == ["a-0", "a-1", "a-2"]
+    assert other == ["c-0", "c-1", "c-2"]
+
+
+def test_errors_reach_every_subscriber():
+    async def failing():
+        yield "partial"
+        raise RuntimeError("overloaded")
+
+    async def run():
+        single_flight = SingleFlight()
+        subscribers = [single_flight.subscribe("q", failing) for _ in range(2)]
+        return await asyncio.gather(*(_collect(events) for events in subscribers), return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
@@ -0,0 +1,53 @@
+from application.backend.chatbot.context import ContextBuilder
+from application.backend.datastore.collections.main.schema import Chunk
+
+
+def make_chunk(text: str, title: str) -> Chunk:
+    return Chunk(
+        text=text,
+        faculty=None,
+        target_groups=[],
+        topic=None,
+        subtopic="Exams",
+        title=title,
+        degree_programs=[],
+        languages=["English"],
+        url=f"https://example.com/{title}",
+    )
+
+
+def test_duplicates_are_dropped_and_indices_stay_consistent():
+    text = "The exam registration for the winter semester closes at the end of November in TUMonline."
+    chunks = [
+        make_chunk(text, "a"),
+        make_chunk(text + " Late registrations are not possible.", "b"),
+        make_chunk("Thesis topics are published on the chair websites every semester.", "c"),
+    ]
+    context, look_up_table = ContextBuilder(token_budget=1000).build("exam registration", chunks)
+
+    assert [doc["title"] for doc in look_up_table.values()] == ["a", "c"]
+    assert "Document Index: 1," in context
+    assert "Document Index: 2, Thesis topics" in context
+    assert "Document Index: 3" not in context
+
+
+def test_budget_skips_chunks_that_do_not_fit():
+    chunks = [
+        make_chunk("word " * 500, "long"),
+        make_chunk("Short chunk about the semester dates.", "short"),
+    ]
+    context, look_up_table = ContextBuilder(token_budget=50).build("semester dates", chunks)
+
+    assert list(look_up_table.values()) == [{"title": "short", "url": "https://example.com/short"}]
+    assert context.startswith("Document Index: 1, Short chunk")
+
+
+def test_compression_keeps_sentences_relevant_to_the_query():
+    text = ("The library opens at eight. The canteen serves lunch. Exam registration closes in November. "
+            "Parking is limited. The exam registration is done in TUMonline. Rooms can be booked online.")
+    builder = ContextBuilder(token_budget=1000, compress=True, max_sentences=2)
+    context, _ = builder.build("When does exam registration close?", [make_chunk(text, "a")])
+
+    assert "Exam registration closes in November." in context
+    assert "The exam registration is done in TUMonline." in context
+    assert "canteen" not in context
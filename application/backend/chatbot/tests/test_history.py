@@ -0,0 +1,37 @@
+from langchain_core.messages import AIMessage, HumanMessage, message_to_dict, messages_from_dict
+
+from application.backend.chatbot.history import HistoryTailCache, _with_pending
+
+
+def test_tail_serves_short_sessions_until_they_outgrow_it():
+    tails = HistoryTailCache(tail_size=4, max_sessions=2)
+    turn = [HumanMessage(content="When is the deadline?"), AIMessage(content="On the 15th.")]
+    tails.put("a", turn, complete=True)
+
+    assert tails.get_all("a") == turn
+    tails.append("a", turn)
+    assert tails.get_all("a") == turn * 2
+
+    # Once older messages fall out of the tail, only the last ones can be served from memory
+    tails.append("a", turn)
+    assert tails.get_all("a") is None
+    assert tails.get("a", 3) == [turn[1]] + turn
+    assert tails.get("a", 5) is None
+
+    tails.append("unknown", turn)
+    assert tails.get("unknown", 1) is None
+
+    tails.put("b", [], complete=True)
+    tails.put("c", [], complete=True)
+    assert tails.get("a", 1) is None  # Evicted as the least recently used session
+
+
+def test_pending_messages_written_while_reading_are_not_duplicated():
+    turn = [HumanMessage(content="When is the deadline?"), AIMessage(content="On the 15th.", id="answer")]
+    stored = [HumanMessage(content="Hi"), AIMessage(content="Hello!")]
+    written = messages_from_dict([message_to_dict(message) for message in turn[:1]])
+
+    assert _with_pending(stored, turn) == stored + turn
+    assert _with_pending(stored + written, turn) == stored + turn
+    assert _with_pending(stored + messages_from_dict([message_to_dict(message) for message in turn]), turn) \
+        == stored + turn
@@ -0,0 +1,14 @@
+from datetime import date
+
+from application.backend.chatbot.history_schema import _PARTITION_SUFFIX, add_months, partition_name
+
+
+def test_monthly_partitions_roll_over_years():
+    assert add_months(date(2024, 11, 1), 2) == date(2025, 1, 1)
+    assert add_months(date(2024, 1, 1), -1) == date(2023, 12, 1)
+
+    name = partition_name("chat_history", date(2024, 3, 1))
+    assert name == "chat_history_p2024_03"
+    assert _PARTITION_SUFFIX.search(name).groups() == ("2024", "03")
+    # The default partition is never mistaken for a month
+    assert _PARTITION_SUFFIX.search("chat_history_default") is None
@@ -0,0 +1,71 @@
+import threading
+
+from langchain_core.messages import AIMessage, HumanMessage
+
+from application.backend.chatbot.history_writer import FeedbackWriter, HistoryWriter
+
+
+def test_queued_turns_are_readable_until_the_batch_is_done():
+    connecting = threading.Event()
+    release = threading.Event()
+
+    def connect():
+        connecting.set()
+        release.wait(5)
+        raise ConnectionError("database is down")
+
+    writer = HistoryWriter(connect, "message_store", flush_interval=0.01, max_attempts=1)
+    turn = [HumanMessage(content="When is the deadline?"), AIMessage(content="On the 15th.")]
+    writer.submit("a", turn)
+    writer.submit("b", turn[:1])
+
+    assert connecting.wait(5)
+    # The worker holds the batch while it connects, the turns are still visible to reads of the session
+    assert writer.pending("a") == turn
+    assert writer.pending("b") == turn[:1]
+
+    release.set()
+    writer.flush()
+    writer.close()
+
+    assert writer.pending("a") == []
+
+
+def test_turns_are_rejected_instead_of_waiting_when_the_queue_is_full():
+    connecting = threading.Event()
+    release = threading.Event()
+
+    def connect():
+        connecting.set()
+        release.wait(5)
+        raise ConnectionError("database is down")
+
+    writer = HistoryWriter(connect, "message_store", max_queue=1, flush_interval=0.01, max_attempts=1)
+    turn = [HumanMessage(content="When is the deadline?"), AIMessage(content="On the 15th.")]
+    assert writer.submit("a", turn)
+    assert connecting.wait(5)  # The worker holds the first turn
+    assert writer.submit("a", turn)
+    assert not writer.submit("b", turn)
+    assert writer.pending("b") == []
+
+    release.set()
+    writer.close()
+
+
+def test_feedback_is_rejected_instead_of_waiting_when_the_queue_is_full():
+    connecting = threading.Event()
+    release = threading.Event()
+
+    def connect():
+        connecting.set()
+        release.wait(5)
+        raise ConnectionError("database is down")
+
+    writer = FeedbackWriter(connect, "chat_feedback", max_queue=1, flush_interval=0.01, max_attempts=1)
+    assert writer.submit("a", "message-1", "helpful", "")
+    assert connecting.wait(5)  # The worker holds the first submission
+    assert writer.submit("a", "message-2", "helpful", "")
+    assert not writer.submit("a", None, "wrong", "The whole conversation was off topic")
+
+    release.set()
+    writer.close()
@@ -0,0 +1,58 @@
+import asyncio
+
+from application.backend.chatbot.sse import SSEWriter
+
+
+async def _events(chunks: list, delay: float = 0.0):
+    for chunk in chunks:
+        await asyncio.sleep(delay)
+        yield "stream", chunk
+    yield "final", {"done": True}
+
+
+async def _collect(writer: SSEWriter, events) -> list:
+    return [event async for event in writer.coalesce(events)]
+
+
+def test_chunks_are_coalesced_after_the_first_one():
+    writer = SSEWriter(max_chars=6, max_delay=10)
+
+    events = asyncio.run(_collect(writer, _events(["Hi", " a", "b", "cdef", "g", "h"])))
+
+    assert events == [
+        ("stream", "Hi"),  # The first chunk is never delayed
+        ("stream", " abcdef"),
+        ("stream", "gh"),  # Flushed by the final event
+        ("final", {"done": True}),
+    ]
+
+
+def test_chunks_are_sent_when_their_window_ends():
+    writer = SSEWriter(max_chars=1000, max_delay=0.02)
+
+    async def stalling():
+        yield "stream", "first"
+        yield "stream", "second"
+        await asyncio.sleep(0.2)
+        yield "stream", "third"
+
+    async def run():
+        received = []
+        start = asyncio.get_running_loop().time()
+        async for _, data in writer.coalesce(stalling()):
+            received.append((data, asyncio.get_running_loop().time() - start))
+        return received
+
+    received = asyncio.run(run())
+
+    assert [data for data, _ in received] == ["first", "second", "third"]
+    assert received[1][1] < 0.15
+
+
+def test_disabled_coalescing_passes_events_through():
+    writer = SSEWriter(max_chars=0)
+
+    events = asyncio.run(_collect(writer, _events(["a", "b"])))
+
+    assert events == [("stream", "a"), ("stream", "b"), ("final", {"done": True})]
+    assert writer.frame({"type": "stream", "data": "ä"}) == '{"type":"stream","data":"ä"}\n\n'
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+from langchain_community.chat_models.fake import FakeListChatModel
+
+from application.backend.chatbot.summary import HistoryCompactor
+
+
+def make_conversation(turns: int) -> list:
+    messages = []
+    for i in range(turns):
+        messages.append(SimpleNamespace(role="user", content=f"question {i}"))
+        messages.append(SimpleNamespace(role="assistant", content=f"answer {i}"))
+    return messages
+
+
+def test_short_conversations_are_kept_verbatim():
+    compactor = HistoryCompactor(recent_turns=3, token_budget=1000)
+    history = compactor.compact("session", make_conversation(2), FakeListChatModel(responses=[]))
+
+    assert history == "user: question 0\nassistant: answer 0\nuser: question 1\nassistant: answer 1"
+
+
+def test_older_turns_are_replaced_by_the_cached_summary():
+    compactor = HistoryCompactor(recent_turns=1, token_budget=1000)
+    llm = FakeListChatModel(responses=["The student studies BMT."])
+    messages = make_conversation(3)
+
+    # The first call schedules the summary and keeps everything verbatim in the meantime
+    assert "question 0" in compactor.compact("session", messages, llm)
+    compactor._executor.shutdown(wait=True)
+
+    history = compactor.compact("session", messages, llm)
+    assert history == "summary: The student studies BMT.\nuser: question 2\nassistant: answer 2"
+
+
+def test_history_is_bounded_by_the_token_budget():
+    compactor = HistoryCompactor(recent_turns=10, token_budget=10)
+    history = compactor.compact(None, make_conversation(10), FakeListChatModel(responses=[]))
+
+    assert history.endswith("assistant: answer 9")
+    assert "question 0" not in history
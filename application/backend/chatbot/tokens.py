@@ -0,0 +1,54 @@
+import logging
+from functools import lru_cache
+
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+ENCODING_NAME = "cl100k_base"
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    """
+    Load the tokenizer used by the GPT models behind our Azure deployments.
+    tiktoken downloads the encoding on first use, so this can fail on machines without network access.
+    """
+    try:
+        return tiktoken.get_encoding(ENCODING_NAME)
+    except Exception as error:
+        logger.warning(f"Could not load tokenizer '{ENCODING_NAME}', falling back to estimates: {error}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens of a text locally, without calling the LLM.
+    If the tokenizer is unavailable, the count is estimated at four characters per token.
+    :param text: The text to count the tokens of
+    :return: The number of tokens
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cut a text down to at most the given number of tokens, keeping its beginning.
+    :param text: The text to truncate
+    :param max_tokens: The maximum number of tokens to keep
+    :return: The truncated text
+    """
+    if max_tokens <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * 4]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
@@ -1,52 +1,57 @@
+import logging
 import os
 import random
-from typing import List
+import time
+from typing import Callable, List
 
 from langchain_core.output_parsers import JsonOutputParser
-from langchain_openai import AzureChatOpenAI
+from langchain_core.language_models import BaseChatModel
 
 from application.backend.chatbot.prompts import (
     FIRST_FILTER_PROMPT,
     FEEDBACK_TRIGGER_PROMPT,
 )
+from application.backend.chatbot.tokens import count_tokens
 from application.backend.datastore.qa_pairs.qa_loader import PostgresLoader
+from application.backend.metrics import CACHE_HITS, CACHE_MISSES, FILTER_STOPS, record_llm_tokens
+
+logger = logging.getLogger(__name__)
+
+# The curated QA pairs change rarely, so we keep them in memory instead of querying Postgres on every question
+QA_PAIRS_CACHE_TTL = 10 * 60
+_qa_pairs_cache: dict[tuple[str, str], tuple[float, list]] = {}
 
-openai_api_key = os.getenv("AZURE_OPENAI_API_KEY")
-azure_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-llm = AzureChatOpenAI(
-    openai_api_version="2023-05-15",
-    deployment_name="ChatbotMGT",
-    azure_endpoint=azure_endpoint,
-    openai_api_key=openai_api_key,
-)
 import re
 
 
 def parse_and_filter_question(
-    question: str, history: List, llm: AzureChatOpenAI
+    question: str, history: List, llm: BaseChatModel
 ) -> dict:
     """
     Invokes the language model with a filter prompt, parses the JSON response,
     and determines the response based on 'is_tum' and 'is_sensitive' fields.
 
     :param question: The question to be processed.
-    :param llm: An instance of AzureChatOpenAI to use for invoking the language model.
+    :param llm: The LLM to use for invoking the language model.
     :return: A dictionary containing the answer and filtering decision. Additionally the language is returned if no filtering is applied.
     """
     json_parser = JsonOutputParser()
     filter_prompt = FIRST_FILTER_PROMPT.format(history=history, question=question)
     response = llm.invoke(filter_prompt, response_format={"type": "json_object"})
+    record_llm_tokens("first_filter", count_tokens(filter_prompt), count_tokens(response.content))
     parsed_response = json_parser.parse(response.content)
 
     if not parsed_response.get("is_tum", False):
-        print("Not TUM related")
+        logger.debug("Not TUM related")
+        FILTER_STOPS.labels(reason="not_tum").inc()
 
         answer = "I'm sorry, I can't answer that question. Please reformulate your question or ask me something different about the TUM School of Management."
 
         return {"answer": answer, "decision": "stop"}
 
     elif parsed_response.get("is_sensitive", True):
-        print("Sensitive data")
+        logger.debug("Sensitive data")
+        FILTER_STOPS.labels(reason="sensitive").inc()
         answer = "I'm sorry, I can't answer that question. Make sure not to include any sensitive data in your inquiry or contact the SOM directly."
         return {"answer": answer, "decision": "stop"}
 
@@ -71,9 +76,7 @@ def get_qa_pairs(degree_program: str, language: str) -> str:
     :return: A string of few-shot QA pairs.
     """
 
-    postgres_qa = PostgresLoader()
-    qa_pairs = postgres_qa.get_data(degree_program, language)
-    postgres_qa.close_connection()
+    qa_pairs = _get_cached_qa_pairs(degree_program, language)
 
     num_to_sample = min(len(qa_pairs), 2)
 
@@ -91,19 +94,63 @@ def get_qa_pairs(degree_program: str, language: str) -> str:
     return few_shot_qa_pairs
 
 
-def get_feedback_trigger(question: str, answer: str, llm: AzureChatOpenAI) -> dict:
+def _get_cached_qa_pairs(degree_program: str, language: str) -> list:
+    """
+    Returns the QA pairs for the given degree program and language, served from memory if they were fetched recently.
+
+    :param degree_program: The degree program to get the QA pairs for.
+    :param language: The language to get the QA pairs for.
+    :return: The rows of the QA pairs table.
+    """
+    key = (degree_program, language)
+    cached = _qa_pairs_cache.get(key)
+    if cached and time.time() - cached[0] < QA_PAIRS_CACHE_TTL:
+        CACHE_HITS.labels(cache="qa_pairs").inc()
+        return cached[1]
+
+    CACHE_MISSES.labels(cache="qa_pairs").inc()
+    qa_pairs = _qa_pairs_source(degree_program, language)
+    _qa_pairs_cache[key] = (time.time(), qa_pairs)
+    return qa_pairs
+
+
+def _load_qa_pairs_from_postgres(degree_program: str, language: str) -> list:
+    postgres_qa = PostgresLoader()
+    qa_pairs = postgres_qa.get_data(degree_program, language)
+    postgres_qa.close_connection()
+    return qa_pairs
+
+
+_qa_pairs_source: Callable[[str, str], list] = _load_qa_pairs_from_postgres
+
+
+def set_qa_pairs_source(source: Callable[[str, str], list] | None):
+    """
+    Replace where the QA pairs are loaded from, e.g. to run the chatbot without the Postgres database.
+    The cache is cleared, so the new source is used right away.
+
+    :param source: Returns the rows of the QA pairs table for a degree program and language,
+    None restores the Postgres database.
+    """
+    global _qa_pairs_source
+    _qa_pairs_source = source or _load_qa_pairs_from_postgres
+    _qa_pairs_cache.clear()
+
+
+def get_feedback_trigger(question: str, answer: str, llm: BaseChatModel) -> dict:
     """
     Invokes the language model with a feedback trigger prompt and parses the JSON response.
 
     :param question: The question to be processed.
     :param answer: The answer to the question.
-    :param llm: An instance of AzureChatOpenAI to use for invoking the language model.
+    :param llm: The LLM to use for invoking the language model.
     :return: A dictionary containing the feedback trigger.
     """
 
     json_parser = JsonOutputParser()
     feedback_prompt = FEEDBACK_TRIGGER_PROMPT.format(question=question, answer=answer)
     response = llm.invoke(feedback_prompt)
+    record_llm_tokens("feedback_trigger", count_tokens(feedback_prompt), count_tokens(response.content))
     feedback_trigger = json_parser.parse(response.content)
 
     return feedback_trigger
@@ -128,7 +175,6 @@ def map_study_program(full_name):
     # Find the abbreviation for a given full program name
     for program, abbreviation in program_mapping.items():
         if full_name == program:
-            print(abbreviation)
             return abbreviation
 
     # Return "Unknown Abbreviation" if the full name is not in the mapping
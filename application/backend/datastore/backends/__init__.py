@@ -0,0 +1,4 @@
+from .base import VectorStoreBackend, StoredObject, Filter, ObjectNotFoundError
+from .local_backend import LocalBackend
+from .weaviate_backend import WeaviateBackend
+from .partitioned_backend import PartitionedBackend
@@ -0,0 +1,216 @@
+from abc import ABC, abstractmethod
+from typing import Any, Iterable, Iterator
+
+
+class Filter(ABC):
+    """
+    A backend-independent filter on the properties of stored objects.
+    Filters can be combined with `&` and `|`, like Weaviate's filters.
+    """
+
+    @abstractmethod
+    def matches(self, properties: dict[str, Any]) -> bool:
+        """
+        Evaluate the filter on the properties of an object.
+        """
+
+    @abstractmethod
+    def key(self) -> tuple:
+        """
+        A hashable representation of the filter, e.g. for caching evaluated filters.
+        """
+
+    def __and__(self, other: "Filter") -> "Filter":
+        return And(self, other)
+
+    def __or__(self, other: "Filter") -> "Filter":
+        return Or(self, other)
+
+    @staticmethod
+    def equal(property_name: str, value: Any) -> "Filter":
+        return Equal(property_name, value)
+
+    @staticmethod
+    def length_equal(property_name: str, length: int) -> "Filter":
+        return LengthEqual(property_name, length)
+
+    @staticmethod
+    def contains_any(property_name: str, values: Iterable[Any]) -> "Filter":
+        return ContainsAny(property_name, values)
+
+
+class Equal(Filter):
+    def __init__(self, property_name: str, value: Any):
+        self.property_name = property_name
+        self.value = value
+
+    def matches(self, properties: dict[str, Any]) -> bool:
+        return properties.get(self.property_name) == self.value
+
+    def key(self) -> tuple:
+        return "equal", self.property_name, self.value
+
+
+class LengthEqual(Filter):
+    def __init__(self, property_name: str, length: int):
+        self.property_name = property_name
+        self.length = length
+
+    def matches(self, properties: dict[str, Any]) -> bool:
+        return len(properties.get(self.property_name) or []) == self.length
+
+    def key(self) -> tuple:
+        return "length_equal", self.property_name, self.length
+
+
+class ContainsAny(Filter):
+    def __init__(self, property_name: str, values: Iterable[Any]):
+        self.property_name = property_name
+        self.values = sorted(set(values))
+
+    def matches(self, properties: dict[str, Any]) -> bool:
+        return any(value in self.values for value in properties.get(self.property_name) or [])
+
+    def key(self) -> tuple:
+        return "contains_any", self.property_name, tuple(self.values)
+
+
+class And(Filter):
+    def __init__(self, *filters: Filter):
+        self.filters = filters
+
+    def matches(self, properties: dict[str, Any]) -> bool:
+        return all(f.matches(properties) for f in self.filters)
+
+    def key(self) -> tuple:
+        return ("and",) + tuple(f.key() for f in self.filters)
+
+
+class Or(Filter):
+    def __init__(self, *filters: Filter):
+        self.filters = filters
+
+    def matches(self, properties: dict[str, Any]) -> bool:
+        return any(f.matches(properties) for f in self.filters)
+
+    def key(self) -> tuple:
+        return ("or",) + tuple(f.key() for f in self.filters)
+
+
+class ObjectNotFoundError(KeyError):
+    """
+    Raised by backends when an object to update does not exist.
+    """
+
+
+class StoredObject:
+    """
+    An object as returned by a vector store backend.
+    """
+
+    uuid: Any
+    properties: dict[str, Any]
+    vector: list[float] | None  # Only set if requested
+    distance: float | None  # Only set for vector searches
+
+    def __init__(self, uuid, properties: dict[str, Any], vector: list[float] = None, distance: float = None):
+        self.uuid = uuid
+        self.properties = properties
+        self.vector = vector
+        self.distance = distance
+
+
+class VectorStoreBackend(ABC):
+    """
+    The operations the chatbot's collections need from a vector store.
+    Each backend instance represents a single collection whose objects are vectorized by their text property.
+    """
+
+    @abstractmethod
+    def hybrid_search(
+        self, query: str, limit: int, filters: Filter | None = None, alpha: float = 0.5, vector: list[float] = None
+    ) -> list[StoredObject]:
+        """
+        Retrieve the objects that match the query best, fusing vector and keyword search.
+        :param alpha: 1.0 is pure vector search, 0.0 is pure keyword search
+        :param vector: The embedding of the query if the caller already computed it, so it is not embedded again
+        """
+
+    @abstractmethod
+    def near_text(self, query: str, limit: int) -> list[StoredObject]:
+        """
+        Retrieve the objects closest to the query in vector space, with their cosine distance.
+        """
+
+    @abstractmethod
+    def insert(self, properties: dict[str, Any], uuid=None) -> Any:
+        """
+        Insert a single object.
+        :param uuid: The uuid of the object, a random one by default. An existing object with this uuid is replaced
+        :return: The uuid of the new object
+        """
+
+    @abstractmethod
+    def insert_many(self, objects: list[dict[str, Any]], uuids: list | None = None) -> list[dict[str, Any]]:
+        """
+        Batch import objects.
+        :param uuids: The uuids of the objects, random ones by default. Existing objects with these uuids are replaced
+        :return: The properties of the objects that failed to import
+        """
+
+    @abstractmethod
+    def update(self, uuid, properties: dict[str, Any]):
+        """
+        Update properties of an object. The object is not re-vectorized.
+        :raises ObjectNotFoundError: If the object does not exist
+        """
+
+    def update_many(self, updates: list[tuple[Any, dict[str, Any]]]) -> list:
+        """
+        Update properties of several objects. The objects are not re-vectorized.
+        :param updates: The uuids of the objects with their properties to update
+        :return: The uuids of the objects that do not exist
+        """
+        missing = []
+        for uuid, properties in updates:
+            try:
+                self.update(uuid, properties)
+            except ObjectNotFoundError:
+                missing.append(uuid)
+        return missing
+
+    @abstractmethod
+    def delete_by_id(self, uuid):
+        """
+        Delete a single object, nothing happens if it does not exist.
+        """
+
+    @abstractmethod
+    def delete_many(self, filters: Filter) -> tuple[int, int]:
+        """
+        Delete all objects matching the filter.
+        :return: The number of objects that were deleted and the number of objects that failed to be deleted
+        """
+
+    @abstractmethod
+    def iterate(self, return_properties: list[str] = None, include_vector: bool = False) -> Iterator[StoredObject]:
+        """
+        Iterate over all objects.
+        """
+
+    @abstractmethod
+    def fetch_sorted(self, property_name: str, limit: int, include_vector: bool = False) -> list[StoredObject]:
+        """
+        Fetch the objects with the highest values of a numeric property, highest first.
+        """
+
+    @abstractmethod
+    def count(self, filters: Filter | None = None) -> int:
+        """
+        Count the objects, only those matching the filter if one is given.
+        """
+
+    def close(self):
+        """
+        Release the resources held by the backend.
+        """
@@ -0,0 +1,213 @@
+import json
+import sqlite3
+import threading
+import uuid as uuid_package
+from contextlib import closing
+from typing import Any, Iterator
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from application.backend.datastore.backends.base import Filter, ObjectNotFoundError, StoredObject, VectorStoreBackend
+from application.backend.datastore.collections.main.local_index import HybridIndex
+
+
+class LocalBackend(VectorStoreBackend):
+    """
+    An embedded vector store for single-node deployments and tests, which needs no Weaviate cluster.
+
+    Objects are persisted in a SQLite table and held in memory, where searches run on a HybridIndex.
+    The index is rebuilt lazily on the first search after a write, except for updates that leave the text unchanged.
+    """
+
+    def __init__(self, name: str, text_property: str, embeddings: Embeddings, path: str = ":memory:"):
+        """
+        :param name: The name of the collection, used as the SQLite table name
+        :param text_property: The property which is vectorized and searched with BM25
+        :param embeddings: The embeddings used to vectorize objects and queries
+        :param path: The path of the SQLite database, in-memory by default
+        """
+        self.name = name
+        self.text_property = text_property
+        self.embeddings = embeddings
+        self._lock = threading.RLock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            f'CREATE TABLE IF NOT EXISTS "{name}" (uuid TEXT PRIMARY KEY, properties TEXT NOT NULL, vector BLOB NOT NULL)'
+        )
+        self._connection.commit()
+
+        self._objects: dict[str, tuple[dict[str, Any], np.ndarray]] = {}
+        for object_uuid, properties, vector in self._connection.execute(f'SELECT * FROM "{name}"'):
+            self._objects[object_uuid] = (json.loads(properties), np.frombuffer(vector, dtype=np.float32))
+        self._index: HybridIndex | None = None
+        self._index_uuids: list[str] = []
+        self._mask_cache: dict[tuple, np.ndarray] = {}
+
+    def _get_index(self) -> HybridIndex:
+        with self._lock:
+            if self._index is None:
+                self._index_uuids = list(self._objects.keys())
+                objects = [self._objects[object_uuid] for object_uuid in self._index_uuids]
+                vectors = np.array([vector for _, vector in objects], dtype=np.float32)
+                self._index = HybridIndex(
+                    [properties.get(self.text_property) or "" for properties, _ in objects],
+                    vectors,
+                    self.embeddings.embed_query,
+                )
+                self._mask_cache = {}
+            return self._index
+
+    def _invalidate(self):
+        self._index = None
+
+    def _mask(self, filters: Filter | None) -> np.ndarray | None:
+        if filters is None:
+            return None
+        key = filters.key()
+        mask = self._mask_cache.get(key)
+        if mask is None:
+            mask = np.fromiter(
+                (filters.matches(self._objects[object_uuid][0]) for object_uuid in self._index_uuids),
+                dtype=bool,
+                count=len(self._index_uuids),
+            )
+            self._mask_cache[key] = mask
+        return mask
+
+    def _stored(self, object_uuid: str, distance: float = None, include_vector: bool = False) -> StoredObject:
+        properties, vector = self._objects[object_uuid]
+        return StoredObject(
+            uuid_package.UUID(object_uuid),
+            dict(properties),
+            vector=vector.tolist() if include_vector else None,
+            distance=distance,
+        )
+
+    def hybrid_search(
+        self, query: str, limit: int, filters: Filter | None = None, alpha: float = 0.5, vector: list[float] = None
+    ) -> list[StoredObject]:
+        with self._lock:
+            index = self._get_index()
+            ranked = index.rank(query, self._mask(filters), k=limit, alpha=alpha, vector=vector)
+            return [self._stored(self._index_uuids[doc_id]) for doc_id, _ in ranked]
+
+    def near_text(self, query: str, limit: int) -> list[StoredObject]:
+        with self._lock:
+            index = self._get_index()
+            if not len(index):
+                return []
+            similarities = index.vector_scores(query)
+            best = np.argsort(-similarities, kind="stable")[:limit]
+            return [
+                self._stored(self._index_uuids[doc_id], distance=float(1 - similarities[doc_id]))
+                for doc_id in best
+            ]
+
+    def _write(self, rows: list[tuple[str, dict[str, Any], np.ndarray]], reindex: bool = True):
+        """
+        :param reindex: Whether texts or vectors changed, otherwise only the filters are reevaluated
+        """
+        with self._lock:
+            self._connection.executemany(
+                f'INSERT OR REPLACE INTO "{self.name}" (uuid, properties, vector) VALUES (?, ?, ?)',
+                [(object_uuid, json.dumps(properties), vector.tobytes()) for object_uuid, properties, vector in rows],
+            )
+            self._connection.commit()
+            for object_uuid, properties, vector in rows:
+                self._objects[object_uuid] = (properties, vector)
+            if reindex:
+                self._invalidate()
+            else:
+                self._mask_cache = {}
+
+    def insert(self, properties: dict[str, Any], uuid=None) -> Any:
+        object_uuid = uuid or uuid_package.uuid4()
+        vector = np.asarray(self.embeddings.embed_query(properties.get(self.text_property) or ""), dtype=np.float32)
+        self._write([(str(object_uuid), dict(properties), vector)])
+        return object_uuid
+
+    def insert_many(self, objects: list[dict[str, Any]], uuids: list | None = None) -> list[dict[str, Any]]:
+        if not objects:
+            return []
+        try:
+            vectors = self.embeddings.embed_documents([obj.get(self.text_property) or "" for obj in objects])
+        except Exception:
+            return list(objects)  # Nothing was imported, the caller may retry
+        uuids = uuids or [uuid_package.uuid4() for _ in objects]
+        self._write([
+            (str(object_uuid), dict(obj), np.asarray(vector, dtype=np.float32))
+            for obj, object_uuid, vector in zip(objects, uuids, vectors)
+        ])
+        return []
+
+    def update(self, uuid, properties: dict[str, Any]):
+        if self.update_many([(uuid, properties)]):
+            raise ObjectNotFoundError(f"No object with uuid {uuid} in {self.name}")
+
+    def update_many(self, updates: list[tuple[Any, dict[str, Any]]]) -> list:
+        with self._lock:
+            rows, missing = [], []
+            for uuid, properties in updates:
+                if str(uuid) not in self._objects:
+                    missing.append(uuid)
+                    continue
+                current, vector = self._objects[str(uuid)]
+                rows.append((str(uuid), {**current, **properties}, vector))
+            if rows:
+                self._write(rows, reindex=any(self.text_property in properties for _, properties in updates))
+            return missing
+
+    def delete_by_id(self, uuid):
+        with self._lock:
+            self._connection.execute(f'DELETE FROM "{self.name}" WHERE uuid = ?', (str(uuid),))
+            self._connection.commit()
+            self._objects.pop(str(uuid), None)
+            self._invalidate()
+
+    def delete_many(self, filters: Filter) -> tuple[int, int]:
+        with self._lock:
+            matching = [object_uuid for object_uuid, (properties, _) in self._objects.items()
+                        if filters.matches(properties)]
+            self._connection.executemany(
+                f'DELETE FROM "{self.name}" WHERE uuid = ?', [(object_uuid,) for object_uuid in matching]
+            )
+            self._connection.commit()
+            for object_uuid in matching:
+                del self._objects[object_uuid]
+            self._invalidate()
+            return len(matching), 0
+
+    def iterate(self, return_properties: list[str] = None, include_vector: bool = False) -> Iterator[StoredObject]:
+        with self._lock:
+            object_uuids = list(self._objects.keys())
+        for object_uuid in object_uuids:
+            if object_uuid not in self._objects:
+                continue  # Deleted while iterating
+            obj = self._stored(object_uuid, include_vector=include_vector)
+            if return_properties is not None:
+                obj.properties = {name: obj.properties.get(name) for name in return_properties}
+            yield obj
+
+    def fetch_sorted(self, property_name: str, limit: int, include_vector: bool = False) -> list[StoredObject]:
+        with self._lock:
+            best = sorted(self._objects, key=lambda object_uuid: self._objects[object_uuid][0].get(property_name) or 0,
+                          reverse=True)[:limit]
+            return [self._stored(object_uuid, include_vector=include_vector) for object_uuid in best]
+
+    def count(self, filters: Filter | None = None) -> int:
+        if filters is None:
+            return len(self._objects)
+        with self._lock:
+            return sum(1 for properties, _ in self._objects.values() if filters.matches(properties))
+
+    @staticmethod
+    def table_names(path: str) -> list[str]:
+        """
+        The names of the collections stored in a SQLite database.
+        """
+        with closing(sqlite3.connect(path)) as connection:
+            return [name for name, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+
+    def close(self):
+        self._connection.close()
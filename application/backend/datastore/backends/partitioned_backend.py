@@ -0,0 +1,271 @@
+import json
+import re
+import threading
+import time
+import uuid as uuid_package
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator
+
+from application.backend.datastore.backends.base import Filter, ObjectNotFoundError, StoredObject, VectorStoreBackend
+
+GENERAL = "General"  # The partition key of objects that are not about a specific degree program
+_RRF_K = 60  # Damping of the reciprocal rank fusion of the partitions' results
+
+
+def _slug(value: str) -> str:
+    return re.sub(r"[^0-9A-Za-z]", "", value)
+
+
+class PartitionedBackend(VectorStoreBackend):
+    """
+    A collection split into one partition per (degree program, language), each stored in its own backend,
+    so a search only scans the partitions it needs instead of filtering the whole vector index.
+
+    - Objects without degree programs go to the general partition of each of their languages
+    - Objects about several degree programs or in several languages are replicated to each of their partitions
+      under the same uuid, which is derived from their properties so retried imports replace instead of duplicate
+    - Writes, deletes and updates are routed to or fanned out over the partitions, iterating yields each object once.
+      Updates are routed if they include the degree programs and languages of the object, otherwise fanned out
+    - `search_partitions` searches the given partitions in parallel and merges their results by rank
+    """
+
+    def __init__(
+        self,
+        name: str,
+        open_partition: Callable[[str], VectorStoreBackend],
+        list_partitions: Callable[[], Iterable[str]],
+        program_property: str,
+        language_property: str,
+        max_workers: int = 8,
+        list_interval: float = 60,
+    ):
+        """
+        :param name: The name of the partitioned collection, the partitions are named `<name>_<program>_<language>`
+        :param open_partition: Opens the backend of a partition by its name, creating it if it does not exist
+        :param list_partitions: Lists the names of the stored collections, including those of other collections
+        :param program_property: The property holding the degree programs of an object
+        :param language_property: The property holding the languages of an object
+        :param max_workers: The maximum number of partitions searched in parallel
+        :param list_interval: The time in seconds the listed partitions are reused before they are listed again
+        """
+        self.name = name
+        self.open_partition = open_partition
+        self.list_partitions = list_partitions
+        self.program_property = program_property
+        self.language_property = language_property
+        self.list_interval = list_interval
+        self._partitions: dict[str, VectorStoreBackend] = {}
+        self._listed: set[str] = set()
+        self._listed_at = float("-inf")
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"partitions-{name}")
+
+    def partition_name(self, program: str | None, language: str) -> str:
+        return f"{self.name}_{_slug(program or GENERAL)}_{_slug(language)}"
+
+    def partitions_of(self, properties: dict[str, Any]) -> list[str]:
+        """
+        The names of the partitions an object is stored in, the first one is where it is counted and iterated.
+        """
+        programs = sorted(properties.get(self.program_property) or []) or [None]
+        languages = sorted(properties.get(self.language_property) or []) or [""]
+        return [self.partition_name(program, language) for program in programs for language in languages]
+
+    def _partition(self, name: str) -> VectorStoreBackend:
+        with self._lock:
+            partition = self._partitions.get(name)
+            if partition is None:
+                partition = self._partitions[name] = self.open_partition(name)
+            return partition
+
+    def names(self) -> list[str]:
+        """
+        The names of all partitions that exist, in the store or in this process.
+        Partitions created by other processes are seen after at most `list_interval` seconds.
+        """
+        if time.monotonic() - self._listed_at > self.list_interval:
+            prefix = f"{self.name}_"
+            self._listed = {name for name in self.list_partitions() if name.startswith(prefix)}
+            self._listed_at = time.monotonic()
+        with self._lock:
+            return sorted(self._listed | set(self._partitions))
+
+    def _uuid(self, properties: dict[str, Any]) -> uuid_package.UUID:
+        return uuid_package.uuid5(uuid_package.NAMESPACE_URL, json.dumps(properties, sort_keys=True, default=str))
+
+    @staticmethod
+    def _fuse(results: list[list[StoredObject]], limit: int) -> list[StoredObject]:
+        """
+        Merge the ranked results of several partitions with reciprocal rank fusion, dropping replicas.
+        Scores of different partitions are normalized per partition, so their ranks are compared instead.
+        """
+        scores: dict[str, float] = {}
+        objects: dict[str, StoredObject] = {}
+        for ranked in results:
+            for rank, obj in enumerate(ranked):
+                key = str(obj.uuid)
+                scores[key] = scores.get(key, 0.0) + 1 / (_RRF_K + rank + 1)
+                objects.setdefault(key, obj)
+        best = sorted(scores, key=lambda key: scores[key], reverse=True)[:limit]
+        return [objects[key] for key in best]
+
+    def search_partitions(
+        self,
+        query: str,
+        limit: int,
+        keys: Iterable[tuple[str | None, str]],
+        alpha: float = 0.5,
+        vector: list[float] = None,
+    ) -> list[StoredObject]:
+        """
+        Hybrid search in the partitions of the given (degree program, language) keys, None is the general partition.
+        Partitions that do not exist are skipped.
+        :param vector: The embedding of the query if it is already known, shared by the searches of all partitions
+        """
+        existing = set(self.names())
+        names = [name for name in dict.fromkeys(self.partition_name(*key) for key in keys) if name in existing]
+        return self._fuse(list(self._executor.map(
+            lambda name: self._partition(name).hybrid_search(query, limit, alpha=alpha, vector=vector), names
+        )), limit)
+
+    def hybrid_search(
+        self, query: str, limit: int, filters: Filter | None = None, alpha: float = 0.5, vector: list[float] = None
+    ) -> list[StoredObject]:
+        return self._fuse(list(self._executor.map(
+            lambda name: self._partition(name).hybrid_search(query, limit, filters, alpha, vector), self.names()
+        )), limit)
+
+    def near_text(self, query: str, limit: int) -> list[StoredObject]:
+        closest: dict[str, StoredObject] = {}
+        for results in self._executor.map(lambda name: self._partition(name).near_text(query, limit), self.names()):
+            for obj in results:
+                closest.setdefault(str(obj.uuid), obj)
+        return sorted(closest.values(), key=lambda obj: obj.distance)[:limit]
+
+    def insert(self, properties: dict[str, Any], uuid=None) -> Any:
+        uuid = uuid or self._uuid(properties)
+        for name in self.partitions_of(properties):
+            self._partition(name).insert(properties, uuid=uuid)
+        return uuid
+
+    def insert_many(self, objects: list[dict[str, Any]], uuids: list | None = None) -> list[dict[str, Any]]:
+        uuids = uuids or [self._uuid(obj) for obj in objects]
+        by_partition: dict[str, tuple[list, list]] = {}
+        for obj, uuid in zip(objects, uuids):
+            for name in self.partitions_of(obj):
+                partition_objects, partition_uuids = by_partition.setdefault(name, ([], []))
+                partition_objects.append(obj)
+                partition_uuids.append(uuid)
+        failed = {}
+        for name, (partition_objects, partition_uuids) in by_partition.items():
+            for obj in self._partition(name).insert_many(partition_objects, partition_uuids):
+                # Failed objects are retried in all their partitions, where the uuid replaces the imported replicas
+                failed.setdefault(json.dumps(obj, sort_keys=True, default=str), obj)
+        return list(failed.values())
+
+    def update(self, uuid, properties: dict[str, Any]):
+        """
+        Update the properties of an object in every partition it is replicated to.
+        """
+        if self.update_many([(uuid, properties)]):
+            raise ObjectNotFoundError(f"No object with uuid {uuid} in {self.name}")
+
+    def update_many(self, updates: list[tuple[Any, dict[str, Any]]]) -> list:
+        """
+        Update the properties of objects in every partition they are replicated to, with one batch per partition.
+        The partitions of an object are not known from its uuid, so updates without the degree programs
+        and languages of their object are tried in all partitions.
+        """
+        existing = self.names()
+        routed: dict[str, bool] = {}
+        by_partition: dict[str, list] = {}
+        for uuid, properties in updates:
+            routed[str(uuid)] = self.program_property in properties and self.language_property in properties
+            for name in self.partitions_of(properties) if routed[str(uuid)] else existing:
+                by_partition.setdefault(name, []).append((uuid, properties))
+        misses: dict[str, int] = {}
+        for name, partition_updates in by_partition.items():
+            if name in existing:
+                missing = self._partition(name).update_many(partition_updates)
+            else:
+                missing = [uuid for uuid, _ in partition_updates]
+            for uuid in missing:
+                misses[str(uuid)] = misses.get(str(uuid), 0) + 1
+        # A routed object is missing if one of its replicas is, a fanned out one if no partition has it
+        return [uuid for uuid, _ in updates
+                if misses.get(str(uuid)) and (routed[str(uuid)] or misses[str(uuid)] == len(existing))]
+
+    def delete_by_id(self, uuid):
+        """
+        Delete an object from every partition, as its partitions are not known from its uuid.
+        """
+        for name in self.names():
+            self._partition(name).delete_by_id(uuid)
+
+    def delete_many(self, filters: Filter) -> tuple[int, int]:
+        """
+        Delete the matching objects from every partition.
+        :return: The number of deleted and failed replicas
+        """
+        successful = failed = 0
+        for name in self.names():
+            partition_successful, partition_failed = self._partition(name).delete_many(filters)
+            successful += partition_successful
+            failed += partition_failed
+        return successful, failed
+
+    def iterate(self, return_properties: list[str] = None, include_vector: bool = False) -> Iterator[StoredObject]:
+        requested = None
+        if return_properties is not None:
+            requested = list(dict.fromkeys(return_properties + [self.program_property, self.language_property]))
+        for name in self.names():
+            for obj in self._partition(name).iterate(requested, include_vector=include_vector):
+                if self.partitions_of(obj.properties)[0] != name:
+                    continue  # A replica, the object is yielded from its first partition
+                if return_properties is not None:
+                    obj.properties = {key: obj.properties.get(key) for key in return_properties}
+                yield obj
+
+    def fetch_sorted(self, property_name: str, limit: int, include_vector: bool = False) -> list[StoredObject]:
+        best: dict[str, StoredObject] = {}
+        for results in self._executor.map(
+            lambda name: self._partition(name).fetch_sorted(property_name, limit, include_vector), self.names()
+        ):
+            for obj in results:
+                best.setdefault(str(obj.uuid), obj)
+        return sorted(best.values(), key=lambda obj: obj.properties.get(property_name) or 0, reverse=True)[:limit]
+
+    def count(self, filters: Filter | None = None) -> int:
+        """
+        Count the objects without their replicas. An object with p degree programs and l languages is stored
+        in p * l partitions, so each partition counts its objects by their number of programs and languages
+        and every object is weighted by the inverse of its number of replicas.
+        """
+        names = self.names()
+        programs = {name.split("_")[-2] for name in names} - {_slug(GENERAL)}
+        languages = {name.split("_")[-1] for name in names}
+        # Most objects are about at most one degree program in one language, so these are counted first
+        shapes = sorted(((p, l) for p in range(len(programs) + 1) for l in range(len(languages) + 1)),
+                        key=lambda shape: (max(shape[0], 1) * max(shape[1], 1), shape))
+
+        def count_partition(name: str) -> float:
+            partition = self._partition(name)
+            remaining = partition.count(filters)
+            weighted = 0.0
+            for program_count, language_count in shapes:
+                if not remaining:
+                    break
+                shape = Filter.length_equal(self.program_property, program_count) & \
+                    Filter.length_equal(self.language_property, language_count)
+                count = partition.count(shape if filters is None else filters & shape)
+                weighted += count / (max(program_count, 1) * max(language_count, 1))
+                remaining -= count
+            return weighted
+
+        return round(sum(self._executor.map(count_partition, names)))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        with self._lock:
+            for partition in self._partitions.values():
+                partition.close()
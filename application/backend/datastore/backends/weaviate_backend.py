@@ -0,0 +1,119 @@
+from typing import Any, Iterator
+
+import weaviate
+import weaviate.classes as wvc
+from weaviate.exceptions import UnexpectedStatusCodeError
+
+from application.backend.datastore.backends.base import (
+    And,
+    ContainsAny,
+    Equal,
+    Filter,
+    LengthEqual,
+    ObjectNotFoundError,
+    Or,
+    StoredObject,
+    VectorStoreBackend,
+)
+
+
+def to_weaviate_filter(filters: Filter):
+    """
+    Translate a backend-independent filter to a Weaviate filter.
+    """
+    if isinstance(filters, Equal):
+        return wvc.query.Filter.by_property(filters.property_name).equal(filters.value)
+    if isinstance(filters, LengthEqual):
+        return wvc.query.Filter.by_property(filters.property_name, length=True).equal(filters.length)
+    if isinstance(filters, ContainsAny):
+        return wvc.query.Filter.by_property(filters.property_name).contains_any(val=list(filters.values))
+    if isinstance(filters, (And, Or)):
+        translated = [to_weaviate_filter(f) for f in filters.filters]
+        combined = translated[0]
+        for other in translated[1:]:
+            combined = combined & other if isinstance(filters, And) else combined | other
+        return combined
+    raise ValueError(f"Unsupported filter: {filters.key()}")
+
+
+def _vector_of(obj) -> list[float] | None:
+    if not obj.vector:
+        return None
+    return obj.vector.get("default") if isinstance(obj.vector, dict) else obj.vector
+
+
+class WeaviateBackend(VectorStoreBackend):
+    """
+    A collection in Weaviate, which vectorizes objects itself using its configured vectorizer.
+    """
+
+    def __init__(self, collection: weaviate.collections.Collection):
+        self.collection = collection
+
+    def hybrid_search(
+        self, query: str, limit: int, filters: Filter | None = None, alpha: float = 0.5, vector: list[float] = None
+    ) -> list[StoredObject]:
+        result = self.collection.query.hybrid(
+            query=query,
+            limit=limit,
+            filters=to_weaviate_filter(filters) if filters is not None else None,
+            alpha=alpha,
+            vector=vector,  # Weaviate only vectorizes the query if no vector is given
+        )
+        return [StoredObject(obj.uuid, obj.properties) for obj in result.objects]
+
+    def near_text(self, query: str, limit: int) -> list[StoredObject]:
+        result = self.collection.query.near_text(
+            query=query,
+            limit=limit,
+            return_metadata=wvc.query.MetadataQuery(distance=True)
+        )
+        return [StoredObject(obj.uuid, obj.properties, distance=obj.metadata.distance) for obj in result.objects]
+
+    def insert(self, properties: dict[str, Any], uuid=None) -> Any:
+        if uuid is not None and self.collection.data.exists(uuid):
+            self.collection.data.replace(uuid=uuid, properties=properties)
+            return uuid
+        return self.collection.data.insert(properties, uuid=uuid)
+
+    def insert_many(self, objects: list[dict[str, Any]], uuids: list | None = None) -> list[dict[str, Any]]:
+        with self.collection.batch.dynamic() as batch:
+            for object_to_upload, uuid in zip(objects, uuids or [None] * len(objects)):
+                batch.add_object(properties=object_to_upload, uuid=uuid)
+        if batch.number_errors > 0:
+            return [failed.object_.properties for failed in batch._BatchBase__results_for_wrapper.failed_objects]
+        return []
+
+    def update(self, uuid, properties: dict[str, Any]):
+        try:
+            self.collection.data.update(uuid=uuid, properties=properties)
+        except UnexpectedStatusCodeError as error:
+            if error.status_code == 404:
+                raise ObjectNotFoundError(f"No object with uuid {uuid} in {self.collection.name}") from error
+            raise
+
+    def delete_by_id(self, uuid):
+        self.collection.data.delete_by_id(uuid)
+
+    def delete_many(self, filters: Filter) -> tuple[int, int]:
+        result = self.collection.data.delete_many(where=to_weaviate_filter(filters))
+        return result.successful, result.failed
+
+    def iterate(self, return_properties: list[str] = None, include_vector: bool = False) -> Iterator[StoredObject]:
+        for obj in self.collection.iterator(include_vector=include_vector, return_properties=return_properties):
+            yield StoredObject(obj.uuid, obj.properties, vector=_vector_of(obj) if include_vector else None)
+
+    def fetch_sorted(self, property_name: str, limit: int, include_vector: bool = False) -> list[StoredObject]:
+        result = self.collection.query.fetch_objects(
+            limit=limit,
+            sort=wvc.query.Sort.by_property(property_name, ascending=False),
+            include_vector=include_vector,
+        )
+        return [StoredObject(obj.uuid, obj.properties, vector=_vector_of(obj) if include_vector else None)
+                for obj in result.objects]
+
+    def count(self, filters: Filter | None = None) -> int:
+        return self.collection.aggregate.over_all(
+            total_count=True,
+            filters=to_weaviate_filter(filters) if filters is not None else None,
+        ).total_count
@@ -0,0 +1,163 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import Callable
+
+from application.backend.datastore.backends.base import VectorStoreBackend
+from application.backend.datastore.collections.main.local_index import LocalHybridIndex
+from application.backend.datastore.collections.main.schema import Chunk
+from application.backend.metrics import CACHE_HITS, CACHE_MISSES, HOT_CHUNKS, RETRIEVED_CHUNKS
+
+logger = logging.getLogger(__name__)
+
+HOT_CHUNKS_SIZE = int(os.getenv("HOT_CHUNKS_SIZE", "0"))  # 0 disables the warm cache and the hit counting
+# A search is only served from the warm cache if all its results are at least this similar to the query
+HOT_CHUNKS_MIN_SIMILARITY = float(os.getenv("HOT_CHUNKS_MIN_SIMILARITY", "0.85"))
+HOT_CHUNKS_REFRESH_SECONDS = float(os.getenv("HOT_CHUNKS_REFRESH_SECONDS", "300"))
+HIT_FLUSH_SECONDS = float(os.getenv("HIT_FLUSH_SECONDS", "30"))
+
+
+class HotChunkCache:
+    """
+    A warm cache of the most retrieved chunks with their vectors, which serves searches for popular content
+    without a round trip to the vector database.
+
+    - Retrievals are counted in memory and added to the `hits` of the chunks in the background
+    - The chunks with the most hits are reloaded periodically, so the cache follows what is popular
+    - A search is served from the cache only if its best k results there are all close to the query,
+      otherwise better matches might be outside of the cache and the vector database is searched
+    """
+
+    def __init__(
+        self,
+        backend: VectorStoreBackend,
+        embed_query: Callable[[str], list[float]],
+        chunk_from_object: Callable,
+        size: int = HOT_CHUNKS_SIZE,
+        min_similarity: float = HOT_CHUNKS_MIN_SIMILARITY,
+        refresh_interval: float = HOT_CHUNKS_REFRESH_SECONDS,
+        flush_interval: float = HIT_FLUSH_SECONDS,
+    ):
+        """
+        :param backend: The vector store holding the chunks
+        :param embed_query: Embeds queries with the same model that vectorized the chunks
+        :param chunk_from_object: Converts a stored object to a Chunk
+        :param size: The number of chunks kept in memory
+        :param min_similarity: The minimum cosine similarity of every result of a search served from the cache
+        :param refresh_interval: The time in seconds between reloads of the most retrieved chunks
+        :param flush_interval: The time in seconds between writes of the counted retrievals
+        """
+        self.backend = backend
+        self.embed_query = embed_query
+        self.chunk_from_object = chunk_from_object
+        self.size = size
+        self.min_similarity = min_similarity
+        self.refresh_interval = refresh_interval
+        self.flush_interval = flush_interval
+
+        self.index: LocalHybridIndex | None = None
+        self._hot_uuids: frozenset = frozenset()
+        self._counts: Counter = Counter()  # Retrievals per chunk uuid that are not written yet
+        # The last known hits per chunk uuid, with the properties a partitioned backend routes updates by
+        self._hits: dict = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="hot-chunks", daemon=True)
+
+    def start(self) -> "HotChunkCache":
+        self.refresh()
+        self._thread.start()
+        return self
+
+    def refresh(self):
+        """
+        Load the most retrieved chunks into memory, searches use the previous ones until they are loaded.
+        """
+        try:
+            objects = self.backend.fetch_sorted(Chunk.HITS, self.size, include_vector=True)
+            snapshot = [(self.chunk_from_object(obj), obj.vector) for obj in objects if obj.vector]
+            self.index = LocalHybridIndex.from_snapshot(snapshot, self.embed_query) if snapshot else None
+            self._hot_uuids = frozenset(str(chunk.uuid) for chunk, _ in snapshot)
+            HOT_CHUNKS.set(len(snapshot))
+        except Exception as error:
+            logger.warning(f"Could not load the most retrieved chunks: {error}")
+
+    def search(
+        self, query: str, k: int, degree_programs: set[str] = None, language: str = None
+    ) -> tuple[list[Chunk] | None, list[float] | None]:
+        """
+        Search the cached chunks with the semantics of MainDataCollection.search.
+        :return: The results, or None if the cache cannot answer the search confidently,
+        and the embedding of the query if it was computed, so a search in the vector database can reuse it
+        """
+        index = self.index
+        vector = None
+        if index is not None:
+            vector = index.query_vector(query)  # Embedded once, the index serves it from memory below
+            similarity = index.kth_similarity(query, k, degree_programs, language)
+            if similarity is not None and similarity >= self.min_similarity:
+                CACHE_HITS.labels(cache="hot_chunks").inc()
+                return index.search(query, k=k, degree_programs=degree_programs, language=language), None
+        CACHE_MISSES.labels(cache="hot_chunks").inc()
+        return None, vector.tolist() if vector is not None else None
+
+    def record(self, chunks: list[Chunk]):
+        """
+        Count the retrieval of chunks, the counts are added to their hits with the next flush.
+        """
+        hot = 0
+        with self._lock:
+            for chunk in chunks:
+                if chunk.uuid is None:
+                    continue
+                key = str(chunk.uuid)
+                self._counts[key] += 1
+                self._hits.setdefault(key, (chunk.uuid, chunk.hits or 0, {
+                    Chunk.DEGREE_PROGRAMS: list(chunk.degree_programs or []),
+                    Chunk.LANGUAGES: list(chunk.languages or []),
+                }))
+                hot += key in self._hot_uuids
+        RETRIEVED_CHUNKS.labels(hot="true").inc(hot)
+        RETRIEVED_CHUNKS.labels(hot="false").inc(len(chunks) - hot)
+
+    def flush(self):
+        """
+        Add the counted retrievals to the hits of the chunks in one batch.
+        Concurrent processes may overwrite each other's increments, the hits only need to rank chunks roughly.
+        """
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+        if not counts:
+            return
+        updates = {}
+        for key, count in counts.items():
+            uuid, hits, routing = self._hits[key]
+            updates[key] = (uuid, hits + count, routing)
+        try:
+            missing = self.backend.update_many(
+                [(uuid, {Chunk.HITS: hits, **routing}) for uuid, hits, routing in updates.values()]
+            )
+        except Exception as error:
+            logger.warning(f"Could not update the hits of {len(updates)} chunks: {error}")
+            return
+        for uuid in missing:  # Deleted since they were retrieved
+            self._hits.pop(str(uuid), None)
+            updates.pop(str(uuid), None)
+        self._hits.update(updates)
+
+    def _run(self):
+        refreshed = time.monotonic()
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+            if time.monotonic() - refreshed >= self.refresh_interval:
+                self.refresh()
+                refreshed = time.monotonic()
+
+    def stop(self):
+        """
+        Stop the background refresh and write the counted retrievals.
+        """
+        self._stopped.set()
+        self.flush()
@@ -0,0 +1,427 @@
+import json
+import math
+import mmap
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Callable, Iterable, Sequence
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from application.backend.datastore.collections.main.schema import Chunk
+
+# Same defaults as Weaviate's BM25 implementation
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_PATTERN = re.compile(r"[^\W_]+", re.UNICODE)
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Split a text into lowercase alphanumeric words, like Weaviate's "word" tokenization.
+    """
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def _normalize_scores(scores: np.ndarray) -> np.ndarray:
+    """
+    Min-max normalize scores to [0, 1], as done by Weaviate's relative score fusion.
+    """
+    if scores.size == 0:
+        return scores
+    low, high = scores.min(), scores.max()
+    if high == low:
+        return np.ones_like(scores)
+    return (scores - low) / (high - low)
+
+
+def _normalize_vector(vector: Sequence[float]) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def azure_embeddings():
+    """
+    Create embeddings with the same Azure OpenAI deployment that Weaviate uses to vectorize chunks.
+    """
+    from langchain_openai import AzureOpenAIEmbeddings
+
+    return AzureOpenAIEmbeddings(
+        azure_deployment=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
+        openai_api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        openai_api_version="2023-05-15",
+    )
+
+
+def azure_query_embedder() -> Callable[[str], list[float]]:
+    """
+    Create a function that embeds queries with the same Azure OpenAI deployment that Weaviate uses to vectorize chunks.
+    """
+    return azure_embeddings().embed_query
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words embeddings, so that texts sharing words are similar.
+    Used instead of the Azure OpenAI deployment in tests and benchmarks that run without network access.
+    """
+
+    dimensions = 64
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in tokenize(text):
+            vector[zlib.crc32(token.encode()) % self.dimensions] += 1
+        return vector.tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+class HybridIndex:
+    """
+    An in-memory hybrid search index over a fixed set of texts and their vectors.
+
+    - Vector search over a matrix of normalized vectors (cosine similarity)
+    - BM25 keyword search over the texts
+    - Both are fused with the same relative score fusion as the hybrid search in Weaviate
+    """
+
+    def __init__(
+        self,
+        texts: list[str],
+        vectors: np.ndarray,
+        embed_query: Callable[[str], list[float]],
+        candidate_pool: int = 100,
+        query_cache_size: int = 1024,
+    ):
+        """
+        :param texts: The texts to search with BM25
+        :param vectors: The vectors of the texts, one row per text
+        :param embed_query: Embeds a query into the vector space of the texts
+        :param candidate_pool: The number of results each of the two searches contributes to the fusion
+        :param query_cache_size: The number of query embeddings to keep in memory
+        """
+        self._init_search(embed_query, candidate_pool, query_cache_size)
+
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.vectors = vectors / np.where(norms == 0, 1, norms)
+
+        self._build_bm25(texts)
+
+    def _init_search(self, embed_query: Callable[[str], list[float]], candidate_pool: int, query_cache_size: int):
+        self.embed_query = embed_query
+        self.candidate_pool = candidate_pool
+        self.query_cache_size = query_cache_size
+        self._query_cache: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._query_cache_lock = threading.Lock()  # Searches run in several threads
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def _build_bm25(self, texts: list[str]):
+        """
+        Build an inverted index with the term frequencies of every text.
+        The postings of all terms are stored back to back in flat arrays, so the index can be saved and memory-mapped.
+        """
+        postings: dict[str, dict[int, int]] = {}
+        self.doc_lengths = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            self.doc_lengths[doc_id] = len(tokens)
+            for token in tokens:
+                term_postings = postings.setdefault(token, {})
+                term_postings[doc_id] = term_postings.get(doc_id, 0) + 1
+        self.average_doc_length = float(self.doc_lengths.mean()) if len(texts) else 0.0
+
+        total = len(texts)
+        self.terms: dict[str, int] = {term: term_id for term_id, term in enumerate(postings)}
+        self.posting_offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        self.idf = np.zeros(len(postings), dtype=np.float32)
+        for term_id, docs in enumerate(postings.values()):
+            self.posting_offsets[term_id + 1] = self.posting_offsets[term_id] + len(docs)
+            self.idf[term_id] = math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+        self.posting_doc_ids = np.fromiter(
+            (doc_id for docs in postings.values() for doc_id in docs.keys()), dtype=np.int64,
+            count=int(self.posting_offsets[-1]))
+        self.posting_frequencies = np.fromiter(
+            (frequency for docs in postings.values() for frequency in docs.values()), dtype=np.float32,
+            count=int(self.posting_offsets[-1]))
+
+    def query_vector(self, query: str) -> np.ndarray:
+        """
+        The normalized embedding of the query, recently embedded queries are served from memory.
+        """
+        with self._query_cache_lock:
+            vector = self._query_cache.get(query)
+            if vector is not None:
+                self._query_cache.move_to_end(query)
+                return vector
+        # Embedded outside of the lock, so a slow embedding does not hold up other searches
+        vector = _normalize_vector(self.embed_query(query))
+        with self._query_cache_lock:
+            self._query_cache[query] = vector
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+        return vector
+
+    def bm25_scores(self, query: str) -> np.ndarray:
+        """
+        Compute the BM25 score of every text for the given query.
+        """
+        scores = np.zeros(len(self), dtype=np.float32)
+        if not self.average_doc_length:
+            return scores
+        for term in set(tokenize(query)):
+            term_id = self.terms.get(term)
+            if term_id is None:
+                continue
+            start, end = self.posting_offsets[term_id], self.posting_offsets[term_id + 1]
+            doc_ids, frequencies = self.posting_doc_ids[start:end], self.posting_frequencies[start:end]
+            idf = self.idf[term_id]
+            lengths = self.doc_lengths[doc_ids] / self.average_doc_length
+            scores[doc_ids] += idf * frequencies * (BM25_K1 + 1) / (
+                frequencies + BM25_K1 * (1 - BM25_B + BM25_B * lengths)
+            )
+        return scores
+
+    def vector_scores(self, query: str, vector: Sequence[float] = None) -> np.ndarray:
+        """
+        Compute the cosine similarity of every text to the given query.
+        :param vector: The embedding of the query if it is already known
+        """
+        return self.vectors @ (self.query_vector(query) if vector is None else _normalize_vector(vector))
+
+    def _top(self, scores: np.ndarray, candidates: np.ndarray, limit: int) -> np.ndarray:
+        """
+        Return the ids of the highest scoring candidates, best first.
+        """
+        if candidates.size <= limit:
+            return candidates[np.argsort(-scores[candidates], kind="stable")]
+        top = np.argpartition(-scores[candidates], limit)[:limit]
+        top = candidates[top]
+        return top[np.argsort(-scores[top], kind="stable")]
+
+    def rank(
+        self, query: str, mask: np.ndarray | None = None, k: int = 3, alpha: float = 0.5, vector: Sequence[float] = None
+    ) -> list[tuple[int, float]]:
+        """
+        Rank the texts for the given query by fusing the vector and keyword search scores.
+        :param query: The query to search for
+        :param mask: Only texts where the mask is True are considered, all texts if None
+        :param k: The number of results
+        :param alpha: The weight of the vector search, 1.0 is pure vector search and 0.0 is pure keyword search
+        :param vector: The embedding of the query if it is already known, otherwise the query is embedded
+        :return: The ids and fused scores of the best texts, best first
+        """
+        candidates = np.flatnonzero(mask) if mask is not None else np.arange(len(self))
+        if candidates.size == 0:
+            return []
+
+        fused: dict[int, float] = {}
+        if alpha > 0:
+            vector_scores = self.vector_scores(query, vector)
+            top_vector = self._top(vector_scores, candidates, self.candidate_pool)
+            for doc_id, score in zip(top_vector, _normalize_scores(vector_scores[top_vector])):
+                fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + alpha * float(score)
+        if alpha < 1:
+            bm25_scores = self.bm25_scores(query)
+            keyword_candidates = candidates[bm25_scores[candidates] > 0]
+            top_keyword = self._top(bm25_scores, keyword_candidates, self.candidate_pool)
+            for doc_id, score in zip(top_keyword, _normalize_scores(bm25_scores[top_keyword])):
+                fused[int(doc_id)] = fused.get(int(doc_id), 0.0) + (1 - alpha) * float(score)
+
+        return sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+
+
+def _stack(masks: list[np.ndarray], size: int) -> np.ndarray:
+    return np.array(masks, dtype=bool) if masks else np.zeros((0, size), dtype=bool)
+
+
+class MappedChunks(Sequence):
+    """
+    The chunks of a saved index, decoded from a memory-mapped file when they are accessed.
+    Processes that map the same file share its pages instead of each holding every chunk as Python objects.
+    """
+
+    def __init__(self, path: str, offsets: np.ndarray):
+        """
+        :param path: A file with one JSON object of chunk properties per line
+        :param offsets: The byte offset of every line and the size of the file
+        """
+        self.offsets = offsets
+        with open(path, "rb") as file:
+            self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if offsets[-1] else b""
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, doc_id: int) -> Chunk:
+        properties = json.loads(self._data[self.offsets[doc_id]:self.offsets[doc_id + 1]])
+        uuid = properties.pop("uuid", None)
+        return Chunk(**properties, uuid=uuid)
+
+
+class LocalHybridIndex(HybridIndex):
+    """
+    An in-process replica of the main data collection for low-latency retrieval.
+    Uses the same alpha as the hybrid search in Weaviate, and evaluates the degree program and language filters
+    on precomputed bitsets.
+    """
+
+    def __init__(self, chunks: list[Chunk], vectors: np.ndarray, embed_query: Callable[[str], list[float]], **kwargs):
+        """
+        :param chunks: The chunks of the collection
+        :param vectors: The vectors of the chunks, one row per chunk
+        :param embed_query: Embeds a query into the vector space of the chunks
+        """
+        self.chunks = chunks
+        super().__init__([chunk.text for chunk in chunks], vectors, embed_query, **kwargs)
+        self._build_bitsets()
+
+    @classmethod
+    def from_snapshot(
+        cls, snapshot: Iterable[tuple[Chunk, list[float]]], embed_query: Callable[[str], list[float]], **kwargs
+    ) -> "LocalHybridIndex":
+        """
+        Build the index from a snapshot of (chunk, vector) pairs.
+        """
+        chunks, vectors = [], []
+        for chunk, vector in snapshot:
+            chunks.append(chunk)
+            vectors.append(vector)
+        return cls(chunks, np.array(vectors, dtype=np.float32), embed_query, **kwargs)
+
+    def save(self, directory: str):
+        """
+        Write the index to a directory, from which `load` maps it without rebuilding it.
+        """
+        os.makedirs(directory, exist_ok=True)
+        offsets = [0]
+        with open(os.path.join(directory, "chunks.jsonl"), "wb") as file:
+            for doc_id in range(len(self)):
+                chunk = self.chunks[doc_id]
+                properties = chunk.as_properties()
+                properties["uuid"] = str(chunk.uuid) if chunk.uuid is not None else None
+                line = json.dumps(properties, ensure_ascii=False).encode("utf-8") + b"\n"
+                file.write(line)
+                offsets.append(offsets[-1] + len(line))
+        arrays = {
+            "chunk_offsets": np.array(offsets, dtype=np.int64),
+            "vectors": self.vectors,
+            "doc_lengths": self.doc_lengths,
+            "posting_offsets": self.posting_offsets,
+            "posting_doc_ids": self.posting_doc_ids,
+            "posting_frequencies": self.posting_frequencies,
+            "idf": self.idf,
+            "general_mask": self.general_mask,
+            "program_masks": _stack(list(self.program_masks.values()), len(self)),
+            "language_masks": _stack(list(self.language_masks.values()), len(self)),
+        }
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as file:
+            json.dump({
+                "average_doc_length": self.average_doc_length,
+                "terms": list(self.terms),
+                "programs": list(self.program_masks),
+                "languages": list(self.language_masks),
+            }, file, ensure_ascii=False)
+
+    @classmethod
+    def load(
+        cls,
+        directory: str,
+        embed_query: Callable[[str], list[float]],
+        candidate_pool: int = 100,
+        query_cache_size: int = 1024,
+    ) -> "LocalHybridIndex":
+        """
+        Map an index written by `save`. The arrays and chunks are read-only views of the files,
+        so every process that loads the same directory shares one copy in the page cache.
+        """
+        def array(name: str) -> np.ndarray:
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as file:
+            meta = json.load(file)
+        index = cls.__new__(cls)
+        index._init_search(embed_query, candidate_pool, query_cache_size)
+        index.chunks = MappedChunks(os.path.join(directory, "chunks.jsonl"), array("chunk_offsets"))
+        index.vectors = array("vectors")
+        index.doc_lengths = array("doc_lengths")
+        index.average_doc_length = meta["average_doc_length"]
+        index.terms = {term: term_id for term_id, term in enumerate(meta["terms"])}
+        index.posting_offsets = array("posting_offsets")
+        index.posting_doc_ids = array("posting_doc_ids")
+        index.posting_frequencies = array("posting_frequencies")
+        index.idf = array("idf")
+        index.general_mask = array("general_mask")
+        index.program_masks = dict(zip(meta["programs"], array("program_masks")))
+        index.language_masks = dict(zip(meta["languages"], array("language_masks")))
+        return index
+
+    def _build_bitsets(self):
+        """
+        Precompute a boolean mask per degree program and language, and one for general chunks.
+        """
+        total = len(self.chunks)
+        self.general_mask = np.zeros(total, dtype=bool)
+        self.program_masks: dict[str, np.ndarray] = {}
+        self.language_masks: dict[str, np.ndarray] = {}
+        for doc_id, chunk in enumerate(self.chunks):
+            if not chunk.degree_programs:
+                self.general_mask[doc_id] = True
+            for program in chunk.degree_programs or []:
+                self.program_masks.setdefault(program, np.zeros(total, dtype=bool))[doc_id] = True
+            for language in chunk.languages or []:
+                self.language_masks.setdefault(language, np.zeros(total, dtype=bool))[doc_id] = True
+
+    def _filter_mask(self, degree_programs: set[str] | None, language: str | None) -> np.ndarray:
+        """
+        Evaluate the same filter as MainDataCollection.search on the bitsets.
+        """
+        mask = self.general_mask.copy()
+        for program in degree_programs or []:
+            program_mask = self.program_masks.get(program)
+            if program_mask is not None:
+                mask |= program_mask
+        if language:
+            language_mask = self.language_masks.get(language)
+            if language_mask is None:
+                return np.zeros_like(mask)
+            mask &= language_mask
+        return mask
+
+    def kth_similarity(self, query: str, k: int, degree_programs: set[str] = None, language: str = None) -> float | None:
+        """
+        The cosine similarity of the k-th most similar chunk to the query among those matching the filters.
+        :return: The similarity, or None if fewer than k chunks match the filters
+        """
+        candidates = np.flatnonzero(self._filter_mask(degree_programs, language))
+        if candidates.size < k or k < 1:
+            return None
+        similarities = self.vector_scores(query)[candidates]
+        return float(-np.partition(-similarities, k - 1)[k - 1])
+
+    def search(
+        self,
+        query: str,
+        k: int = 3,
+        degree_programs: set[str] = None,
+        language: str = None,
+        alpha: float = 0.5,
+    ) -> list[Chunk]:
+        """
+        Retrieve the most similar chunks to the given query with the same semantics as MainDataCollection.search.
+        :param alpha: The weight of the vector search, 1.0 is pure vector search and 0.0 is pure keyword search
+        """
+        ranked = self.rank(query, self._filter_mask(degree_programs, language), k=k, alpha=alpha)
+        return [self.chunks[doc_id] for doc_id, _ in ranked]
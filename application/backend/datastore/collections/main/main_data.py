@@ -1,12 +1,21 @@
+import logging
+import os
 import time
 import traceback
-from typing import Iterable
-
-import weaviate
-import weaviate.classes as wvc
+from typing import TYPE_CHECKING, Callable, Iterable, Iterator, Sized
 
+from application.backend.datastore.backends.base import Filter, VectorStoreBackend
+from application.backend.datastore.backends.partitioned_backend import PartitionedBackend
+from application.backend.datastore.collections.main.hot_chunks import HOT_CHUNKS_SIZE, HotChunkCache
+from application.backend.datastore.collections.main.local_index import LocalHybridIndex, azure_query_embedder
 from application.backend.datastore.collections.main.schema import Chunk
-from application.backend.datastore.collections.main.sharepoint_document import SharepointDocument
+from application.backend.datastore.collections.main.shared_index import (
+    SHARED_INDEX_CHECK_SECONDS, SHARED_INDEX_DIR, SharedIndexStore
+)
+from application.backend.metrics import SYNC_DOCUMENTS
+
+if TYPE_CHECKING:
+    from application.backend.datastore.collections.main.sharepoint_document import SharepointDocument
 
 
 def elapsed(start: float) -> str:
@@ -20,148 +29,340 @@ def elapsed(start: float) -> str:
     return f"{int(minutes)}m {seconds:.2f}s" if minutes > 0 else f"{seconds:.2f}s"
 
 
+logger = logging.getLogger(__name__)
+
+LOCAL_SEARCH = os.getenv("LOCAL_SEARCH", "false").lower() == "true"
+UPLOAD_BATCH_SIZE = 100  # The number of chunks of a document that are uploaded together
+
+
+def _as_set(degree_programs: str | Iterable[str] | None) -> set[str] | None:
+    """
+    The degree programs to filter by, the chatbot passes the single program of the user as a string.
+    """
+    if isinstance(degree_programs, str):
+        return {degree_programs} if degree_programs else None
+    return set(degree_programs) if degree_programs is not None else None
+
+
+def _batched(items: Iterable, size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 class MainDataCollection:
     """
     This class is responsible for managing the main data of the chatbot.
 
     - Synchronize the database with a source of truth
     - Retrieve the most similar documents to a given query with optional filters
+    - Optionally serve searches from an in-process replica of the collection, with the vector database as the fallback
+    - Optionally share that replica between the worker processes through memory-mapped files
+    - Optionally count how often chunks are retrieved and serve searches for the most retrieved ones from memory
     """
 
-    def __init__(self, collection: weaviate.collections.Collection):
-        self.collection = collection
+    def __init__(
+        self,
+        backend: VectorStoreBackend,
+        local_search: bool = LOCAL_SEARCH,
+        embed_query: Callable[[str], list[float]] = None,
+        shared_index: SharedIndexStore | None = None,
+        hot_chunks: int = HOT_CHUNKS_SIZE,
+    ):
+        """
+        :param backend: The vector store holding the collection
+        :param local_search: Whether to build an in-process replica of the collection and search it
+        :param embed_query: Embeds queries for the local replica, defaults to the Azure OpenAI deployment of Weaviate
+        :param shared_index: Where the replica is shared with other processes, defaults to SHARED_INDEX_DIR if set
+        :param hot_chunks: The number of most retrieved chunks to keep in memory, 0 disables the hit counting
+        """
+        self.backend = backend
+        self.local_search = local_search
+        self.local_index: LocalHybridIndex | None = None
+        self.embed_query = embed_query
+        if shared_index is None and local_search and SHARED_INDEX_DIR:
+            shared_index = SharedIndexStore(SHARED_INDEX_DIR)
+        self.shared_index = shared_index
+        self._generation: str | None = None  # The shared generation the replica was loaded from
+        self._checked_at = 0.0
+        if local_search:
+            # Workers map the published replica instead of each building their own
+            self.refresh_local_index(rebuild=False)
+        self.hot_chunks: HotChunkCache | None = None
+        if hot_chunks > 0:
+            self._start_hot_chunks(hot_chunks)
+
+    def _start_hot_chunks(self, size: int):
+        try:
+            if self.embed_query is None:
+                self.embed_query = azure_query_embedder()
+            self.hot_chunks = HotChunkCache(self.backend, self.embed_query, self._chunk_from_object, size).start()
+            logger.info(f"Loaded {len(self.hot_chunks.index or [])} most retrieved chunks into memory.")
+        except Exception as error:
+            logger.warning(f"Could not start the cache of the most retrieved chunks: {error}")
+
+    @staticmethod
+    def _chunk_from_object(obj) -> Chunk:
+        """
+        Convert a stored object to a Chunk.
+        """
+        return Chunk(
+            uuid=obj.uuid,
+            text=obj.properties[Chunk.TEXT],
+            faculty=obj.properties.get(Chunk.FACULTY, None),
+            target_groups=obj.properties.get(Chunk.TARGET_GROUPS, None),
+            topic=obj.properties.get(Chunk.TOPIC, None),
+            subtopic=obj.properties.get(Chunk.SUBTOPIC, None),
+            title=obj.properties.get(Chunk.TITLE, None),
+            degree_programs=obj.properties.get(Chunk.DEGREE_PROGRAMS, None),
+            languages=obj.properties.get(Chunk.LANGUAGES, None),
+            hash=obj.properties[Chunk.HASH],
+            url=obj.properties[Chunk.URL],
+            hits=obj.properties[Chunk.HITS],
+            page=obj.properties.get(Chunk.PAGE, None),
+        )
+
+    def snapshot(self) -> Iterable[tuple[Chunk, list[float]]]:
+        """
+        Iterate over all chunks in the vector database together with their vectors.
+        """
+        for obj in self.backend.iterate(include_vector=True):
+            yield self._chunk_from_object(obj), obj.vector
+
+    def refresh_local_index(self, rebuild: bool = True, outdated: str | None = None):
+        """
+        Rebuild the in-process replica from a snapshot of the collection.
+        Searches keep using the previous replica (or the vector database) until the new one is complete.
+        With a shared index, the replica is built by one process, published and then mapped by every worker.
+        :param rebuild: Whether to build a new shared replica even if one has already been published
+        :param outdated: Only build a new shared replica if this generation is still the published one,
+        so of the workers that notice the same change only the first one rebuilds it
+        """
+        start = time.time()
+        try:
+            if self.embed_query is None:
+                self.embed_query = azure_query_embedder()
+            if self.shared_index is None:
+                self.local_index = LocalHybridIndex.from_snapshot(self.snapshot(), self.embed_query)
+                logger.info(f"Built local search index with {len(self.local_index)} chunks in {elapsed(start)}.")
+                return
+            with self.shared_index.lock():
+                # Another worker might have published the replica while this one waited for the lock
+                current = self.shared_index.current()
+                if current is None or rebuild and (outdated is None or current == outdated):
+                    self.shared_index.publish(LocalHybridIndex.from_snapshot(self.snapshot(), self.embed_query))
+            self._load_shared_index(self.shared_index.current())
+            logger.info(f"Loaded shared local search index with {len(self.local_index)} chunks in {elapsed(start)}.")
+        except Exception as error:
+            logger.warning(f"Could not build local search index, searching the vector database instead: {error}")
+
+    def invalidate(self):
+        """
+        Reload what is held in memory about the collection after another process changed it, e.g. a sync run.
+        """
+        if self.local_search:
+            self.refresh_local_index(outdated=self._generation)
+        if self.hot_chunks is not None:
+            self.hot_chunks.refresh()
+
+    def _load_shared_index(self, generation: str):
+        self.local_index = self.shared_index.load(generation, self.embed_query)
+        self._generation = generation
+
+    def _follow_shared_index(self):
+        """
+        Swap to the current shared replica if another process published a new one.
+        The published generation is checked at most every SHARED_INDEX_CHECK_SECONDS.
+        """
+        now = time.monotonic()
+        if now - self._checked_at < SHARED_INDEX_CHECK_SECONDS:
+            return
+        self._checked_at = now
+        generation = self.shared_index.current()
+        if generation is not None and generation != self._generation:
+            try:
+                self._load_shared_index(generation)
+                logger.info(f"Switched to shared local search index generation {generation}.")
+            except Exception as error:
+                logger.warning(f"Could not load shared local search index {generation}: {error}")
 
     def _fetch_distinct_hashes(self) -> set[str]:
         """
-        Fetch the distinct hashes of documents in Weaviate.
-        :return: The distinct hashes of the documents in Weaviate
+        Fetch the distinct hashes of documents in the vector database.
+        :return: The distinct hashes of the documents in the vector database
         """
         hashes = set()
-        for obj in self.collection.iterator(return_properties=[Chunk.HASH]):
+        for obj in self.backend.iterate(return_properties=[Chunk.HASH]):
             hashes.add(obj.properties[Chunk.HASH])
         return hashes
 
     def count_chunks(self) -> int:
         """
-        Count the number of chunks in Weaviate.
-        :return: The number of chunks in Weaviate
+        Count the number of chunks in the vector database.
+        :return: The number of chunks in the vector database
         """
-        return self.collection.aggregate.over_all(total_count=True).total_count
+        return self.backend.count()
 
     def count_documents(self) -> int:
         """
-        Count the number of documents in Weaviate.
-        :return: The number of documents in Weaviate
+        Count the number of documents in the vector database.
+        :return: The number of documents in the vector database
         """
         return len(self._fetch_distinct_hashes())
 
     def delete_by_hashes(self, hashes: Iterable[str]):
         """
-        Delete documents from Weaviate by their hashes.
+        Delete documents from the vector database by their hashes.
         :param hashes: The hashes of the documents to delete
         """
         for hash in hashes:
             print(f"Removing chunks with hash '{hash}'...", end="\r")
-            result = self.collection.data.delete_many(
-                where=wvc.query.Filter.by_property(Chunk.HASH).equal(hash)
-            )
-            print(f"Removed {result.successful} chunks with hash '{hash}', {result.failed} failed.")
+            successful, failed = self.backend.delete_many(Filter.equal(Chunk.HASH, hash))
+            print(f"Removed {successful} chunks with hash '{hash}', {failed} failed.")
 
     def _remove_by_hash(self, hash: str):
         """
-        Remove documents from Weaviate by their hashes.
+        Remove documents from the vector database by their hashes.
         :param hash: The hashes of the documents to remove
         """
         print(f"Removing chunks with hash '{hash}'...", end="\r")
-        result = self.collection.data.delete_many(
-            where=wvc.query.Filter.by_property(Chunk.HASH).equal(hash)
-        )
-        print(f"Removed {result.successful} chunks with hash '{hash}', {result.failed} failed.")
+        successful, failed = self.backend.delete_many(Filter.equal(Chunk.HASH, hash))
+        print(f"Removed {successful} chunks with hash '{hash}', {failed} failed.")
 
-    def synchronize(self, source_of_truth: list[SharepointDocument]):
+    def synchronize(self, source_of_truth: Iterable["SharepointDocument"]) -> int:
         """
         Synchronize the database with the provided LocalDocuments as the source of truth.
         This will add new documents to the database that are not already in it,
         and remove documents from the database that are no longer in the provided documents.
         Provided documents that are already in the database will not be re-added.
         This is done by comparing the hashes of the documents.
+        Documents are handled as they arrive: unchanged ones are released right away and new ones are uploaded,
+        so a source that streams its documents only holds one of them at a time.
+        Removed documents are deleted once the whole source has been seen.
         This method should be called periodically to ensure that the database is up-to-date.
-        :param source_of_truth: The source of truth
-        :return: A tuple of two lists: the first list contains the documents that were successfully added/updated,
-        the second list contains the documents that failed to be added/updated
+        :param source_of_truth: The source of truth, e.g. the documents as they are loaded from SharePoint
+        :return: The number of documents in the source of truth
         """
         print("Fetching current state of vector database...")
         start = time.time()
-        # Fetch the current hashes from Weaviate
+        # Fetch the current hashes from the vector database
         db_hashes = self._fetch_distinct_hashes()
         print(f"Found {len(db_hashes)} documents in vector database, comparing with source of truth...")
-        truth_docs_by_hash = {doc.hash: doc for doc in source_of_truth}
-        truth_hashes = truth_docs_by_hash.keys()
-        hashes_to_reembed = {hash for hash, doc in truth_docs_by_hash.items() if doc.should_reembed()}
-        hashes_to_remove_from_db = db_hashes - (truth_hashes - hashes_to_reembed)
-        hashes_to_keep_in_db = db_hashes - hashes_to_remove_from_db
-        hashes_to_upload = truth_hashes - hashes_to_keep_in_db
-
-        if hashes_to_reembed:
-            print(f"{len(hashes_to_reembed)} documents are marked for resynchronization and will be re-imported.")
-        print(f"{len(hashes_to_remove_from_db)} documents will be removed, {len(hashes_to_keep_in_db)} documents "
-              f"will be kept, and {len(hashes_to_upload)} new documents will be added.")
+        truth_hashes = set()
+        counts = {"kept": 0, "reembedded": 0}
+
+        def documents_to_upload() -> Iterator["SharepointDocument"]:
+            for document in source_of_truth:
+                if document.hash in truth_hashes:  # The same document twice, it is only imported once
+                    document.release()
+                    continue
+                truth_hashes.add(document.hash)
+                if document.hash in db_hashes:
+                    if not document.should_reembed():
+                        # The document did not change - we set its sync status to True if it isn't already
+                        document.release()
+                        document.update_sync_status(True)
+                        counts["kept"] += 1
+                        continue
+                    print(f"Document '{document.file_path}' is marked for resynchronization and will be re-imported.")
+                    self.delete_by_hashes([document.hash])
+                    counts["reembedded"] += 1
+                yield document
+
+        # Add new documents from the source of truth as they arrive
+        self.ingest(documents_to_upload())
 
         # Remove documents that are no longer in the source of truth
+        hashes_to_remove_from_db = db_hashes - truth_hashes
         if hashes_to_remove_from_db:
             print(f"Removing documents from vector database...")
             self.delete_by_hashes(hashes_to_remove_from_db)
+        print(f"{len(hashes_to_remove_from_db)} documents were removed, {counts['kept']} documents were kept, "
+              f"and {counts['reembedded']} documents were re-imported.")
+        print(f"Synchronized vector database with source of truth in {elapsed(start)}.")
+        if self.local_index is not None:
+            self.refresh_local_index()
+        return len(truth_hashes)
 
-        # Add new documents from the source of truth
-        documents_to_upload = [truth_docs_by_hash[hash] for hash in hashes_to_upload]
-        self.ingest(documents_to_upload)
+    def synchronize_changes(self, changed: list["SharepointDocument"], hashes_to_remove: set[str]):
+        """
+        Incremental counterpart of `synchronize`, which only needs the documents that changed in SharePoint.
+        Changed documents that are already in the vector database under their hash are kept,
+        unless they are marked for resynchronization, the others are added.
+        :param changed: The documents that are new or changed since the previous synchronization
+        :param hashes_to_remove: The hashes of the documents that were removed or replaced by a changed document
+        """
+        start = time.time()
+        # The database only has to be read if a changed document might be in it already, e.g. on the first run
+        db_hashes = self._fetch_distinct_hashes() if changed else set()
+        hashes_to_reembed = {doc.hash for doc in changed if doc.should_reembed()}
+        documents_to_keep = [doc for doc in changed if doc.hash in db_hashes - hashes_to_reembed]
+        documents_to_upload = [doc for doc in changed if doc.hash not in db_hashes - hashes_to_reembed]
+        hashes_to_remove = (set(hashes_to_remove) | hashes_to_reembed) & db_hashes if changed else hashes_to_remove
+        print(f"{len(hashes_to_remove)} documents will be removed, {len(documents_to_keep)} changed documents "
+              f"are already in the vector database, and {len(documents_to_upload)} documents will be added.")
 
-        # These are just the documents which did not change - we set their sync status to True if it isn't already
-        # Those that did change already had their sync status updated
-        print("Updating sync status in SharePoint...")
-        for existing_doc in [truth_docs_by_hash[hash] for hash in hashes_to_keep_in_db]:
-            existing_doc.update_sync_status(True)
-        print(f"Synchronized vector database with source of truth in {elapsed(start)}.")
+        if hashes_to_remove:
+            print(f"Removing documents from vector database...")
+            self.delete_by_hashes(hashes_to_remove)
+        for document in documents_to_keep:
+            document.update_sync_status(True)
+            document.release()
+        self.ingest(documents_to_upload)
+        print(f"Synchronized vector database with the changes in {elapsed(start)}.")
+        if self.local_index is not None:
+            self.refresh_local_index()
 
-    def ingest(self, documents: list[SharepointDocument] | set[SharepointDocument]):
+    def ingest(self, documents: "Iterable[SharepointDocument]"):
         """
-        Ingest the given documents into Weaviate.
-        :param documents: The documents to ingest
+        Ingest the given documents into the vector database.
+        :param documents: The documents to ingest, documents that are still being loaded are ingested as they arrive
         """
         print(f"Uploading new documents to vector database...")
         successes = 0
         fails = 0
+        total = len(documents) if isinstance(documents, Sized) else None
+        SYNC_DOCUMENTS.labels(state="total").set(total or 0)
+        SYNC_DOCUMENTS.labels(state="succeeded").set(0)
+        SYNC_DOCUMENTS.labels(state="failed").set(0)
         for i, document in enumerate(documents):
-            progress = f"{i + 1}/{len(documents)}"
+            progress = f"{i + 1}/{total}" if total is not None else f"{i + 1}"
+            if total is None:
+                SYNC_DOCUMENTS.labels(state="total").set(i + 1)
             print(f"({progress}) Chunking document '{document.file_path}'...", end="\r")
-            # Try to chunk the document
-            # If this fails then there is a bug with a chunking library, stacktrace will be printed
+            # Chunks are uploaded in batches while the document is still being parsed
+            # If chunking fails then there is a bug with a chunking library, stacktrace will be printed
+            chunking = time.time()
+            uploaded = 0
             try:
-                chunking = time.time()
-                chunks = document.chunk()
-                print(f"({progress}) Chunked document '{document.file_path}' into {len(chunks)} chunks "
+                for batch in _batched(document.iter_chunks(), UPLOAD_BATCH_SIZE):
+                    self.import_chunks(batch)
+                    uploaded += len(batch)
+                print(f"({progress}) Chunked and uploaded document '{document.file_path}' as {uploaded} chunks "
                       f"(took {elapsed(chunking)}).")
+                document.update_sync_status(True)
+                successes += 1
             except Exception:
-                print(f"({progress}) Failed to chunk document '{document.file_path}'")
+                print(f"({progress}) Failed to chunk or upload document '{document.file_path}'")
                 traceback.print_exc()
+                if uploaded:
+                    self.delete_by_hashes([document.hash])  # Do not keep a partially imported document
                 document.update_sync_status(False)  # Make sure SharePoint shows that this document failed
                 fails += 1
-                continue
-
-            # Try to upload the chunks
-            try:
-                self.import_chunks(chunks)
-                document.update_sync_status(True)
-                successes += 1
-            except Exception as e:
-                print(f"Error while uploading chunks of {document.file_path}: {e}")
-                document.update_sync_status(False)
-                fails += 1
-        print(f"Of the {len(documents)} documents to upload, {successes} succeeded and {fails} failed.")
+            finally:
+                document.release()
+                SYNC_DOCUMENTS.labels(state="succeeded").set(successes)
+                SYNC_DOCUMENTS.labels(state="failed").set(fails)
+        print(f"Of the {successes + fails} documents to upload, {successes} succeeded and {fails} failed.")
 
     def import_chunks(self, chunks: list[Chunk]):
         """
-        Import the given chunks into Weaviate.
+        Import the given chunks into the vector database.
         :param chunks: The chunks to import
         """
         len_chunks = len(chunks)
@@ -180,82 +381,106 @@ class MainDataCollection:
         print(f"Uploaded {len_chunks} chunks in {attempts} batches (took {elapsed(uploading)}).")
 
     def upload_objects(self, objects: list[dict]):
-        with self.collection.batch.dynamic() as batch:
-            for object_to_upload in objects:
-                batch.add_object(properties=object_to_upload)
-        if batch.number_errors > 0:
-            return [failed.object_.properties for failed in batch._BatchBase__results_for_wrapper.failed_objects]
-        return []
+        return self.backend.insert_many(objects)
 
     def search(
         self,
         query: str,
         k: int = 3,
-        degree_programs: set[str] = None,
+        degree_programs: str | set[str] = None,
         language: str = None,
     ) -> list[Chunk]:
         """
         Retrieve the most similar documents to the given query with optional filtering.
-        This performs a hybrid search in Weaviate.
+        This performs a hybrid search in the vector database, or in the local replica if enabled.
         :param query: The query to search for
         :param k: The number of documents to retrieve
-        :param degree_programs: Only fetch documents that are about at least one of these degree programs.
-        General documents will always be included. An empty set will only fetch general documents.
+        :param degree_programs: Only fetch documents that are about at least one of these degree programs,
+        or about the given one if it is a string. General documents will always be included.
+        An empty set will only fetch general documents.
         :param language: Only fetch documents that are (at least partially) in this language.
         """
+        degree_programs = _as_set(degree_programs)
+        if self.shared_index is not None and self.local_index is not None:
+            self._follow_shared_index()
+        results, vector = None, None
+        if self.local_index is not None:
+            try:
+                results = self.local_index.search(query, k=k, degree_programs=degree_programs, language=language)
+            except Exception as error:
+                logger.warning(f"Local search failed, falling back to the vector database: {error}")
+        elif self.hot_chunks is not None:
+            results, vector = self.hot_chunks.search(query, k=k, degree_programs=degree_programs, language=language)
+        if results is None:
+            results = self.search_backend(query, k=k, degree_programs=degree_programs, language=language, vector=vector)
+        if self.hot_chunks is not None:
+            self.hot_chunks.record(results)
+        return results
+
+    def search_backend(
+        self,
+        query: str,
+        k: int = 3,
+        degree_programs: str | set[str] = None,
+        language: str = None,
+        vector: list[float] = None,
+    ) -> list[Chunk]:
+        """
+        Retrieve the most similar documents to the given query by performing a hybrid search in the vector database.
+        A partitioned collection only searches the general and the degree programs' partitions of the language.
+        See `search` for the other parameters.
+        :param vector: The embedding of the query if it was already computed, otherwise the vector database embeds it
+        """
+        degree_programs = _as_set(degree_programs)
+        if isinstance(self.backend, PartitionedBackend) and language:
+            keys = [(program, language) for program in [None, *sorted(degree_programs or [])]]
+            result = self.backend.search_partitions(query, limit=k, keys=keys, alpha=0.5, vector=vector)
+            return [self._chunk_from_object(obj) for obj in result]
+
         # By default only fetch general documents
-        filter = wvc.query.Filter.by_property(Chunk.DEGREE_PROGRAMS, length=True).equal(0)
+        filter = Filter.length_equal(Chunk.DEGREE_PROGRAMS, 0)
         if degree_programs:
             # Fetch general data and data about the specified degree programs
-            filter = filter | wvc.query.Filter.by_property(
-                Chunk.DEGREE_PROGRAMS
-            ).contains_any(val=list(degree_programs))
+            filter = filter | Filter.contains_any(Chunk.DEGREE_PROGRAMS, degree_programs)
         if language:
-            filter = filter & wvc.query.Filter.by_property(Chunk.LANGUAGES).contains_any(val=[language])
-        result = self.collection.query.hybrid(
+            filter = filter & Filter.contains_any(Chunk.LANGUAGES, [language])
+        result = self.backend.hybrid_search(
             query=query,
             limit=k,
             filters=filter,
             alpha=0.5,  # alpha=1.0 is pure vector search, alpha=0.0 is pure text search. 0.5 is equal weight
+            vector=vector,
         )
-        # Convert from Weaviate objects to Chunks
-        relevant_chunks = [
-            Chunk(
-                uuid=obj.uuid,
-                text=obj.properties[Chunk.TEXT],
-                faculty=obj.properties.get(Chunk.FACULTY, None),
-                target_groups=obj.properties.get(Chunk.TARGET_GROUPS, None),
-                topic=obj.properties.get(Chunk.TOPIC, None),
-                subtopic=obj.properties.get(Chunk.SUBTOPIC, None),
-                title=obj.properties.get(Chunk.TITLE, None),
-                degree_programs=obj.properties.get(Chunk.DEGREE_PROGRAMS, None),
-                languages=obj.properties.get(Chunk.LANGUAGES, None),
-                hash=obj.properties[Chunk.HASH],
-                url=obj.properties[Chunk.URL],
-                hits=obj.properties[Chunk.HITS],
-            ) for obj in result.objects
-        ]
+        # Convert from stored objects to Chunks
+        relevant_chunks = [self._chunk_from_object(obj) for obj in result]
         return relevant_chunks
 
     def increment_hits(self, hits: list[Chunk]):
         """
-        Increment the hits of the given chunks in Weaviate.
+        Increment the hits of the given chunks in the vector database.
         :param hits: The chunks to increment the hits of
         """
         for chunk in hits:
             chunk.hits += 1
-            self.collection.data.update(
+            self.backend.update(
                 uuid=chunk.uuid,
                 properties={Chunk.HITS: chunk.hits}
             )
         print(f"Incremented hits of {len(hits)} chunks.")
 
+    def close(self):
+        """
+        Stop the cache of the most retrieved chunks and write the counted retrievals.
+        """
+        if self.hot_chunks is not None:
+            self.hot_chunks.stop()
+
     def query_distinct_degree_programs(self) -> set[str]:
         """
-        Query the distinct degree programs in Weaviate.
-        :return: The distinct degree programs in Weaviate
+        Query the distinct degree programs in the vector database.
+        :return: The distinct degree programs in the vector database
         """
         hashes = set()
-        for obj in self.collection.iterator(return_properties=[Chunk.DEGREE_PROGRAMS]):
+        for obj in self.backend.iterate(return_properties=[Chunk.DEGREE_PROGRAMS]):
             hashes.update(obj.properties[Chunk.DEGREE_PROGRAMS])
         return hashes
@@ -25,6 +25,7 @@ class Chunk:
     HASH = "hash"
     URL = "url"
     HITS = "hits"
+    PAGE = "page"
 
     text: str
     faculty: str | None
@@ -37,6 +38,7 @@ class Chunk:
     hash: str | None
     url: str | None
     hits: int
+    page: int | None  # The page of a PDF the chunk starts on
     uuid: Any  # This is a Weaviate UUID, will only be set in a query result
 
     def __init__(
@@ -52,6 +54,7 @@ class Chunk:
         hash: str | None = None,
         url: str | None = None,
         hits: int = 0,
+        page: int | None = None,
         uuid=None,
     ):
         self.text = text
@@ -65,6 +68,7 @@ class Chunk:
         self.hash = hash
         self.url = url
         self.hits = hits
+        self.page = page
         self.uuid = uuid
 
     def as_properties(self) -> dict[str, Any]:
@@ -84,6 +88,7 @@ class Chunk:
             Chunk.HASH: self.hash,
             Chunk.URL: self.url,
             Chunk.HITS: self.hits,
+            Chunk.PAGE: self.page,
         }
 
 
@@ -188,5 +193,11 @@ def create_collection_if_not_exists(client: WeaviateClient, collection_name: str
                 data_type=wvc.config.DataType.INT,
                 skip_vectorization=True,
             ),
+            wvc.config.Property(
+                name=Chunk.PAGE,
+                description="The page of a PDF document the chunk starts on",
+                data_type=wvc.config.DataType.INT,
+                skip_vectorization=True,
+            ),
         ],
     )
@@ -0,0 +1,89 @@
+import fcntl
+import logging
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Callable
+
+from application.backend.datastore.collections.main.local_index import LocalHybridIndex
+
+logger = logging.getLogger(__name__)
+
+# Unset: every process builds its own local search index
+SHARED_INDEX_DIR = os.getenv("SHARED_INDEX_DIR")
+SHARED_INDEX_CHECK_SECONDS = float(os.getenv("SHARED_INDEX_CHECK_SECONDS", "5"))
+
+_CURRENT = "current"
+
+
+class SharedIndexStore:
+    """
+    Shares the local search index between the worker processes of one machine.
+
+    The index is built once and saved as a generation directory of flat arrays, which every worker memory-maps,
+    so the processes share one copy in the page cache instead of each holding its own.
+    A new generation is published by pointing the `current` symlink at it with an atomic rename,
+    so a worker sees either the old or the new generation and never a partially written one.
+    Put the directory on a RAM-backed file system like /dev/shm to keep the index out of the disk cache.
+    """
+
+    def __init__(self, root: str):
+        """
+        :param root: The directory the generations are written to
+        """
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    @contextmanager
+    def lock(self):
+        """
+        Hold an exclusive lock on the store across processes, so only one of them builds the index.
+        """
+        with open(os.path.join(self.root, ".lock"), "w") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def current(self) -> str | None:
+        """
+        The name of the published generation, None if nothing has been published yet.
+        """
+        try:
+            return os.readlink(os.path.join(self.root, _CURRENT))
+        except FileNotFoundError:
+            return None
+
+    def publish(self, index: LocalHybridIndex) -> str:
+        """
+        Save the index as a new generation and make it the current one.
+        :return: The name of the new generation
+        """
+        previous = self.current()
+        generation = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        staging = os.path.join(self.root, f".{generation}")
+        index.save(staging)
+        os.rename(staging, os.path.join(self.root, generation))
+
+        link = os.path.join(self.root, f".{_CURRENT}-{generation}")
+        os.symlink(generation, link)
+        os.replace(link, os.path.join(self.root, _CURRENT))
+        self._remove_generations(keep={generation, previous})
+        logger.info(f"Published local search index generation {generation} with {len(index)} chunks")
+        return generation
+
+    def load(self, generation: str, embed_query: Callable[[str], list[float]]) -> LocalHybridIndex:
+        return LocalHybridIndex.load(os.path.join(self.root, generation), embed_query)
+
+    def _remove_generations(self, keep: set[str | None]):
+        """
+        Delete old generations. The previous one is kept for workers that are just about to load it,
+        files that are still mapped by a worker stay readable after they are deleted.
+        """
+        for name in os.listdir(self.root):
+            if name.startswith(".") or name == _CURRENT or name in keep:
+                continue
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
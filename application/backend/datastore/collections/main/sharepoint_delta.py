@@ -0,0 +1,358 @@
+import json
+import os
+import time
+
+from application.backend.datastore.collections.main.main_data import MainDataCollection, elapsed
+from application.backend.datastore.collections.main.sharepoint_document import SharepointDocument
+
+GRAPH_URL = os.getenv("GRAPH_URL", "https://graph.microsoft.com/v1.0")
+# The delta token and the downloaded files of incremental synchronizations, keyed by drive item id
+SHAREPOINT_CACHE_DIR = os.getenv("SHAREPOINT_CACHE_DIR", "sharepoint_cache")
+
+LIST_ITEM_FIELDS = [
+    SharepointDocument.FACULTY,
+    SharepointDocument.TARGET_GROUPS,
+    SharepointDocument.TOPIC,
+    SharepointDocument.SUBTOPIC,
+    SharepointDocument.TITLE,
+    SharepointDocument.DEGREE_PROGRAMS,
+    SharepointDocument.LANGUAGES,
+    SharepointDocument.SYNC_STATUS,
+]
+
+
+class GraphListItem:
+    """
+    The SharePoint list item of a drive item, with the interface of O365's SharepointListItem
+    that SharepointDocument uses to read the column values and to update the sync status.
+    """
+
+    def __init__(self, drive: "GraphDrive", item_id: str, data: dict):
+        self.drive = drive
+        self.item_id = item_id
+        self.fields = data.get("fields", {})
+        self.web_url = data.get("webUrl")
+        self._updates = {}
+
+    def update_fields(self, updates: dict):
+        self.fields.update(updates)
+        self._updates.update(updates)
+
+    def save_updates(self) -> bool:
+        if not self._updates:
+            return True
+        self.drive.update_fields(self.item_id, self._updates)
+        self._updates = {}
+        return True
+
+
+class GraphDrive:
+    """
+    The Microsoft Graph requests of incremental synchronizations against one SharePoint drive.
+    Uses any connection with the `get` and `patch` methods of O365's Connection, which handles the authentication,
+    so tests can run against a local stand-in of Graph.
+    """
+
+    def __init__(self, connection, drive_id: str, base_url: str = GRAPH_URL):
+        """
+        :param connection: Sends authenticated requests and returns responses like `requests`
+        :param drive_id: The ID of the SharePoint drive
+        :param base_url: The Graph endpoint, the drive's URLs are relative to it
+        """
+        self.connection = connection
+        self.drive_id = drive_id
+        self.base_url = base_url.rstrip("/")
+
+    def _url(self, path: str) -> str:
+        return f"{self.base_url}/drives/{self.drive_id}{path}"
+
+    def changes(self, delta_link: str | None) -> tuple[list[dict], str]:
+        """
+        The drive items that changed since the delta link, all items of the drive if there is none.
+        Delta queries are only supported on the root of SharePoint drives, so the items are not filtered by folder.
+        :return: The changed items and the delta link of the next synchronization
+        """
+        url = delta_link or self._url("/root/delta")
+        items = []
+        while True:
+            page = self.connection.get(url).json()
+            items.extend(page.get("value", []))
+            if "@odata.nextLink" in page:
+                url = page["@odata.nextLink"]
+            else:
+                return items, page["@odata.deltaLink"]
+
+    def item(self, item_id: str) -> dict:
+        return self.connection.get(self._url(f"/items/{item_id}")).json()
+
+    def list_item(self, item_id: str) -> GraphListItem:
+        select = ",".join(LIST_ITEM_FIELDS)
+        data = self.connection.get(self._url(f"/items/{item_id}/listItem"), params={
+            "$expand": f"fields($select={select})",
+        }).json()
+        return GraphListItem(self, item_id, data)
+
+    def update_fields(self, item_id: str, fields: dict):
+        self.connection.patch(self._url(f"/items/{item_id}/listItem/fields"), data=fields)
+
+    def download(self, item_id: str, path: str, chunk_size: int = 8 * 1024):
+        """
+        Download the content of a drive item to a path, replacing it only once the download is complete.
+        """
+        partial = f"{path}.part"
+        response = self.connection.get(self._url(f"/items/{item_id}/content"), stream=True)
+        with open(partial, "wb") as file:
+            for data in response.iter_content(chunk_size=chunk_size):
+                file.write(data)
+        os.replace(partial, path)
+
+
+def _folder_entry(item: dict) -> dict:
+    if "root" in item:
+        return {"parent": None, "name": ""}
+    return {"parent": item.get("parentReference", {}).get("id"), "name": item["name"]}
+
+
+def _folder_path(folders: dict[str, dict], folder_id: str, drive: "GraphDrive | None" = None) -> str | None:
+    """
+    The path of a folder relative to the drive root, following the parent ids of the known folders.
+    Delta queries do not return the paths of items, so they are tracked by id.
+    :param folders: The known folders by drive item id, with the id of their parent and their name
+    :param drive: Fetches folders that are not known yet and adds them to `folders`, if given
+    :return: The path, None if the folder does not exist anymore or is not known
+    """
+    names = []
+    for _ in range(len(folders) + 64):  # More steps than folders means the parents form a cycle
+        entry = folders.get(folder_id)
+        if entry is None:
+            if drive is None:
+                return None
+            try:
+                item = drive.item(folder_id)
+            except Exception:
+                return None
+            if "deleted" in item or ("folder" not in item and "root" not in item):
+                return None
+            entry = folders[folder_id] = _folder_entry(item)
+        if entry["parent"] is None:
+            return "".join(f"/{name}" for name in reversed(names))
+        names.append(entry["name"])
+        folder_id = entry["parent"]
+    return None
+
+
+def _item_path(item: dict, folders: dict[str, dict], drive: "GraphDrive | None" = None) -> str | None:
+    """
+    The path of a drive item relative to the drive root, None if it is not known.
+    """
+    parent = item.get("parentReference", {}).get("id")
+    if parent is None or "name" not in item:
+        return None
+    folder = _folder_path(folders, parent, drive)
+    return None if folder is None else f"{folder}/{item['name']}"
+
+
+class DeltaState:
+    """
+    What the previous incremental synchronization saw in SharePoint, persisted in the cache directory:
+    - The delta link, from which Graph lists the changes since then
+    - The files below the data folder by drive item id, with their path, eTag, cTag, cached copy and document hash
+    - The folders of the drive by drive item id with the id of their parent and their name, as delta queries only
+      return the parent id of an item and deleting or moving a folder might only report the folder
+    A cached copy is valid as long as the cTag of its file is the same, which only changes with the content,
+    while the eTag also changes with the column values.
+    """
+
+    def __init__(self, directory: str = SHAREPOINT_CACHE_DIR):
+        """
+        :param directory: The directory of the state file and the downloaded files
+        """
+        self.directory = directory
+        self.path = os.path.join(directory, "state.json")
+        self.delta_link: str | None = None
+        self.files: dict[str, dict] = {}
+        self.folders: dict[str, dict] = {}
+        if os.path.isfile(self.path):
+            with open(self.path) as file:
+                state = json.load(file)
+            self.delta_link = state["delta_link"]
+            self.files = state["files"]
+            self.folders = state["folders"]
+        os.makedirs(os.path.join(directory, "files"), exist_ok=True)
+
+    def cache_path(self, item_id: str, name: str) -> str:
+        """
+        The path of the cached copy of a file, which keeps its extension so the chunker can tell its type.
+        """
+        return os.path.join(self.directory, "files", f"{item_id}{os.path.splitext(name)[1]}")
+
+    def is_cached(self, item: dict) -> bool:
+        previous = self.files.get(item["id"])
+        return (previous is not None and previous["ctag"] == item.get("cTag")
+                and previous["file"] == self.cache_path(item["id"], item["name"])
+                and os.path.isfile(previous["file"]))
+
+    def remove(self, item_id: str):
+        entry = self.files.pop(item_id)
+        if os.path.isfile(entry["file"]):
+            os.remove(entry["file"])
+
+    def save(self):
+        """
+        Write the state atomically, so an interrupted synchronization starts over from the previous one.
+        """
+        partial = f"{self.path}.part"
+        with open(partial, "w") as file:
+            json.dump({"delta_link": self.delta_link, "files": self.files, "folders": self.folders}, file)
+        os.replace(partial, self.path)
+
+
+class DeltaChanges:
+    """
+    The changes below the data folder since the previous synchronization, see `collect_changes`.
+    """
+
+    def __init__(self, delta_link: str, folders: dict[str, dict]):
+        self.delta_link = delta_link
+        self.folders = folders  # The folders of the drive after the changes
+        self.items: dict[str, dict] = {}  # The new or changed files by drive item id
+        self.paths: dict[str, str] = {}  # The paths of the new or changed files by drive item id
+        self.removed: set[str] = set()  # The drive item ids of removed files
+        self.documents: dict[str, SharepointDocument] = {}  # The loaded documents of the changed files
+        self.downloaded = 0
+        self.cached = 0
+        self.failed = 0
+        self.corpus_changed = False  # Whether documents were added to or removed from the vector database
+
+
+def collect_changes(drive: GraphDrive, state: DeltaState, folder: str) -> DeltaChanges:
+    """
+    List the changes of the drive since the previous synchronization and load the changed documents below the folder.
+    Only files with a new eTag or path are loaded, and only those with a new cTag or without a cached copy are
+    downloaded, so an unchanged corpus costs a single delta request.
+    :param drive: The SharePoint drive
+    :param state: The state of the previous synchronization, which is not modified
+    :param folder: The path of the data folder in the drive, e.g. /Data_ChatBot
+    :return: The changes
+    """
+    items, delta_link = drive.changes(state.delta_link)
+    changes = DeltaChanges(delta_link, {folder_id: dict(entry) for folder_id, entry in state.folders.items()})
+    removed_folders, changed_folders = set(), set()
+    for item in items:
+        item_id = item["id"]
+        if "folder" in item or "root" in item or item_id in state.folders:
+            if "deleted" in item:
+                removed_folders.add(item_id)
+            else:
+                changes.folders[item_id] = _folder_entry(item)
+                changed_folders.add(item_id)
+    for folder_id in removed_folders:
+        changes.folders.pop(folder_id, None)
+
+    # The files in removed, moved or renamed folders might not be reported themselves
+    refetched = []
+    for folder_id in removed_folders | changed_folders:
+        previous_path = _folder_path(state.folders, folder_id)
+        if previous_path is None:
+            continue
+        path = None if folder_id in removed_folders else _folder_path(changes.folders, folder_id, drive)
+        if path == previous_path:
+            continue
+        for file_id, entry in state.files.items():
+            if entry["path"].startswith(f"{previous_path}/"):
+                if path is None:
+                    changes.removed.add(file_id)
+                else:
+                    refetched.append(drive.item(file_id))
+
+    for item in items + refetched:  # Items are listed in the order of their changes, later entries of an item win
+        item_id = item["id"]
+        if "folder" in item or "root" in item or item_id in state.folders:
+            continue
+        path = None if "deleted" in item else _item_path(item, changes.folders, drive)
+        if path is None or not path.startswith(f"{folder}/"):
+            changes.items.pop(item_id, None)
+            if item_id in state.files:
+                changes.removed.add(item_id)
+            continue
+        if "file" not in item:
+            continue
+        changes.removed.discard(item_id)
+        previous = state.files.get(item_id)
+        if previous is not None and previous["etag"] == item.get("eTag") and previous["path"] == path:
+            changes.items.pop(item_id, None)
+            continue
+        changes.items[item_id] = item
+        changes.paths[item_id] = path
+
+    total = len(changes.items)
+    for i, (item_id, item) in enumerate(changes.items.items()):
+        path = changes.paths[item_id]
+        progress = f"{i + 1}/{total}"
+        download_path = state.cache_path(item_id, item["name"])
+        if state.is_cached(item):
+            print(f"({progress}) Content of {path} did not change, using the cached file.")
+            changes.cached += 1
+        else:
+            print(f"({progress}) Downloading {path}...", end="\r")
+            download_start = time.time()
+            try:
+                drive.download(item_id, download_path)
+            except Exception as error:
+                print(f"({progress}) Could not download {path}: {error}, it is retried with the next synchronization.")
+                changes.failed += 1
+                continue
+            print(f"({progress}) Downloading {path}... (done in {elapsed(download_start)})")
+            changes.downloaded += 1
+        changes.documents[item_id] = SharepointDocument(download_path, drive.list_item(item_id))
+    return changes
+
+
+def synchronize_changes(main: MainDataCollection, drive: GraphDrive, state: DeltaState, folder: str) -> DeltaChanges:
+    """
+    Synchronize the vector database with the changes in SharePoint since the previous synchronization
+    and save the new state once it is done. Without a saved state, every file is listed as changed,
+    documents that are already in the vector database are kept like with a full synchronization.
+    :return: The applied changes
+    """
+    start = time.time()
+    changes = collect_changes(drive, state, folder)
+    print(f"Found {len(changes.items)} changed and {len(changes.removed)} removed files in SharePoint, "
+          f"downloaded {changes.downloaded} ({changes.cached} cached) in {elapsed(start)}.")
+
+    hashes_to_remove = {state.files[item_id]["hash"] for item_id in changes.removed}
+    documents_to_check = []
+    for item_id, document in changes.documents.items():
+        previous = state.files.get(item_id, {}).get("hash")
+        if previous == document.hash and not document.should_reembed():
+            document.update_sync_status(True)  # Only the sync status or other columns that are not hashed changed
+            document.release()
+            continue
+        if previous is not None:
+            hashes_to_remove.add(previous)
+        documents_to_check.append(document)
+    changes.corpus_changed = bool(hashes_to_remove or documents_to_check)
+    if changes.corpus_changed:
+        main.synchronize_changes(documents_to_check, hashes_to_remove)
+
+    for item_id in changes.removed:
+        state.remove(item_id)
+    for item_id, document in changes.documents.items():
+        item = changes.items[item_id]
+        previous = state.files.get(item_id)
+        if previous is not None and previous["file"] != document.file_path and os.path.isfile(previous["file"]):
+            os.remove(previous["file"])  # The file was renamed to another extension
+        state.files[item_id] = {
+            "path": changes.paths[item_id],
+            "etag": item.get("eTag"),
+            "ctag": item.get("cTag"),
+            "file": document.file_path,
+            "hash": document.hash,
+        }
+    state.folders = changes.folders
+    if not changes.failed:  # Otherwise the same changes are listed again, the applied ones are skipped by eTag
+        state.delta_link = changes.delta_link
+    state.save()
+    print(f"Synchronized {len(changes.documents)} changed and {len(changes.removed)} removed files "
+          f"in {elapsed(start)}.")
+    return changes
@@ -1,13 +1,39 @@
 import hashlib
 import os
 from enum import Enum
-
-from O365.sharepoint import SharepointListItem
-from langchain_community.document_loaders import UnstructuredFileLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from typing import IO, TYPE_CHECKING, Iterable, Iterator
 
 from application.backend.datastore.collections.main.schema import Chunk
 
+if TYPE_CHECKING:
+    # O365 and Unstructured are only needed to ingest documents, the API never imports them
+    from O365.sharepoint import SharepointListItem
+    from langchain_text_splitters import TextSplitter
+
+
+def split_pages(pages: Iterable[str], text_splitter: "TextSplitter") -> Iterator[tuple[str, int]]:
+    """
+    Split the texts of consecutive pages into chunks, holding only one page and the unfinished chunk in memory.
+    The last split of a page can continue on the next one, so it is carried over instead of being cut at the page end.
+    :param pages: The texts of the pages in order
+    :param text_splitter: A splitter that records the start index of the splits
+    :return: The chunks with the number of the page they start on, starting at 1
+    """
+    carry, carry_page = "", 1
+    for page, page_text in enumerate(pages, start=1):
+        text = carry + page_text
+        splits = text_splitter.create_documents([text])
+        if not splits:
+            carry, carry_page = "", page + 1
+            continue
+        for split in splits[:-1]:
+            yield split.page_content, carry_page if split.metadata["start_index"] < len(carry) else page
+        last = splits[-1]
+        carry_page = carry_page if last.metadata["start_index"] < len(carry) else page
+        carry = text[last.metadata["start_index"]:]
+    if carry.strip():
+        yield carry.strip(), carry_page
+
 
 class SyncStatus(str, Enum):
     NOT_YET_SYNCED = "Not Yet Synced"
@@ -28,17 +54,26 @@ class SharepointDocument:
     SYNC_STATUS = "SyncStatus"
 
     """
-    Represents a document in SharePoint which has been downloaded onto the local file system.
+    Represents a document in SharePoint which has been downloaded onto the local file system or into a buffer.
     Contains the file path and the SharePoint item.
     Offers methods to hash the document, create chunks, and update the sync status in SharePoint.
     """
     file_path: str
-    item: SharepointListItem
+    item: "SharepointListItem"
+    content: IO[bytes] | None  # The downloaded bytes if the document was streamed instead of saved to file_path
     _hash: str | None = None
 
-    def __init__(self, file_path: str, item):
+    def __init__(self, file_path: str, item, content: IO[bytes] | None = None, content_sha1=None):
+        """
+        :param file_path: The path of the downloaded file, or the path in SharePoint if the content is given
+        :param item: The SharePoint list item with the column values
+        :param content: The downloaded bytes, read instead of the file
+        :param content_sha1: A sha1 hash object that was fed the content while it was downloaded
+        """
         self.file_path = file_path
         self.item = item
+        self.content = content
+        self._content_sha1 = content_sha1
         # Since not all documents have all fields, we need to handle the case where a field is missing
         # We also want to ensure that all multi-value fields are distinct and sorted for hashing consistency
         item.fields[SharepointDocument.FACULTY] = self.item.fields.get(SharepointDocument.FACULTY, None)
@@ -64,9 +99,17 @@ class SharepointDocument:
         Compute the hash of the document using the raw bytes from the file and the properties from SharePoint.
         This hash is used to correlate chunks in Weaviate with their owning documents.
         """
-        sha1 = hashlib.sha1()
-        with open(self.file_path, "rb") as file:
-            sha1.update(file.read())
+        if self._content_sha1 is not None:
+            sha1 = self._content_sha1.copy()  # The bytes were hashed while they were downloaded
+        elif self.content is not None:
+            sha1 = hashlib.sha1()
+            self.content.seek(0)
+            for block in iter(lambda: self.content.read(1024 * 1024), b""):
+                sha1.update(block)
+        else:
+            sha1 = hashlib.sha1()
+            with open(self.file_path, "rb") as file:
+                sha1.update(file.read())
         for field in [SharepointDocument.FACULTY, SharepointDocument.TARGET_GROUPS, SharepointDocument.TOPIC,
                       SharepointDocument.SUBTOPIC, SharepointDocument.TITLE, SharepointDocument.DEGREE_PROGRAMS,
                       SharepointDocument.LANGUAGES]:
@@ -75,72 +118,76 @@ class SharepointDocument:
         sha1.update(self.item.web_url.encode("utf-8"))
         return sha1.hexdigest()
 
+    def _loader(self, **kwargs):
+        """
+        The Unstructured loader of the downloaded bytes, which reads a streamed buffer without writing it to disk.
+        """
+        from langchain_community.document_loaders import UnstructuredFileIOLoader, UnstructuredFileLoader
+
+        if self.content is None:
+            return UnstructuredFileLoader(file_path=self.file_path, **kwargs)
+        self.content.seek(0)
+        # The file name tells Unstructured the file type, as it would with a file on disk
+        return UnstructuredFileIOLoader(file=self.content, metadata_filename=os.path.basename(self.file_path), **kwargs)
+
+    def _make_chunk(self, text: str, page: int | None = None) -> Chunk:
+        return Chunk(
+            text=text,  # The text content of the chunk
+            faculty=self.item.fields[SharepointDocument.FACULTY],
+            target_groups=self.item.fields[SharepointDocument.TARGET_GROUPS],
+            topic=self.item.fields[SharepointDocument.TOPIC],
+            subtopic=self.item.fields[SharepointDocument.SUBTOPIC],
+            title=self.item.fields[SharepointDocument.TITLE],
+            degree_programs=self.item.fields[SharepointDocument.DEGREE_PROGRAMS],
+            languages=self.item.fields[SharepointDocument.LANGUAGES],
+            hash=self.hash,  # Every chunk from the same document will have the same hash
+            url=self.item.web_url,
+            hits=0,
+            page=page,
+        )
+
     def chunk(self) -> list[Chunk]:
         """
         Use Unstructured to turn a SharepointDocument into chunks, which can then be batch imported into Weaviate.
+        See `iter_chunks` for the splitting strategies.
+        """
+        return list(self.iter_chunks())
+
+    def iter_chunks(self) -> Iterator[Chunk]:
+        """
+        Turn a SharepointDocument into chunks as they are parsed, so they can be uploaded while parsing continues.
         Use different splitting strategies based on the document type:
-        - For PDFs: Load the document as a single large chunk and then use RecursiveCharacterTextSplitter.
+        - For PDFs: Parse the document page by page and split the text with RecursiveCharacterTextSplitter.
         - For other types: Use UnstructuredFileLoader with mode="elements".
         """
-
         if self.file_path.endswith(".pdf"):
-            return self._chunk_pdf()
+            yield from self._iter_pdf_chunks()
+            return
 
-        splitter = UnstructuredFileLoader(
-            file_path=self.file_path,
-            mode="elements",
-            strategy="fast"
-        )
-        chunks = [
-            Chunk(
-                text=chunk.page_content,  # The text content of the chunk
-                faculty=self.item.fields[SharepointDocument.FACULTY],
-                target_groups=self.item.fields[SharepointDocument.TARGET_GROUPS],
-                topic=self.item.fields[SharepointDocument.TOPIC],
-                subtopic=self.item.fields[SharepointDocument.SUBTOPIC],
-                title=self.item.fields[SharepointDocument.TITLE],
-                degree_programs=self.item.fields[SharepointDocument.DEGREE_PROGRAMS],
-                languages=self.item.fields[SharepointDocument.LANGUAGES],
-                hash=self.hash,  # Every chunk from the same document will have the same hash
-                url=self.item.web_url,
-                hits=0,
-            )
-            for chunk in splitter.load()
-        ]
-        return chunks
-
-    def _chunk_pdf(self) -> list[Chunk]:
-        """
-        Chunk a PDF document using RecursiveCharacterTextSplitter.
+        splitter = self._loader(mode="elements", strategy="fast")
+        for chunk in splitter.load():
+            yield self._make_chunk(chunk.page_content)
+
+    def _iter_pdf_chunks(self) -> Iterator[Chunk]:
+        """
+        Chunk a PDF document page by page using RecursiveCharacterTextSplitter.
         This is a special case because PDFs are not chunked satisfactorily by UnstructuredFileLoader.
-        :return: The chunks of the document
+        Only one page is parsed at a time, with pdfminer like Unstructured's fast strategy,
+        so large documents do not have to fit into memory as a whole.
         """
-        splitter = UnstructuredFileLoader(
-            file_path=self.file_path,
-            strategy="fast"
-        )
-        doc = splitter.load()[0]  # Should only be one document
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=20,
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
+
+        if self.content is not None:
+            self.content.seek(0)
+        pages = (
+            "".join(element.get_text() for element in page if isinstance(element, LTTextContainer))
+            for page in extract_pages(self.content if self.content is not None else self.file_path)
         )
-        chunks = [
-            Chunk(
-                text=split_text,  # The text content of the chunk
-                faculty=self.item.fields[SharepointDocument.FACULTY],
-                target_groups=self.item.fields[SharepointDocument.TARGET_GROUPS],
-                topic=self.item.fields[SharepointDocument.TOPIC],
-                subtopic=self.item.fields[SharepointDocument.SUBTOPIC],
-                title=self.item.fields[SharepointDocument.TITLE],
-                degree_programs=self.item.fields[SharepointDocument.DEGREE_PROGRAMS],
-                languages=self.item.fields[SharepointDocument.LANGUAGES],
-                hash=self.hash,  # Every chunk from the same document will have the same hash
-                url=self.item.web_url,
-                hits=0,
-            )
-            for split_text in text_splitter.split_text(doc.page_content)
-        ]
-        return chunks
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=20, add_start_index=True)
+        for text, page in split_pages(pages, text_splitter):
+            yield self._make_chunk(text, page)
 
     def should_reembed(self) -> bool:
         """
@@ -161,6 +208,14 @@ class SharepointDocument:
         self.item.update_fields({SharepointDocument.SYNC_STATUS: new_status})
         self.item.save_updates()
 
+    def release(self):
+        """
+        Free the buffer of a streamed document once it is hashed and chunked. Downloaded files are kept as a cache.
+        """
+        if self.content is not None:
+            self.content.close()
+            self.content = None
+
     def delete_local_file(self):
         """
         Delete the file from the local file system.
@@ -1,12 +1,19 @@
+import argparse
+import hashlib
 import os
+import tempfile
 import time
 import urllib.parse
+from typing import Iterator
 
 from O365 import Account
 from O365.drive import Folder, File
 from dotenv import load_dotenv
 
-from application.backend.datastore.collections.main.main_data import elapsed
+from application.backend.datastore.collections.main.main_data import MainDataCollection, elapsed
+from application.backend.datastore.collections.main.sharepoint_delta import (
+    SHAREPOINT_CACHE_DIR, DeltaChanges, DeltaState, GraphDrive, synchronize_changes
+)
 from application.backend.datastore.collections.main.sharepoint_document import SharepointDocument
 from application.backend.datastore.db import ChatbotVectorDatabase
 
@@ -15,6 +22,35 @@ load_dotenv()
 DOWNLOAD_CHUNK_SIZE = 8 * 1024
 DATA_FOLDER = "/Data_ChatBot"
 TEMP_DIR = "sharepoint_temp"
+# Stream downloads into memory instead of TEMP_DIR, files larger than the spool size spill to a temporary file
+SHAREPOINT_STREAMING = os.getenv("SHAREPOINT_STREAMING", "false").lower() == "true"
+SHAREPOINT_SPOOL_MAX_MB = int(os.getenv("SHAREPOINT_SPOOL_MAX_MB", "32"))
+
+
+class HashingWriter:
+    """
+    Writes a download into a buffer and hashes the bytes on the way, so the document is never read again to hash it.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.sha1 = hashlib.sha1()
+
+    def write(self, data: bytes) -> int:
+        self.sha1.update(data)
+        return self.buffer.write(data)
+
+
+def stream_file(file: File, spool_size: int = SHAREPOINT_SPOOL_MAX_MB * 1024 * 1024) -> HashingWriter:
+    """
+    Download a file into a spooled buffer, which is held in memory up to `spool_size` bytes and spills to disk above.
+    :return: The writer holding the buffer and the sha1 hash object of the downloaded bytes
+    """
+    writer = HashingWriter(tempfile.SpooledTemporaryFile(max_size=spool_size))
+    if not file.download(output=writer, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        writer.buffer.close()
+        raise IOError(f"Could not download {file.name}")
+    return writer
 
 
 def load_file_structure(folder: Folder, path: str) -> dict[str, File]:
@@ -48,9 +84,27 @@ def clear_download_dir():
             os.rmdir(os.path.join(root, name))
 
 
-def load_from_sharepoint() -> list[SharepointDocument]:
+def connect(client_id: str, client_secret: str) -> Account:
+    """
+    Authenticate with SharePoint using the client credentials flow.
+    """
+    account = Account(
+        (client_id, client_secret),
+        auth_flow_type="credentials",
+        tenant_id="5d7b49e9-50d2-40dc-bab1-14a2d903542c",
+    )
+    if account.authenticate():
+        print("Authenticated with SharePoint")
+    return account
+
+
+def load_from_sharepoint(streaming: bool = SHAREPOINT_STREAMING) -> Iterator[SharepointDocument]:
     """
     Loads documents from SharePoint including their column values, downloading them onto the local file system.
+    With streaming, the documents are downloaded into spooled buffers instead, which are hashed while downloading
+    and handed to the chunker directly, so nothing has to be written to and read back from TEMP_DIR.
+    Documents are yielded one at a time and the next one is only downloaded once the previous one was handled,
+    so with streaming at most one buffer is held at a time.
 
     Expects the following environment variables to be set:
     O365_CLIENT_ID: The client ID for the SharePoint API
@@ -58,7 +112,7 @@ def load_from_sharepoint() -> list[SharepointDocument]:
     O365_DRIVE_ID: The ID of the SharePoint drive
     O365_FOLDER_PATH: The path of the folder in SharePoint
 
-    :return: a list of SharepointDocuments
+    :return: The SharepointDocuments as they are downloaded
     """
     client_id = os.environ["O365_CLIENT_ID"]
     client_secret = os.environ["O365_CLIENT_SECRET"]
@@ -71,19 +125,12 @@ def load_from_sharepoint() -> list[SharepointDocument]:
 
     start = time.time()
 
-    account = Account(
-        (client_id, client_secret),
-        auth_flow_type="credentials",
-        tenant_id="5d7b49e9-50d2-40dc-bab1-14a2d903542c",
-    )
-    if account.authenticate():
-        print("Authenticated with SharePoint")
+    account = connect(client_id, client_secret)
     # First load the files with OneDrive, so we know what items we need to fetch from SharePoint
     root = account.storage().get_drive(drive_id).get_item_by_path(DATA_FOLDER)
     downloadable_files = load_file_structure(root, "")
     total_files = len(downloadable_files)
 
-    local_documents = []
     print(f"Downloading {total_files} files from SharePoint...")
     # Load all list items (files and folders) from SharePoint with their column data
     sharepoint_items = (
@@ -116,6 +163,18 @@ def load_from_sharepoint() -> list[SharepointDocument]:
         file = downloadable_files.pop(file_path)
         download_path = f"{TEMP_DIR}{file_path}"  # Create a local path for the file (file_path has a leading /)
         progress = f"{total_files - len(downloadable_files)}/{total_files}"
+        if streaming:
+            print(f"({progress}) Streaming {file_path}...", end="\r")
+            download_start = time.time()
+            try:
+                writer = stream_file(file)
+            except IOError as error:
+                print(f"({progress}) {error}, skipping it.")
+                continue
+            print(f"({progress}) Streaming {file_path}... (done in {elapsed(download_start)})")
+            downloaded += 1
+            yield SharepointDocument(file_path, sharepoint_item, writer.buffer, writer.sha1)
+            continue
         if os.path.isfile(download_path):
             print(f"({progress}) File {file_path} already exists, skipping download.")
             cached += 1
@@ -127,20 +186,44 @@ def load_from_sharepoint() -> list[SharepointDocument]:
             file.download(to_path=download_folder, chunk_size=DOWNLOAD_CHUNK_SIZE)
             print(f"({progress}) Downloading {file_path}... (done in {elapsed(download_start)})")
             downloaded += 1
-        local_documents.append(SharepointDocument(download_path, sharepoint_item))
+        yield SharepointDocument(download_path, sharepoint_item)
 
     print(f"Downloaded {downloaded} files ({cached} cached) from SharePoint in {elapsed(start)}.")
     if downloadable_files:
         print(f"Warning: The following files were found in OneDrive, but not SharePoint (what does this mean?):"
               f"{downloadable_files.keys()}")
-    return local_documents
+
+
+def synchronize_from_sharepoint(main: MainDataCollection, cache_dir: str = SHAREPOINT_CACHE_DIR) -> DeltaChanges:
+    """
+    Synchronize the vector database with the changes in SharePoint since the previous incremental synchronization,
+    which are listed with a Graph delta query. Only changed files are downloaded, into a cache in `cache_dir`.
+    Expects the same environment variables as `load_from_sharepoint`, except O365_FOLDER_PATH.
+    :return: The applied changes
+    """
+    client_id = os.environ["O365_CLIENT_ID"]
+    client_secret = os.environ["O365_CLIENT_SECRET"]
+    drive_id = os.environ["O365_DRIVE_ID"]
+    assert client_id, "O365_CLIENT_ID not set"
+    assert client_secret, "O365_CLIENT_SECRET not set"
+    assert drive_id, "O365_DRIVE_ID not set"
+
+    account = connect(client_id, client_secret)
+    drive = GraphDrive(account.con, drive_id)
+    return synchronize_changes(main, drive, DeltaState(cache_dir), DATA_FOLDER)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synchronize the vector database with SharePoint")
+    parser.add_argument("--full", action="store_true",
+                        help="List and compare every document instead of only the changes since the previous run")
+    args = parser.parse_args()
     # clear_download_dir()
     db = ChatbotVectorDatabase()
-    documents = load_from_sharepoint()
-    db.main.synchronize(documents)
+    if args.full:
+        db.main.synchronize(load_from_sharepoint())
+    else:
+        synchronize_from_sharepoint(db.main)
     # print(db.main.count_documents())
     # db.main.clear()
     # db.main.increment_hits(docs)
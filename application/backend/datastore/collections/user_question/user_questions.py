@@ -1,21 +1,19 @@
 import time
 
-import weaviate
-import weaviate.classes as wvc
-
+from application.backend.datastore.backends.base import VectorStoreBackend
 from application.backend.datastore.collections.user_question.schema import Question
 
 
 class UserQuestionCollection:
     """
-    This class is responsible for tracking user questions in Weaviate.
+    This class is responsible for tracking user questions in the vector database.
 
     The questions are anonymized and summarized, and the collection keeps track of
     how often similar questions have been asked.
     """
 
-    def __init__(self, collection: weaviate.collections.Collection):
-        self.collection = collection
+    def __init__(self, backend: VectorStoreBackend):
+        self.backend = backend
 
     def keep_only_since(self, seconds: float = 30 * 24 * 60 * 60):
         """
@@ -26,9 +24,9 @@ class UserQuestionCollection:
         for question in self.get_all_questions():
             question.hit_times = [time for time in question.hit_times if time > since]
             if question.hit_times:
-                self.collection.data.update(uuid=question.uuid, properties=question.as_properties())
+                self.backend.update(uuid=question.uuid, properties=question.as_properties())
             else:
-                self.collection.data.delete_by_id(question.uuid)
+                self.backend.delete_by_id(question.uuid)
 
     def add_question(self, content: str, difference_threshold: float = 0.1):
         """
@@ -41,19 +39,15 @@ class UserQuestionCollection:
         :param difference_threshold: The difference threshold past which we consider a question different to those
         already in the collection. Defaults to 0.1.
         """
-        result = self.collection.query.near_text(
-            query=content,
-            limit=1,
-            return_metadata=wvc.query.MetadataQuery(distance=True)
-        )
-        closest = result.objects[0] if result.objects else None
+        result = self.backend.near_text(query=content, limit=1)
+        closest = result[0] if result else None
         # If there is no closest question or the distance is greater than the threshold, add a new question
-        if closest is None or closest.metadata.distance > difference_threshold:
-            self.collection.data.insert(Question(content=content, hit_times=[time.time()]).as_properties())
+        if closest is None or closest.distance > difference_threshold:
+            self.backend.insert(Question(content=content, hit_times=[time.time()]).as_properties())
         else:
             # Otherwise, we already have a similar question in the collection, so update the hit times
             closest.properties[Question.HIT_TIMES].append(time.time())
-            self.collection.data.update(uuid=closest.uuid, properties=closest.properties)
+            self.backend.update(uuid=closest.uuid, properties=closest.properties)
 
     def get_all_questions(self) -> list[Question]:
         """
@@ -61,7 +55,7 @@ class UserQuestionCollection:
         ordered by most frequently asked.
         """
         questions = []
-        for obj in self.collection.iterator():
+        for obj in self.backend.iterate():
             questions.append(Question(
                 content=obj.properties[Question.CONTENT],
                 hit_times=obj.properties[Question.HIT_TIMES],
@@ -77,7 +71,7 @@ class UserQuestionCollection:
         """
         since = time.time() - seconds
         questions = []
-        for obj in self.collection.iterator():
+        for obj in self.backend.iterate():
             hit_times = obj.properties.get(Question.HIT_TIMES, [])
             hit_times = [time for time in hit_times if time > since]
             if hit_times:
@@ -1,24 +1,72 @@
 import os
+from typing import Callable, Iterable
 
 import weaviate
 from dotenv import find_dotenv, load_dotenv
 
 import application.backend.datastore.collections.main.schema as main_schema
 import application.backend.datastore.collections.user_question.schema as question_schema
+from application.backend.datastore.backends import LocalBackend, PartitionedBackend, VectorStoreBackend, WeaviateBackend
+from application.backend.datastore.collections.main.local_index import azure_embeddings
 from application.backend.datastore.collections.main.main_data import MainDataCollection
+from application.backend.datastore.collections.main.schema import Chunk
+from application.backend.datastore.collections.user_question.schema import Question
 from application.backend.datastore.collections.user_question.user_questions import UserQuestionCollection
 
 load_dotenv(find_dotenv())
 
+MAIN_COLLECTION_NAME = "ChatbotData"
+QUESTION_COLLECTION_NAME = "UserQuestion"
+# Store the chunks in one collection per (degree program, language) instead of filtering one collection.
+# After switching, the next synchronization imports all documents into the partitions
+PARTITIONED_COLLECTION = os.getenv("PARTITIONED_COLLECTION", "false").lower() == "true"
+
+
 class ChatbotVectorDatabase:
     """
     This class is responsible for managing the vector database of the chatbot, and should be used as a singleton.
     This class provides access to the main chatbot data under the `main` attribute.
+
+    The vector store is selected with the VECTOR_STORE_BACKEND environment variable:
+    - "weaviate" (default): The Weaviate cloud cluster
+    - "local": An embedded store persisted in the SQLite file at LOCAL_VECTOR_STORE_PATH
+    With PARTITIONED_COLLECTION, the main data is split into one collection per degree program and language.
     """
 
-    def __init__(self):
+    def __init__(self, backend: str = None, embeddings=None, local_path: str = None, partitioned: bool = None):
         """
         Initialize the vector database.
+        :param backend: The vector store backend, overrides VECTOR_STORE_BACKEND
+        :param embeddings: The embeddings used by the local backend, defaults to the Azure OpenAI deployment
+        :param local_path: The SQLite file of the local backend, overrides LOCAL_VECTOR_STORE_PATH
+        :param partitioned: Whether to partition the main data, overrides PARTITIONED_COLLECTION
+        """
+        self.client = None
+        self.main = None
+        self.questions = None
+        self.partitioned = PARTITIONED_COLLECTION if partitioned is None else partitioned
+        backend = backend or os.getenv("VECTOR_STORE_BACKEND", "weaviate")
+        try:
+            if backend == "weaviate":
+                self._connect_weaviate()
+            elif backend == "local":
+                path = local_path or os.getenv("LOCAL_VECTOR_STORE_PATH", "vector_store.sqlite3")
+                embeddings = embeddings or azure_embeddings()
+                self.main = MainDataCollection(self._main_backend(
+                    lambda name: LocalBackend(name, Chunk.TEXT, embeddings, path),
+                    lambda: LocalBackend.table_names(path),
+                ))
+                self.questions = UserQuestionCollection(
+                    LocalBackend(QUESTION_COLLECTION_NAME, Question.CONTENT, embeddings, path))
+            else:
+                raise ValueError(f"Unknown vector store backend '{backend}'")
+        except Exception:
+            self.close()  # Do not leave a connection or the background threads behind when the caller retries
+            raise
+
+    def _connect_weaviate(self):
+        """
+        Connect to the Weaviate cluster.
         This method expects the following environment variables to be set:
 
         - WCS_URL: The URL of the Weaviate instance
@@ -38,10 +86,41 @@ class ChatbotVectorDatabase:
             headers={"X-Azure-Api-Key": azure_openai_api_key},
         )
 
-        self.main = MainDataCollection(main_schema.create_collection_if_not_exists(self.client, "ChatbotData"))
-        self.questions = UserQuestionCollection(
-            question_schema.create_collection_if_not_exists(self.client, "UserQuestion"))
+        self.main = MainDataCollection(self._main_backend(
+            lambda name: WeaviateBackend(main_schema.create_collection_if_not_exists(self.client, name)),
+            lambda: self.client.collections.list_all(simple=True).keys(),
+        ))
+        self.questions = UserQuestionCollection(WeaviateBackend(
+            question_schema.create_collection_if_not_exists(self.client, QUESTION_COLLECTION_NAME)))
+
+    def _main_backend(
+        self, open_collection: Callable[[str], VectorStoreBackend], list_collections: Callable[[], Iterable[str]]
+    ) -> VectorStoreBackend:
+        """
+        The backend of the main data, partitioned if enabled.
+        :param open_collection: Opens a collection by its name, creating it if it does not exist
+        :param list_collections: Lists the names of all collections in the store
+        """
+        if not self.partitioned:
+            return open_collection(MAIN_COLLECTION_NAME)
+        return PartitionedBackend(
+            MAIN_COLLECTION_NAME, open_collection, list_collections, Chunk.DEGREE_PROGRAMS, Chunk.LANGUAGES
+        )
+
+    def close(self):
+        """
+        Stop the background threads of the collections and close their stores and the connection to Weaviate.
+        """
+        if self.main is not None:
+            self.main.close()
+            self.main.backend.close()
+        if self.questions is not None:
+            self.questions.backend.close()
+        if self.client is not None:
+            self.client.close()
+            self.client = None
 
     def __del__(self):
         # Close the connection to Weaviate when the object is deleted
-        self.client.close()
+        if self.client is not None:
+            self.client.close()
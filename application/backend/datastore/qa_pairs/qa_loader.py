@@ -1,7 +1,9 @@
+import argparse
+import csv
 import psycopg
 from psycopg import sql
 import os
-import csv
+import time
 from dotenv import load_dotenv, find_dotenv
 #import random
 
@@ -19,6 +21,19 @@ conn_string = "host={0} user={1} dbname={2} password={3}".format(
 
 csv_file_path='cleaned_questions_answers.csv'
 
+COLUMNS = ("program", "language", "question", "answer")
+COPY_CHUNK_SIZE = 1 << 20  # Bytes of CSV sent to the database at a time
+
+
+def content_hash_expression() -> sql.Composable:
+    """
+    The key QA pairs are merged on: a hash of the program, language and question, so a changed answer
+    replaces the stored one instead of being added next to it.
+    """
+    return sql.SQL("md5(coalesce(program, '') || E'\\x1f' || coalesce(language, '') || E'\\x1f' || "
+                   "coalesce(question, ''))")
+
+
 class PostgresLoader:
     """Class to load CSV data into a Postgres database."""
     """Class to get data from a Postgres database based on study program and language."""
@@ -41,23 +56,108 @@ class PostgresLoader:
             return None
 
     def _create_table_if_not_exists(self) -> None:
-        create_table_query = f"""CREATE TABLE IF NOT EXISTS {self.table_name} (
+        create_table_query = sql.SQL("""CREATE TABLE IF NOT EXISTS {} (
             id SERIAL PRIMARY KEY,
             program VARCHAR(255),
             language VARCHAR(255),
             question TEXT,
-            answer TEXT
-        );"""
+            answer TEXT,
+            content_hash TEXT GENERATED ALWAYS AS ({}) STORED,
+            CONSTRAINT {} UNIQUE (content_hash)
+        );""").format(
+            sql.Identifier(self.table_name), content_hash_expression(),
+            sql.Identifier(f"{self.table_name}_content_hash_key")
+        )
         self.cursor.execute(create_table_query)
         self.connection.commit()
 
-    def load_csv_data(self) -> None:
-        with open(self.csv_file_path, mode='r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                insert_query = sql.SQL("INSERT INTO {} (program, language, question, answer) VALUES (%s, %s, %s, %s)").format(sql.Identifier(self.table_name))
-                self.cursor.execute(insert_query, (row['program'], row['language'], row['question'], row['answer']))
+    def _ensure_merge_key(self) -> None:
+        """
+        Add the content hash and its unique index to a table created before they existed.
+        Duplicates from earlier imports are removed first, the oldest row of each QA pair is kept.
+        """
+        index_name = f"{self.table_name}_content_hash_key"
+        self.cursor.execute("SELECT to_regclass(%s) IS NOT NULL;", (index_name,))
+        if self.cursor.fetchone()[0]:
             self.connection.commit()
+            return
+        table = sql.Identifier(self.table_name)
+        self.cursor.execute(sql.SQL(
+            "ALTER TABLE {} ADD COLUMN IF NOT EXISTS content_hash TEXT GENERATED ALWAYS AS ({}) STORED;"
+        ).format(table, content_hash_expression()))
+        self.cursor.execute(sql.SQL(
+            "DELETE FROM {} duplicate USING {} kept WHERE duplicate.content_hash = kept.content_hash "
+            "AND duplicate.id > kept.id;"
+        ).format(table, table))
+        print(f"Removed {self.cursor.rowcount} duplicate QA pairs")
+        self.cursor.execute(sql.SQL("CREATE UNIQUE INDEX {} ON {} (content_hash);").format(
+            sql.Identifier(index_name), table
+        ))
+        self.connection.commit()
+
+    def load_csv_data(self) -> None:
+        self.import_csv(self.csv_file_path)
+
+    def import_csv(self, path: str) -> dict:
+        """
+        Import QA pairs from a CSV file with a header row.
+        The file is streamed into a staging table with COPY and then merged on the content hash,
+        so re-importing a file only writes the QA pairs that are new or whose answer changed.
+
+        :param path: The CSV file, with the columns program, language, question and answer in any order
+        :return: The number of rows read and of QA pairs inserted or updated, and the time it took
+        """
+        self._ensure_merge_key()
+        start = time.perf_counter()
+        with open(path, mode='r', encoding='utf-8', newline='') as file:
+            # Parsed like the rows, so quoted column names are read correctly
+            header = [column.strip() for column in next(csv.reader([file.readline().lstrip('\ufeff')]), [])]
+            if sorted(header) != sorted(COLUMNS):
+                raise ValueError(f"Expected the columns {', '.join(COLUMNS)} in {path}, got {', '.join(header)}")
+
+            with self.connection.transaction():
+                staging = sql.Identifier(f"{self.table_name}_staging")
+                self.cursor.execute(sql.SQL(
+                    "CREATE TEMPORARY TABLE {} (line BIGSERIAL, program VARCHAR(255), language VARCHAR(255), "
+                    "question TEXT, answer TEXT) ON COMMIT DROP;"
+                ).format(staging))
+                copy_query = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+                    staging, sql.SQL(", ").join(map(sql.Identifier, header))
+                )
+                with self.cursor.copy(copy_query) as copy:
+                    while chunk := file.read(COPY_CHUNK_SIZE):
+                        copy.write(chunk)
+                read = self.cursor.rowcount
+
+                # The last occurrence of a QA pair in the file wins. Duplicates are found with the merge key,
+                # which does not tell an empty field from a missing one
+                self.cursor.execute(sql.SQL("""
+                    INSERT INTO {table} (program, language, question, answer)
+                    SELECT DISTINCT ON ({key}) program, language, question, answer
+                    FROM {staging} ORDER BY {key}, line DESC
+                    ON CONFLICT (content_hash) DO UPDATE SET answer = EXCLUDED.answer
+                    WHERE {table}.answer IS DISTINCT FROM EXCLUDED.answer;
+                """).format(table=sql.Identifier(self.table_name), staging=staging, key=content_hash_expression()))
+                merged = self.cursor.rowcount
+        seconds = time.perf_counter() - start
+        return {"read": read, "merged": merged, "seconds": seconds}
+
+    def export_csv(self, path: str) -> dict:
+        """
+        Export all QA pairs to a CSV file in the format `import_csv` reads, streamed with COPY.
+        :return: The number of exported rows and the time it took
+        """
+        start = time.perf_counter()
+        copy_query = sql.SQL("COPY (SELECT {} FROM {} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER true)").format(
+            sql.SQL(", ").join(map(sql.Identifier, COLUMNS)), sql.Identifier(self.table_name)
+        )
+        with open(path, mode='wb') as file:
+            with self.cursor.copy(copy_query) as copy:
+                for data in copy:
+                    file.write(data)
+        rows = self.cursor.rowcount
+        self.connection.commit()
+        return {"rows": rows, "seconds": time.perf_counter() - start}
 
 
     def get_data(self, program: str, language: str) -> list:
@@ -73,6 +173,32 @@ class PostgresLoader:
             self.connection.close()
 
 
+def main():
+    parser = argparse.ArgumentParser(description="Import or export the curated QA pairs")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("path", nargs="?", default=csv_file_path, help="The CSV file to read or write")
+    parser.add_argument("--table", default="qa_pairs", help="The QA pairs table")
+    args = parser.parse_args()
+
+    loader = PostgresLoader(table_name=args.table)
+    try:
+        if args.command == "import":
+            result = loader.import_csv(args.path)
+            print(f"Read {result['read']} rows in {result['seconds']:.1f}s "
+                  f"({result['read'] / max(result['seconds'], 1e-9):.0f} rows/s), "
+                  f"{result['merged']} QA pairs were new or changed")
+        else:
+            result = loader.export_csv(args.path)
+            print(f"Exported {result['rows']} rows in {result['seconds']:.1f}s "
+                  f"({result['rows'] / max(result['seconds'], 1e-9):.0f} rows/s)")
+    finally:
+        loader.close_connection()
+
+
+if __name__ == "__main__":
+    main()
+
+
 """ if __name__ == "__main__":
 
     language = "English"
@@ -0,0 +1,414 @@
+"""
+Keeps the vector database in sync with SharePoint.
+
+- The daemon runs a synchronization every SYNC_INTERVAL_MINUTES, incremental by default (see sharepoint_delta),
+  and optionally a full comparison every n-th run to repair anything the delta queries missed
+- A Postgres advisory lock makes sure that two runs never overlap, also between machines. A run that finds the lock
+  taken is skipped. The lock belongs to the connection, so it is released as well if the process dies
+- Every run is recorded in the sync runs table with its duration, outcome and whether the corpus changed
+- API processes poll the table and reload their in-memory copies of the corpus after a run changed it,
+  see CorpusWatcher
+- The daemon serves its metrics for Prometheus on SYNC_METRICS_PORT
+
+Usage:
+    python -m application.backend.datastore.sync_service daemon [--interval 60] [--full-every 0]
+    python -m application.backend.datastore.sync_service run [--full]
+    python -m application.backend.datastore.sync_service history [--limit 20]
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+import psycopg
+from psycopg import sql
+from psycopg.rows import dict_row
+
+from application.backend.metrics import SYNC_DURATION, SYNC_LAST_SUCCESS, SYNC_RUNNING, SYNC_RUNS
+
+logger = logging.getLogger(__name__)
+
+SYNC_RUNS_TABLE = os.getenv("SYNC_RUNS_TABLE", "sync_runs")
+SYNC_INTERVAL_MINUTES = float(os.getenv("SYNC_INTERVAL_MINUTES", "60"))
+SYNC_FULL_EVERY = int(os.getenv("SYNC_FULL_EVERY", "0"))  # 0 never runs a full comparison on a schedule
+SYNC_METRICS_PORT = int(os.getenv("SYNC_METRICS_PORT", "9101"))
+# How often API processes check whether a sync run changed the corpus, 0 disables the check
+CORPUS_CHECK_SECONDS = float(os.getenv("CORPUS_CHECK_SECONDS", "60"))
+
+SYNC_LOCK_HEARTBEAT_SECONDS = float(os.getenv("SYNC_LOCK_HEARTBEAT_SECONDS", "60"))
+
+SYNC_LOCK_KEY = 0x53594E43  # The key of the advisory lock ("SYNC"), the same in every process
+# TCP keepalives notice a dropped lock connection, and keep idle connections open through NAT and firewalls
+KEEPALIVES = dict(keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3)
+
+
+def create_runs_table(connection: psycopg.Connection, table_name: str = SYNC_RUNS_TABLE):
+    """
+    Create the table of sync runs if it does not exist.
+    """
+    with connection.transaction():
+        connection.execute(sql.SQL("""CREATE TABLE IF NOT EXISTS {} (
+            id BIGSERIAL PRIMARY KEY,
+            mode TEXT NOT NULL,
+            status TEXT NOT NULL,
+            started_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+            finished_at TIMESTAMPTZ DEFAULT NULL,
+            duration_seconds DOUBLE PRECISION DEFAULT NULL,
+            corpus_changed BOOLEAN NOT NULL DEFAULT FALSE,
+            details JSONB DEFAULT NULL,
+            error TEXT DEFAULT NULL
+        );""").format(sql.Identifier(table_name)))
+
+
+@contextmanager
+def advisory_lock(connection: psycopg.Connection, key: int = SYNC_LOCK_KEY):
+    """
+    Try to take a session-level advisory lock without waiting for it.
+    :return: Whether the lock was taken, it is released when the context is left
+    """
+    acquired = connection.execute("SELECT pg_try_advisory_lock(%s);", (key,)).fetchone()[0]
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                connection.execute("SELECT pg_advisory_unlock(%s);", (key,))
+            except psycopg.Error as error:  # The lock went with the connection
+                logger.warning(f"Could not release the synchronization lock: {error}")
+
+
+def holds_lock(connection: psycopg.Connection, key: int = SYNC_LOCK_KEY) -> bool:
+    """
+    Whether the session of the connection still holds the advisory lock, False if the connection is broken.
+    """
+    try:
+        return connection.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid() "
+            "AND classid = %s AND objid = %s AND objsubid = 1 AND granted);",
+            (key >> 32, key & 0xFFFFFFFF),
+        ).fetchone()[0]
+    except psycopg.Error:
+        return False
+
+
+class LockHeartbeat:
+    """
+    Checks in a background thread that the advisory lock is still held while a run takes hours.
+    The regular queries also keep the otherwise idle lock connection from being dropped by idle timeouts.
+    """
+
+    def __init__(self, connection: psycopg.Connection, key: int, interval: float):
+        self.connection = connection
+        self.key = key
+        self.interval = interval
+        self.held = True
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sync-lock-heartbeat", daemon=True)
+
+    def start(self) -> "LockHeartbeat":
+        self._thread.start()
+        return self
+
+    def check(self) -> bool:
+        """
+        :return: Whether the lock has been held on every check so far
+        """
+        if self.held and not holds_lock(self.connection, self.key):
+            self.held = False
+        return self.held
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            if not self.check():
+                logger.error("The synchronization lost its lock, another run might start while it is still running.")
+                return
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+
+def latest_corpus_change(connection: psycopg.Connection, table_name: str = SYNC_RUNS_TABLE) -> int | None:
+    """
+    The id of the last successful run that changed the corpus, None if there is none or no run was recorded yet.
+    """
+    if not connection.execute("SELECT to_regclass(%s) IS NOT NULL;", (table_name,)).fetchone()[0]:
+        return None
+    return connection.execute(sql.SQL(
+        "SELECT MAX(id) FROM {} WHERE status = 'succeeded' AND corpus_changed;"
+    ).format(sql.Identifier(table_name))).fetchone()[0]
+
+
+def synchronize_sharepoint(main, full: bool) -> dict:
+    """
+    Synchronize the main collection with SharePoint.
+    :param main: The MainDataCollection to synchronize
+    :param full: Whether to load and compare every document instead of only the changes since the previous run
+    :return: The details of the run, with `corpus_changed`
+    """
+    from application.backend.datastore.collections.main.sharepoint_loader import (
+        load_from_sharepoint, synchronize_from_sharepoint
+    )
+
+    if full:
+        documents = main.synchronize(load_from_sharepoint())
+        # A full comparison does not tell what changed, so the API processes reload to be safe
+        return {"documents": documents, "corpus_changed": True}
+    changes = synchronize_from_sharepoint(main)
+    return {
+        "changed": len(changes.items),
+        "removed": len(changes.removed),
+        "downloaded": changes.downloaded,
+        "cached": changes.cached,
+        "failed_downloads": changes.failed,
+        "corpus_changed": changes.corpus_changed,
+    }
+
+
+class SyncService:
+    """
+    Runs synchronizations one at a time across all processes and records them in the sync runs table.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], psycopg.Connection],
+        synchronize: Callable[[bool], dict],
+        table_name: str = SYNC_RUNS_TABLE,
+        lock_key: int = SYNC_LOCK_KEY,
+        heartbeat_interval: float = SYNC_LOCK_HEARTBEAT_SECONDS,
+    ):
+        """
+        :param connect: Opens an autocommit connection to the database holding the lock and the runs,
+        preferably with TCP keepalives
+        :param synchronize: Runs a synchronization, a full one if it is passed True,
+        and returns its details including whether the corpus changed
+        :param table_name: The table the runs are recorded in
+        :param lock_key: The key of the advisory lock
+        :param heartbeat_interval: The time in seconds between the checks of the lock during a run
+        """
+        self.connect = connect
+        self.synchronize = synchronize
+        self.table_name = table_name
+        self.lock_key = lock_key
+        self.heartbeat_interval = heartbeat_interval
+
+    def run(self, full: bool = False) -> dict | None:
+        """
+        Run a synchronization unless another one is running.
+        The lock is held on a connection of its own, which is checked every SYNC_LOCK_HEARTBEAT_SECONDS,
+        and the run is recorded on fresh connections, so a dropped lock connection does not lose the outcome.
+        :return: The recorded run, None if it was skipped
+        """
+        with self.connect() as lock_connection:
+            with advisory_lock(lock_connection, self.lock_key) as acquired:
+                if not acquired:
+                    logger.info("Another synchronization is running, skipping this one.")
+                    SYNC_RUNS.labels(status="skipped").inc()
+                    return None
+                run_id = self._start_run(full)
+                logger.info(f"Started {'full' if full else 'incremental'} synchronization {run_id}.")
+
+                heartbeat = LockHeartbeat(lock_connection, self.lock_key, self.heartbeat_interval).start()
+                start = time.monotonic()
+                SYNC_RUNNING.set(1)
+                details, error = {}, None
+                try:
+                    details = self.synchronize(full)
+                except Exception as exception:
+                    logger.exception(f"Synchronization {run_id} failed")
+                    error = repr(exception)
+                finally:
+                    SYNC_RUNNING.set(0)
+                    heartbeat.stop()
+                duration = time.monotonic() - start
+                if not heartbeat.check():
+                    logger.error(f"Synchronization {run_id} lost its lock, another run might have overlapped it.")
+                    details["lock_lost"] = True
+                status = "failed" if error else "succeeded"
+                run = self._finish_run(run_id, status, duration, details, error)
+
+        SYNC_RUNS.labels(status=status).inc()
+        SYNC_DURATION.observe(duration)
+        if not error:
+            SYNC_LAST_SUCCESS.set_to_current_time()
+        logger.info(f"Synchronization {run_id} {status} after {duration:.1f}s: {details}")
+        return run
+
+    def _start_run(self, full: bool) -> int:
+        table = sql.Identifier(self.table_name)
+        with self.connect() as connection:
+            create_runs_table(connection, self.table_name)
+            # Runs are only started while holding the lock, so unfinished ones were interrupted
+            connection.execute(sql.SQL("UPDATE {} SET status = 'interrupted' WHERE status = 'running';").format(table))
+            return connection.execute(sql.SQL(
+                "INSERT INTO {} (mode, status) VALUES (%s, 'running') RETURNING id;"
+            ).format(table), ("full" if full else "incremental",)).fetchone()[0]
+
+    def _finish_run(self, run_id: int, status: str, duration: float, details: dict, error: str | None) -> dict:
+        with self.connect() as connection:
+            return connection.cursor(row_factory=dict_row).execute(sql.SQL(
+                "UPDATE {} SET status = %s, finished_at = NOW(), duration_seconds = %s, corpus_changed = %s, "
+                "details = %s, error = %s WHERE id = %s RETURNING *;"
+            ).format(sql.Identifier(self.table_name)), (
+                status, duration, bool(details.get("corpus_changed")), json.dumps(details), error, run_id,
+            )).fetchone()
+
+    def history(self, limit: int = 20) -> list[dict]:
+        """
+        The most recent runs, newest first.
+        """
+        with self.connect() as connection:
+            create_runs_table(connection, self.table_name)
+            return connection.cursor(row_factory=dict_row).execute(sql.SQL(
+                "SELECT * FROM {} ORDER BY id DESC LIMIT %s;"
+            ).format(sql.Identifier(self.table_name)), (limit,)).fetchall()
+
+
+class SyncScheduler:
+    """
+    Runs synchronizations at a fixed interval until it is stopped.
+    The interval is measured from the start of a run, a run that takes longer delays the next one.
+    """
+
+    def __init__(self, service: SyncService, interval: float = SYNC_INTERVAL_MINUTES * 60,
+                 full_every: int = SYNC_FULL_EVERY):
+        """
+        :param service: Runs the synchronizations
+        :param interval: The time in seconds between the starts of two runs
+        :param full_every: Run a full comparison instead of an incremental run every n-th run, 0 never does
+        """
+        self.service = service
+        self.interval = interval
+        self.full_every = full_every
+        self._stopped = threading.Event()
+
+    def run_forever(self):
+        runs = 0
+        while not self._stopped.is_set():
+            start = time.monotonic()
+            runs += 1
+            try:
+                self.service.run(full=self.full_every > 0 and runs % self.full_every == 0)
+            except Exception as error:  # E.g. the database is not reachable, the next run tries again
+                logger.error(f"Could not run the synchronization: {error}")
+            self._stopped.wait(max(0.0, start + self.interval - time.monotonic()))
+
+    def stop(self):
+        """
+        Stop after the current run.
+        """
+        self._stopped.set()
+
+
+class CorpusWatcher:
+    """
+    Checks in a background thread whether a sync run changed the corpus, so an API process can reload
+    what it holds in memory about it, like the local search index and the most retrieved chunks.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], psycopg.Connection],
+        on_change: Callable[[], None],
+        table_name: str = SYNC_RUNS_TABLE,
+        interval: float = CORPUS_CHECK_SECONDS,
+    ):
+        """
+        :param connect: Opens a connection to the database holding the sync runs
+        :param on_change: Called after a run changed the corpus
+        :param table_name: The table the runs are recorded in
+        :param interval: The time in seconds between two checks
+        """
+        self.connect = connect
+        self.on_change = on_change
+        self.table_name = table_name
+        self.interval = interval
+        self._seen: int | None = None  # The id of the last run that changed the corpus
+        self._checked = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="corpus-watcher", daemon=True)
+
+    def start(self) -> "CorpusWatcher":
+        self._thread.start()
+        return self
+
+    def check(self) -> bool:
+        """
+        Check for a new change of the corpus and handle it.
+        :return: Whether the corpus changed since the previous check, the first check only notes the latest change
+        """
+        with self.connect() as connection:
+            latest = latest_corpus_change(connection, self.table_name)
+        changed = self._checked and latest != self._seen
+        self._seen, self._checked = latest, True
+        return changed
+
+    def _run(self):
+        while True:
+            try:
+                if self.check():
+                    logger.info("The corpus changed, reloading the data held in memory.")
+                    self.on_change()
+            except Exception as error:
+                logger.warning(f"Could not check for changes of the corpus: {error}")
+            if self._stopped.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stopped.set()
+
+
+def main():
+    from prometheus_client import start_http_server
+
+    from application.backend.chatbot.history import conn_string
+    from application.backend.datastore.db import ChatbotVectorDatabase
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    daemon_parser = commands.add_parser("daemon", help="Synchronize on a schedule until stopped")
+    daemon_parser.add_argument("--interval", type=float, default=SYNC_INTERVAL_MINUTES,
+                               help="Minutes between the starts of two runs")
+    daemon_parser.add_argument("--full-every", type=int, default=SYNC_FULL_EVERY,
+                               help="Run a full comparison every n-th run, 0 never does")
+    run_parser = commands.add_parser("run", help="Synchronize once")
+    run_parser.add_argument("--full", action="store_true", help="Load and compare every document")
+    history_parser = commands.add_parser("history", help="Show the most recent runs")
+    history_parser.add_argument("--limit", type=int, default=20, help="The number of runs to show")
+    args = parser.parse_args()
+
+    connect = lambda: psycopg.connect(conn_string, autocommit=True, **KEEPALIVES)
+    if args.command == "history":
+        for run in SyncService(connect, lambda full: {}).history(args.limit):
+            duration = f"{run['duration_seconds']:.1f}s" if run["duration_seconds"] is not None else "-"
+            print(f"{run['id']:>6} {run['started_at']:%Y-%m-%d %H:%M:%S} {run['mode']:<11} {run['status']:<11} "
+                  f"{duration:>9} changed={run['corpus_changed']} {run['error'] or run['details'] or ''}")
+        return
+
+    db = ChatbotVectorDatabase()
+    service = SyncService(connect, lambda full: synchronize_sharepoint(db.main, full))
+    try:
+        if args.command == "run":
+            run = service.run(full=args.full)
+            if run is None:
+                print("Another synchronization is running.")
+            return
+        start_http_server(SYNC_METRICS_PORT)
+        scheduler = SyncScheduler(service, args.interval * 60, args.full_every)
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signal_number, lambda *_: scheduler.stop())
+        logger.info(f"Synchronizing every {args.interval} minutes, metrics on port {SYNC_METRICS_PORT}.")
+        scheduler.run_forever()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
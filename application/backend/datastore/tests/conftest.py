@@ -0,0 +1,59 @@
+import os
+import uuid
+
+import pytest
+
+from application.backend.datastore.backends import LocalBackend, PartitionedBackend, WeaviateBackend
+from application.backend.datastore.collections.main.local_index import HashEmbeddings
+from application.backend.datastore.collections.main.schema import Chunk
+
+
+def _weaviate_backend():
+    """
+    Create a backend on a temporary collection in the Weaviate cluster, if one is configured.
+    """
+    if not (os.getenv("WCS_URL") and os.getenv("WEAVIATE_API_KEY") and os.getenv("AZURE_OPENAI_API_KEY")):
+        pytest.skip("Weaviate is not configured")
+    import weaviate
+    import application.backend.datastore.collections.main.schema as main_schema
+
+    client = weaviate.connect_to_wcs(
+        cluster_url=os.getenv("WCS_URL"),
+        auth_credentials=weaviate.auth.AuthApiKey(os.getenv("WEAVIATE_API_KEY")),
+        headers={"X-Azure-Api-Key": os.getenv("AZURE_OPENAI_API_KEY")},
+    )
+    name = f"Conformance{uuid.uuid4().hex}"
+    backend = WeaviateBackend(main_schema.create_collection_if_not_exists(client, name))
+    return backend, lambda: (client.collections.delete(name), client.close())
+
+
+def partitioned_backend():
+    """
+    A partitioned collection with a local backend per partition.
+    """
+    return PartitionedBackend(
+        "Conformance",
+        lambda name: LocalBackend(name, Chunk.TEXT, HashEmbeddings()),
+        lambda: [],
+        Chunk.DEGREE_PROGRAMS,
+        Chunk.LANGUAGES,
+    )
+
+
+@pytest.fixture(params=["local", "partitioned", "weaviate"])
+def chunk_backend(request):
+    """
+    A backend for the chunk schema, for every backend implementation that can run here.
+    """
+    if request.param == "local":
+        backend = LocalBackend("Conformance", Chunk.TEXT, HashEmbeddings())
+        yield backend
+        backend.close()
+    elif request.param == "partitioned":
+        backend = partitioned_backend()
+        yield backend
+        backend.close()
+    else:
+        backend, cleanup = _weaviate_backend()
+        yield backend
+        cleanup()
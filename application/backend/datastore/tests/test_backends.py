@@ -0,0 +1,144 @@
+"""
+Conformance tests that every vector store backend has to pass.
+The Weaviate backend is only tested if a cluster is configured in the environment.
+"""
+import uuid as uuid_package
+
+from application.backend.datastore.backends import Filter, LocalBackend
+from application.backend.datastore.collections.main.main_data import MainDataCollection
+from application.backend.datastore.collections.main.schema import Chunk
+from application.backend.datastore.tests.conftest import HashEmbeddings, partitioned_backend
+
+
+def make_chunk(text: str, degree_programs: list[str], languages: list[str], hash: str) -> Chunk:
+    return Chunk(
+        text=text,
+        faculty=None,
+        target_groups=[],
+        topic=None,
+        subtopic=None,
+        title=text,
+        degree_programs=degree_programs,
+        languages=languages,
+        hash=hash,
+        url=f"https://example.com/{hash}",
+    )
+
+
+CHUNKS = [
+    make_chunk("Exam registration for all students happens in TUMonline", [], ["English"], "general"),
+    make_chunk("The BMT exam registration closes in November", ["BMT"], ["English"], "bmt"),
+    make_chunk("The MMT exam registration closes in December", ["MMT"], ["English"], "mmt"),
+    make_chunk("Die Prüfungsanmeldung erfolgt in TUMonline", [], ["German"], "german"),
+]
+
+
+def test_import_count_and_iterate(chunk_backend):
+    main = MainDataCollection(chunk_backend)
+    main.import_chunks(CHUNKS)
+
+    assert main.count_chunks() == len(CHUNKS)
+    assert main.count_documents() == len(CHUNKS)
+    assert main.query_distinct_degree_programs() == {"BMT", "MMT"}
+    vectors = [obj.vector for obj in chunk_backend.iterate(include_vector=True)]
+    assert all(vector for vector in vectors)
+
+
+def test_search_applies_degree_program_and_language_filters(chunk_backend):
+    main = MainDataCollection(chunk_backend)
+    main.import_chunks(CHUNKS)
+
+    results = main.search("exam registration", k=10, degree_programs={"BMT"}, language="English")
+    assert {chunk.hash for chunk in results} == {"general", "bmt"}
+
+    results = main.search("Prüfungsanmeldung", k=10, language="German")
+    assert [chunk.hash for chunk in results] == ["german"]
+
+
+def test_delete_by_filter_and_update(chunk_backend):
+    main = MainDataCollection(chunk_backend)
+    main.import_chunks(CHUNKS)
+
+    main.delete_by_hashes(["bmt", "mmt"])
+    assert main.count_chunks() == 2
+
+    [chunk] = main.search("Prüfungsanmeldung", k=1, language="German")
+    main.increment_hits([chunk])
+    [chunk] = main.search("Prüfungsanmeldung", k=1, language="German")
+    assert chunk.hits == 1
+
+
+def test_update_many_reports_missing_objects(chunk_backend):
+    MainDataCollection(chunk_backend).import_chunks(CHUNKS)
+    uuids = {obj.properties[Chunk.HASH]: obj.uuid for obj in chunk_backend.iterate()}
+    missing = uuid_package.uuid4()
+
+    bmt = CHUNKS[1].as_properties()
+    routed = {Chunk.HITS: 3, Chunk.DEGREE_PROGRAMS: bmt[Chunk.DEGREE_PROGRAMS], Chunk.LANGUAGES: bmt[Chunk.LANGUAGES]}
+    assert chunk_backend.update_many([(uuids["bmt"], routed), (uuids["german"], {Chunk.HITS: 5}),
+                                      (missing, {Chunk.HITS: 1})]) == [missing]
+    hits = {obj.properties[Chunk.HASH]: obj.properties[Chunk.HITS] for obj in chunk_backend.iterate()}
+    assert hits == {"general": 0, "bmt": 3, "mmt": 0, "german": 5}
+
+
+def test_near_text_returns_distances(chunk_backend):
+    chunk_backend.insert(CHUNKS[1].as_properties())
+
+    [closest] = chunk_backend.near_text("The BMT exam registration closes in November", limit=1)
+    assert closest.distance < 0.1
+
+
+def test_local_backend_persists_objects(tmp_path):
+    path = str(tmp_path / "store.sqlite3")
+    backend = LocalBackend("Chunks", Chunk.TEXT, HashEmbeddings(), path)
+    backend.insert_many([chunk.as_properties() for chunk in CHUNKS])
+    backend.delete_many(Filter.equal(Chunk.HASH, "mmt"))
+    backend.close()
+
+    reopened = LocalBackend("Chunks", Chunk.TEXT, HashEmbeddings(), path)
+    assert reopened.count() == 3
+    assert reopened.hybrid_search("BMT exam", limit=1)[0].properties[Chunk.HASH] == "bmt"
+
+
+def test_partitioned_backend_replicates_across_programs():
+    backend = partitioned_backend()
+    main = MainDataCollection(backend)
+    shared = make_chunk("The exam registration for BMT and MMT closes in November", ["BMT", "MMT"], ["English"], "both")
+    main.import_chunks(CHUNKS + [shared])
+
+    assert main.count_chunks() == len(CHUNKS) + 1
+    for program in ("BMT", "MMT"):
+        results = main.search("exam registration November", k=10, degree_programs={program}, language="English")
+        assert "both" in [chunk.hash for chunk in results]
+        assert len(results) == len({chunk.uuid for chunk in results})
+
+    # The chatbot passes the program of the user as a string
+    results = main.search("exam registration November", k=10, degree_programs="BMT", language="English")
+    assert {chunk.hash for chunk in results} == {"general", "bmt", "both"}
+
+    main.delete_by_hashes(["both"])
+    assert main.count_chunks() == len(CHUNKS)
+    assert "both" not in {chunk.hash for chunk in main.search("November", k=10, degree_programs={"MMT"},
+                                                                language="English")}
+
+
+def test_most_retrieved_chunks_are_served_from_memory(monkeypatch):
+    backend = LocalBackend("Chunks", Chunk.TEXT, HashEmbeddings())
+    backend.insert_many([chunk.as_properties() for chunk in CHUNKS])
+    for obj in backend.iterate():
+        backend.update(obj.uuid, {Chunk.HITS: 10 if obj.properties[Chunk.HASH] == "bmt" else 0})
+    main = MainDataCollection(backend, embed_query=HashEmbeddings().embed_query, hot_chunks=1)
+
+    monkeypatch.setattr(main, "search_backend", None)  # A cached search must not reach the backend
+    [chunk] = main.search(CHUNKS[1].text, k=1, degree_programs={"BMT"}, language="English")
+    assert chunk.hash == "bmt"
+    monkeypatch.undo()
+
+    monkeypatch.setattr(backend.embeddings, "embed_query", None)  # A miss reuses the query vector of the cache
+    [chunk] = main.search("Prüfungsanmeldung", k=1, language="German")
+    assert chunk.hash == "german"
+    index = backend._get_index()
+    main.close()
+    assert backend._get_index() is index  # Writing the hits keeps the search index
+    hits = {obj.properties[Chunk.HASH]: obj.properties[Chunk.HITS] for obj in backend.iterate()}
+    assert hits["bmt"] == 11 and hits["german"] == 1
@@ -0,0 +1,119 @@
+import zlib
+
+import numpy as np
+
+from application.backend.datastore.backends import LocalBackend
+from application.backend.datastore.collections.main.local_index import HashEmbeddings, LocalHybridIndex, tokenize
+from application.backend.datastore.collections.main.main_data import MainDataCollection
+from application.backend.datastore.collections.main.schema import Chunk
+from application.backend.datastore.collections.main.shared_index import SharedIndexStore
+
+DIMENSIONS = 64
+
+
+def embed(text: str) -> list[float]:
+    """
+    A deterministic bag-of-words embedding, so that texts sharing words are similar.
+    """
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    for token in tokenize(text):
+        vector[zlib.crc32(token.encode()) % DIMENSIONS] += 1
+    return vector.tolist()
+
+
+def make_chunk(text: str, degree_programs: list[str], languages: list[str]) -> Chunk:
+    return Chunk(
+        text=text,
+        faculty=None,
+        target_groups=[],
+        topic=None,
+        subtopic=None,
+        title=text,
+        degree_programs=degree_programs,
+        languages=languages,
+    )
+
+
+CHUNKS = [
+    make_chunk("Exam registration for all students happens in TUMonline", [], ["English"]),
+    make_chunk("The BMT exam registration closes in November", ["BMT"], ["English"]),
+    make_chunk("The MMT exam registration closes in December", ["MMT"], ["English"]),
+    make_chunk("Die Prüfungsanmeldung erfolgt in TUMonline", [], ["German"]),
+    make_chunk("Semester abroad applications for exchange students", [], ["English"]),
+]
+
+
+def build_index() -> LocalHybridIndex:
+    return LocalHybridIndex.from_snapshot(((chunk, embed(chunk.text)) for chunk in CHUNKS), embed)
+
+
+def test_filters_match_weaviate_semantics():
+    index = build_index()
+
+    general = index.search("exam registration", k=10, language="English")
+    assert {chunk.text for chunk in general} == {CHUNKS[0].text, CHUNKS[4].text}
+
+    bmt = index.search("exam registration", k=10, degree_programs={"BMT"}, language="English")
+    assert CHUNKS[1] in bmt and CHUNKS[2] not in bmt
+
+    assert index.search("exam registration", k=10, language="French") == []
+
+
+def test_keyword_and_vector_results_are_fused():
+    index = build_index()
+
+    results = index.search("BMT exam registration", k=2, degree_programs={"BMT", "MMT"}, language="English")
+    assert results[0] is CHUNKS[1]
+
+    keyword_only = index.search("exchange", k=1, language="English", alpha=0.0)
+    assert keyword_only == [CHUNKS[4]]
+
+
+def test_query_embeddings_are_cached():
+    calls = []
+    index = LocalHybridIndex.from_snapshot(
+        ((chunk, embed(chunk.text)) for chunk in CHUNKS), lambda text: calls.append(text) or embed(text)
+    )
+    index.search("exam", language="English")
+    index.search("exam", language="English")
+    assert calls == ["exam"]
+
+
+def test_published_index_is_mapped_and_swapped(tmp_path):
+    store = SharedIndexStore(str(tmp_path))
+    assert store.current() is None
+    first = store.publish(build_index())
+
+    mapped = store.load(first, embed)
+    query = dict(k=10, degree_programs={"BMT"}, language="English")
+    assert [chunk.text for chunk in mapped.search("exam registration", **query)] == \
+           [chunk.text for chunk in build_index().search("exam registration", **query)]
+
+    second = store.publish(build_index())
+    third = store.publish(build_index())
+    assert store.current() == third
+    assert sorted(path.name for path in tmp_path.iterdir() if not path.name.startswith(".")) == \
+           sorted(["current", second, third])
+    # The replaced generation stays readable for a worker that still maps it
+    assert len(mapped.search("exam", language="English")) > 0
+
+
+def test_workers_rebuild_the_shared_index_once_after_the_corpus_changed(tmp_path):
+    embeddings = HashEmbeddings()
+    backend = LocalBackend("Invalidated", Chunk.TEXT, embeddings)
+    MainDataCollection(backend, hot_chunks=0).import_chunks(CHUNKS[:3])
+    store = SharedIndexStore(str(tmp_path))
+    workers = [
+        MainDataCollection(backend, local_search=True, embed_query=embeddings.embed_query, shared_index=store,
+                           hot_chunks=0)
+        for _ in range(2)
+    ]
+    published = store.current()
+
+    MainDataCollection(backend, hot_chunks=0).import_chunks(CHUNKS[3:])
+    workers[0].invalidate()
+    rebuilt = store.current()
+    workers[1].invalidate()  # Finds the generation rebuilt by the first worker and maps it
+
+    assert rebuilt != published and store.current() == rebuilt
+    assert [len(worker.local_index) for worker in workers] == [len(CHUNKS)] * 2
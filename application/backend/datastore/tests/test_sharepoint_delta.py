@@ -0,0 +1,147 @@
+import urllib.parse
+
+from application.backend.datastore.collections.main.sharepoint_delta import DeltaState, GraphDrive, synchronize_changes
+
+DRIVE = "https://graph.test/v1.0/drives/drive"
+
+
+class Response:
+    def __init__(self, data=None, content: bytes = b""):
+        self.data = data
+        self.content = content
+
+    def json(self):
+        return self.data
+
+    def iter_content(self, chunk_size: int):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+
+class FakeGraph:
+    """
+    A local stand-in of the Graph endpoints of one drive, recording every change for delta queries.
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.contents = {}
+        self.fields = {}
+        self.log = []  # The ids of changed items in order, a delta token is a position in it
+        self.downloads = []
+        self.folder("root", None, "")
+
+    def folder(self, item_id: str, parent: str | None, name: str):
+        self.items[item_id] = {"id": item_id, "name": name, "folder": {}, "parent": parent}
+        self.log.append(item_id)
+
+    def put(self, item_id: str, parent: str, name: str, content: bytes, fields: dict = None):
+        previous = self.items.get(item_id, {"etag": 0, "ctag": 0})
+        changed = self.contents.get(item_id) != content
+        self.items[item_id] = {"id": item_id, "name": name, "file": {}, "parent": parent,
+                               "etag": previous["etag"] + 1, "ctag": previous["ctag"] + changed}
+        self.contents[item_id] = content
+        self.fields[item_id] = {"Title": name, **(fields or {})}
+        self.log.append(item_id)
+
+    def delete(self, item_id: str):
+        self.items[item_id]["deleted"] = {}
+        self.log.append(item_id)
+
+    def path(self, item_id: str) -> str:
+        item = self.items[item_id]
+        return "" if item["parent"] is None else f"{self.path(item['parent'])}/{item['name']}"
+
+    def drive_item(self, item_id: str) -> dict:
+        item = self.items[item_id]
+        if "deleted" in item:
+            return {"id": item_id, "deleted": {}}
+        data = {"id": item_id, "name": item["name"]}
+        if item["parent"] is None:
+            data["root"] = {}
+        else:  # Like Graph's delta responses, items only refer to their parent by id
+            data["parentReference"] = {"driveId": "drive", "id": item["parent"]}
+        if "folder" in item:
+            data["folder"] = {}
+        else:
+            data.update({"file": {}, "eTag": f"e{item['etag']}", "cTag": f"c{item['ctag']}"})
+        return data
+
+    def get(self, url: str, params=None, **kwargs):
+        path = url[len(DRIVE):]
+        if path.startswith("/root/delta"):
+            token = int(path.partition("token=")[2] or 0)
+            changed = list(dict.fromkeys(self.log[token:]))
+            return Response({"value": [self.drive_item(item_id) for item_id in changed],
+                             "@odata.deltaLink": f"{DRIVE}/root/delta?token={len(self.log)}"})
+        item_id, _, resource = path[len("/items/"):].partition("/")
+        if resource == "content":
+            self.downloads.append(item_id)
+            return Response(content=self.contents[item_id])
+        if resource == "listItem":
+            web_url = f"https://sharepoint.test/Shared%20Documents{urllib.parse.quote(self.path(item_id))}"
+            return Response({"webUrl": web_url, "fields": dict(self.fields[item_id])})
+        return Response(self.drive_item(item_id))
+
+    def patch(self, url: str, data=None, **kwargs):
+        item_id = url[len(f"{DRIVE}/items/"):].partition("/")[0]
+        self.fields[item_id].update(data)
+        self.items[item_id]["etag"] += 1
+        self.log.append(item_id)
+
+
+class RecordingCollection:
+    def __init__(self):
+        self.hashes = set()
+
+    def synchronize_changes(self, changed, hashes_to_remove):
+        self.hashes -= set(hashes_to_remove)
+        for document in changed:
+            document.update_sync_status(True)
+            self.hashes.add(document.hash)
+
+
+def test_only_changed_files_are_downloaded_and_synchronized(tmp_path):
+    graph = FakeGraph()
+    graph.folder("data", "root", "Data_ChatBot")
+    graph.folder("exams", "data", "Exams")
+    graph.put("a", "exams", "registration.txt", b"Registration closes in November.")
+    graph.put("b", "data", "fees.txt", b"The semester fee is due in January.")
+    graph.put("c", "root", "unrelated.txt", b"Not below the data folder.")
+    drive = GraphDrive(graph, "drive", base_url="https://graph.test/v1.0")
+    main = RecordingCollection()
+
+    def sync():
+        graph.downloads.clear()
+        return synchronize_changes(main, drive, DeltaState(str(tmp_path)), "/Data_ChatBot")
+
+    sync()
+    assert sorted(graph.downloads) == ["a", "b"]
+    assert len(main.hashes) == 2
+    hashes = set(main.hashes)
+
+    # The sync status updates are listed once more, but the cached files are reused and nothing changes
+    sync()
+    assert graph.downloads == [] and main.hashes == hashes
+    changes = sync()
+    assert graph.downloads == [] and changes.items == {}
+
+    # Changed columns reuse the cached file, changed content is downloaded again
+    graph.put("a", "exams", "registration.txt", b"Registration closes in November.", {"Language": ["English"]})
+    graph.put("b", "data", "fees.txt", b"The semester fee is due in February.")
+    changes = sync()
+    assert graph.downloads == ["b"] and changes.cached == 1
+    assert len(main.hashes) == 2 and not main.hashes & hashes
+
+    # Files in a renamed folder are reimported under their new URL from the cached copy
+    hashes = set(main.hashes)
+    graph.folder("exams", "data", "Exam Registration")
+    changes = sync()
+    assert graph.downloads == [] and changes.paths["a"] == "/Data_ChatBot/Exam Registration/registration.txt"
+    assert len(main.hashes) == 2 and len(main.hashes & hashes) == 1
+
+    # Files of a deleted folder are removed from the vector database and the cache
+    graph.delete("exams")
+    sync()
+    assert len(main.hashes) == 1
+    assert sorted(path.name for path in (tmp_path / "files").iterdir()) == ["b.txt"]
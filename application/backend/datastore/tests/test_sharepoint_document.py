@@ -0,0 +1,85 @@
+import tempfile
+
+from application.backend.datastore.backends import LocalBackend
+from application.backend.datastore.collections.main.local_index import HashEmbeddings
+from application.backend.datastore.collections.main.main_data import MainDataCollection
+from application.backend.datastore.collections.main.schema import Chunk
+from application.backend.datastore.collections.main.sharepoint_document import SharepointDocument, split_pages
+from application.backend.datastore.collections.main.sharepoint_loader import HashingWriter
+
+
+class FakeItem:
+    def __init__(self):
+        self.fields = {SharepointDocument.TITLE: "Exam registration", SharepointDocument.LANGUAGES: ["English"]}
+        self.web_url = "https://example.com/Data_ChatBot/exams.txt"
+
+
+def test_streamed_document_has_the_same_hash_as_a_downloaded_file(tmp_path):
+    content = b"The exam registration closes in November.\n" * 1000
+    path = tmp_path / "exams.txt"
+    path.write_bytes(content)
+
+    writer = HashingWriter(tempfile.SpooledTemporaryFile(max_size=1024))
+    for start in range(0, len(content), 8192):
+        writer.write(content[start:start + 8192])
+    streamed = SharepointDocument("/exams.txt", FakeItem(), writer.buffer, writer.sha1)
+
+    assert streamed.hash == SharepointDocument(str(path), FakeItem()).hash
+    streamed.release()
+    assert streamed.content is None
+
+
+def test_pages_are_split_with_carry_over_and_page_numbers():
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    pages = [
+        "Exam registration opens in October. ",
+        "It closes in November. " * 5,
+        "",
+        "Grades are published in February.",
+    ]
+    splitter = RecursiveCharacterTextSplitter(chunk_size=60, chunk_overlap=0, add_start_index=True)
+    chunks = list(split_pages(iter(pages), splitter))
+
+    # The end of a page is carried into the next chunk, which starts on the page it was carried from
+    assert chunks[0] == ("Exam registration opens in October. It closes in November.", 1)
+    assert chunks[-2] == ("November. It closes in November. Grades are published in", 2)
+    assert chunks[-1] == ("February.", 4)
+    assert " ".join(text for text, _ in chunks).split() == " ".join(pages).split()
+
+
+class StreamedDocument:
+    def __init__(self, name: str, loaded: list):
+        self.file_path = name
+        self.hash = name
+        self.released = False
+        self.loaded = loaded
+
+    def should_reembed(self):
+        return False
+
+    def update_sync_status(self, success: bool):
+        pass
+
+    def iter_chunks(self):
+        yield Chunk(text=self.file_path, faculty=None, target_groups=[], topic=None, subtopic=None,
+                    title=self.file_path, degree_programs=[], languages=["English"], hash=self.hash)
+
+    def release(self):
+        self.released = True
+
+
+def test_documents_are_synchronized_as_they_arrive():
+    main = MainDataCollection(LocalBackend("Synchronized", Chunk.TEXT, HashEmbeddings()), hot_chunks=0)
+    loaded = []
+    main.synchronize(StreamedDocument(name, loaded) for name in ["kept", "removed"])
+
+    def source():
+        for name in ["kept", "added"]:
+            # Every document is released before the next one is loaded
+            assert all(document.released for document in loaded)
+            loaded.append(StreamedDocument(name, loaded))
+            yield loaded[-1]
+
+    assert main.synchronize(source()) == 2
+    assert main._fetch_distinct_hashes() == {"kept", "added"}
@@ -0,0 +1,140 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Buckets cover everything from a cache lookup to a long streamed answer
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0)
+
+STAGE_LATENCY = Histogram(
+    "chatbot_stage_latency_seconds",
+    "Latency of the individual stages of the chat pipeline",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+GENERATION_TTFT = Histogram(
+    "chatbot_generation_ttft_seconds",
+    "Time until the first token of the answer was generated",
+    buckets=LATENCY_BUCKETS,
+)
+FILTER_STOPS = Counter(
+    "chatbot_filter_stops_total",
+    "Number of questions that were answered by the first filter",
+    ["reason"],
+)
+CACHE_HITS = Counter(
+    "chatbot_cache_hits_total",
+    "Number of cache lookups that were served from memory",
+    ["cache"],
+)
+CACHE_MISSES = Counter(
+    "chatbot_cache_misses_total",
+    "Number of cache lookups that had to fall through to the backing store",
+    ["cache"],
+)
+LLM_TOKENS = Counter(
+    "chatbot_llm_tokens_total",
+    "Number of tokens sent to and received from the LLM",
+    ["stage", "kind"],
+)
+
+LLM_IN_FLIGHT = Gauge(
+    "chatbot_llm_in_flight",
+    "Number of LLM calls currently admitted per deployment",
+    ["deployment"],
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "chatbot_llm_queue_depth",
+    "Number of LLM calls waiting for admission",
+    ["deployment", "priority"],
+)
+LLM_QUEUE_WAIT = Histogram(
+    "chatbot_llm_queue_wait_seconds",
+    "Time LLM calls waited for admission",
+    ["deployment", "priority"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_REJECTED = Counter(
+    "chatbot_llm_rejected_total",
+    "Number of LLM calls that were not admitted",
+    ["deployment", "priority", "reason"],
+)
+
+COALESCED_REQUESTS = Counter(
+    "chatbot_coalesced_requests_total",
+    "Number of streamed questions by whether they started a pipeline (leader), attached to an identical one "
+    "in flight (follower), or could not be coalesced because they have a history (bypassed)",
+    ["role"],
+)
+
+HOT_CHUNKS = Gauge(
+    "chatbot_hot_chunks",
+    "Number of the most retrieved chunks held in the warm cache",
+)
+RETRIEVED_CHUNKS = Counter(
+    "chatbot_retrieved_chunks_total",
+    "Number of retrieved chunks by whether they are in the warm cache, the share of hot ones is its coverage",
+    ["hot"],
+)
+
+WRITE_QUEUE_DEPTH = Gauge(
+    "chatbot_write_queue_depth",
+    "Number of items waiting to be written to a table in the background",
+    ["table"],
+)
+
+SYNC_RUNS = Counter(
+    "chatbot_sync_runs_total",
+    "Number of SharePoint synchronizations by their outcome, skipped ones found another run holding the lock",
+    ["status"],
+)
+SYNC_DURATION = Histogram(
+    "chatbot_sync_duration_seconds",
+    "Duration of the SharePoint synchronizations",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200),
+)
+SYNC_RUNNING = Gauge(
+    "chatbot_sync_running",
+    "Whether a SharePoint synchronization is running in this process",
+)
+SYNC_LAST_SUCCESS = Gauge(
+    "chatbot_sync_last_success_timestamp_seconds",
+    "Unix time at which the last successful SharePoint synchronization finished",
+)
+SYNC_DOCUMENTS = Gauge(
+    "chatbot_sync_documents",
+    "Number of documents of the current or last upload to the vector database by state",
+    ["state"],
+)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """
+    Measure the duration of a pipeline stage and record it in the stage latency histogram.
+    :param stage: The name of the stage, e.g. "retrieval"
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage=stage).observe(time.perf_counter() - start)
+
+
+def record_llm_tokens(stage: str, prompt_tokens: int, completion_tokens: int):
+    """
+    Record the number of tokens used by an LLM call.
+    :param stage: The pipeline stage the call belongs to
+    :param prompt_tokens: The number of tokens in the prompt
+    :param completion_tokens: The number of tokens in the completion
+    """
+    LLM_TOKENS.labels(stage=stage, kind="prompt").inc(prompt_tokens)
+    LLM_TOKENS.labels(stage=stage, kind="completion").inc(completion_tokens)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """
+    Render all registered metrics in the Prometheus text format.
+    :return: The rendered metrics and their content type
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST